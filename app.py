@@ -1,9 +1,10 @@
 import os
 import logging
 
-from flask import Flask, send_from_directory
-from datetime import datetime, render_template, jsonify, request
+from flask import Flask, send_from_directory, render_template, jsonify, request
+from datetime import datetime
 from werkzeug.middleware.proxy_fix import ProxyFix
+from werkzeug.exceptions import HTTPException
 
 # Настройка логирования
 logging.basicConfig(level=logging.DEBUG)
@@ -41,6 +42,9 @@ def after_request(response):
 @app.errorhandler(Exception)
 def handle_exception(e):
     """Глобальный обработчик ошибок"""
+    if isinstance(e, HTTPException):
+        # 404, 405, 416 и т.д. отдаются со своим кодом и заголовками (Content-Range, Allow)
+        return e
     logger.error(f"Необработанная ошибка: {str(e)}")
     return jsonify({"error": str(e)}), 500
 
@@ -48,17 +52,37 @@ def handle_exception(e):
 from controllers.ollama_controller import ollama_bp
 from controllers.terminal_controller import terminal_bp
 from controllers.file_controller import file_bp
-from controllers.extensions_controller import extensions_bp, loaded_extensions
+from controllers.extensions_controller import extensions_bp, extension_blueprints
+from controllers.model_params_controller import model_params_bp
+from controllers.model_residency import residency_manager
+from controllers.batch_jobs import batch_jobs
 
 # Регистрируем блюпринты
 app.register_blueprint(ollama_bp)
 app.register_blueprint(terminal_bp)
 app.register_blueprint(file_bp)
 app.register_blueprint(extensions_bp)
+app.register_blueprint(model_params_bp)
 
-# Регистрируем блюпринты загруженных расширений
-for ext_id, ext_data in loaded_extensions.items():
-    app.register_blueprint(ext_data['blueprint'])
+# Регистрируем блюпринты всех установленных расширений: выключенные отвечают 404
+for ext_blueprint in extension_blueprints.values():
+    app.register_blueprint(ext_blueprint)
+
+def start_background_workers():
+    """Запуск фоновых потоков: загрузка и выгрузка моделей, исполнители пакетной генерации.
+
+    При импорте приложения потоки не запускаются. Вызывается сервером при
+    старте воркера (gunicorn.conf.py, asgi.py) и перед каждым запросом:
+    повторный вызов ничего не делает, а после fork потоки создаются заново.
+    """
+    # Предварительная загрузка моделей и выгрузка простаивающих при нехватке памяти
+    residency_manager.start()
+    # Пакеты, не выполненные до перезапуска, продолжают выполняться
+    batch_jobs.start()
+
+@app.before_request
+def ensure_background_workers():
+    start_background_workers()
 
 @app.route('/')
 def index():
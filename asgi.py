@@ -0,0 +1,487 @@
+"""ASGI-точка входа: асинхронный прокси к Ollama.
+
+Запуск: uvicorn asgi:app --workers 2
+
+Запросы /api/ollama/generate, /api/ollama/chat и ходы чат-сессий
+(/api/ollama/sessions/<id>/chat) обрабатываются в цикле asyncio через
+httpx, поэтому долгая генерация не занимает поток воркера и сотни
+запросов могут ждать Ollama одновременно. Все остальные маршруты
+выполняет Flask-приложение в ограниченном пуле потоков (WsgiBridge):
+каждый запрос в своём потоке, ответ передаётся по мере готовности.
+
+Зависимости устанавливаются отдельно: pip install ".[async]"
+"""
+import os
+import re
+import sys
+import ssl
+import json
+import time
+import asyncio
+import logging
+import tempfile
+import itertools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Optional
+
+try:
+    import httpx
+    import certifi
+except ImportError as e:
+    raise ImportError('Для асинхронного режима установите зависимости: pip install ".[async]"') from e
+
+from app import app as flask_app, start_background_workers
+from models import log_manager, LogEntry
+from controllers.ollama_client import ollama_client
+from controllers.ollama_backends import backend_pool, BackendUnavailable
+from controllers.ollama_controller import (
+    COMPLETIONS, prepare_completion, cached_completion, fit_context,
+    frame_chunk, finish_chunk, log_stream_outcome, observe_completion,
+    prepare_session_turn, session_stream_done, finish_session_turn
+)
+from controllers.completion_cache import completion_cache
+from controllers.ollama_scheduler import ollama_scheduler, SchedulerRejected
+
+# Настройка логирования
+logger = logging.getLogger(__name__)
+
+# Максимум одновременных соединений к Ollama в асинхронном режиме
+ASYNC_POOL_SIZE = int(os.environ.get("OLLAMA_ASYNC_POOL_SIZE", "256"))
+# Пул httpx перебирает все свои соединения на каждый запрос, поэтому при сотнях
+# одновременных запросов он делится на несколько небольших клиентов
+ASYNC_POOL_SHARDS = int(os.environ.get("OLLAMA_ASYNC_POOL_SHARDS", "8"))
+# Потоков для маршрутов Flask; потоковые ответы (SSE загрузки моделей, логи) занимают поток до конца
+WSGI_THREADS = int(os.environ.get("ASGI_WSGI_THREADS", "64"))
+# Тело запроса больше этого размера буферизуется на диске
+WSGI_BODY_MEMORY = 1024 * 1024
+
+
+class WsgiBridge:
+    """Выполнение WSGI-приложения (Flask) из ASGI в ограниченном пуле потоков.
+
+    asgiref.WsgiToAsgi выполняет все запросы в одном потоке
+    (sync_to_async с thread_sensitive=True), поэтому один медленный маршрут
+    задерживал остальные. Здесь каждый запрос получает свой поток из пула,
+    фрагменты ответа передаются клиенту по мере выдачи, а отключение
+    клиента закрывает итератор ответа, как в WSGI-сервере.
+    """
+
+    def __init__(self, wsgi_app, threads: int = WSGI_THREADS):
+        self.wsgi_app = wsgi_app
+        self.executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="wsgi")
+
+    @staticmethod
+    def build_environ(scope, body) -> Dict:
+        server = scope.get("server") or ("localhost", 80)
+        environ = {
+            "REQUEST_METHOD": scope["method"],
+            "SCRIPT_NAME": scope.get("root_path", "").encode("utf-8").decode("latin-1"),
+            "PATH_INFO": scope["path"].encode("utf-8").decode("latin-1"),
+            "QUERY_STRING": scope.get("query_string", b"").decode("latin-1"),
+            "SERVER_NAME": str(server[0]),
+            "SERVER_PORT": str(server[1] or 80),
+            "SERVER_PROTOCOL": f"HTTP/{scope.get('http_version', '1.1')}",
+            "wsgi.version": (1, 0),
+            "wsgi.url_scheme": scope.get("scheme", "http"),
+            "wsgi.input": body,
+            # Тело прочитано целиком, его можно читать до конца без Content-Length
+            "wsgi.input_terminated": True,
+            "wsgi.errors": sys.stderr,
+            "wsgi.multithread": True,
+            "wsgi.multiprocess": True,
+            "wsgi.run_once": False
+        }
+        if scope.get("client"):
+            environ["REMOTE_ADDR"], environ["REMOTE_PORT"] = scope["client"][0], str(scope["client"][1])
+        for name, value in scope.get("headers", []):
+            name = name.decode("latin-1").upper().replace("-", "_")
+            key = name if name in ("CONTENT_TYPE", "CONTENT_LENGTH") else f"HTTP_{name}"
+            value = value.decode("latin-1")
+            environ[key] = f"{environ[key]},{value}" if key in environ else value
+        return environ
+
+    async def __call__(self, scope, receive, send):
+        body = tempfile.SpooledTemporaryFile(max_size=WSGI_BODY_MEMORY)
+        try:
+            while True:
+                message = await receive()
+                if message["type"] == "http.disconnect":
+                    return
+                body.write(message.get("body", b""))
+                if not message.get("more_body"):
+                    break
+            body.seek(0)
+
+            disconnected = threading.Event()
+
+            async def wait_disconnect():
+                while (await receive())["type"] != "http.disconnect":
+                    pass
+                disconnected.set()
+
+            watcher = asyncio.ensure_future(wait_disconnect())
+            try:
+                loop = asyncio.get_running_loop()
+                await loop.run_in_executor(self.executor, self._run, self.build_environ(scope, body),
+                                           loop, send, disconnected)
+            finally:
+                watcher.cancel()
+        finally:
+            body.close()
+
+    def _run(self, environ, loop, send, disconnected: threading.Event):
+        """Выполнение запроса в потоке пула; сообщения ASGI отправляются через цикл событий"""
+        response = {"started": False}
+
+        def send_sync(message):
+            asyncio.run_coroutine_threadsafe(send(message), loop).result()
+
+        def start():
+            if not response["started"]:
+                response["started"] = True
+                send_sync({"type": "http.response.start", "status": response["status"],
+                           "headers": response["headers"]})
+
+        def write(data: bytes):
+            start()
+            send_sync({"type": "http.response.body", "body": data, "more_body": True})
+
+        def start_response(status, headers, exc_info=None):
+            if exc_info and response["started"]:
+                raise exc_info[1].with_traceback(exc_info[2])
+            response["status"] = int(status.split(" ", 1)[0])
+            response["headers"] = [(name.lower().encode("latin-1"), value.encode("latin-1"))
+                                   for name, value in headers]
+            return write
+
+        iterable = self.wsgi_app(environ, start_response)
+        try:
+            for chunk in iterable:
+                if disconnected.is_set():
+                    # Клиент отключился: закрытие итератора прерывает генератор Flask
+                    return
+                if chunk:
+                    write(chunk)
+            start()
+            send_sync({"type": "http.response.body", "body": b""})
+        finally:
+            close = getattr(iterable, "close", None)
+            if close is not None:
+                close()
+
+
+class AsyncOllamaProxy:
+    """ASGI-приложение: генерация — асинхронно, остальное — через Flask"""
+
+    ROUTES = {"/api/ollama/generate": "generate", "/api/ollama/chat": "chat"}
+    SESSION_CHAT = re.compile(r"/api/ollama/sessions/([^/]+)/chat")
+
+    def __init__(self, wsgi_app):
+        self.wsgi = WsgiBridge(wsgi_app)
+        # Один контекст TLS на все клиенты: загрузка сертификатов для каждого клиента
+        # при первом запросе блокировала бы цикл событий
+        self._ssl_context = ssl.create_default_context(cafile=certifi.where())
+        self._clients: Dict[str, list] = {}
+        self._next_client = itertools.count()
+
+    def _client_for(self, url: str) -> "httpx.AsyncClient":
+        clients = self._clients.get(url)
+        if clients is None:
+            shard_size = max(1, ASYNC_POOL_SIZE // ASYNC_POOL_SHARDS)
+            clients = self._clients[url] = [
+                httpx.AsyncClient(
+                    base_url=url,
+                    timeout=httpx.Timeout(ollama_client.read_timeout, connect=ollama_client.connect_timeout),
+                    verify=self._ssl_context,
+                    limits=httpx.Limits(max_connections=shard_size, max_keepalive_connections=shard_size)
+                )
+                for _ in range(ASYNC_POOL_SHARDS)
+            ]
+        return clients[next(self._next_client) % len(clients)]
+
+    async def _send_upstream(self, path: str, payload: dict, model: str, stream: bool = False,
+                             prefer: Optional[str] = None):
+        """Запрос к выбранному пулом серверу; при ошибке подключения — к следующему.
+
+        Возвращает (ответ, сервер); сервер освобождается вызывающим кодом
+        через backend_pool.release() после чтения ответа. prefer — URL
+        сервера, который выбирается, пока он доступен (KV-кэш чат-сессии).
+        """
+        tried = []
+        last_error = None
+        while True:
+            backend = backend_pool.choose(model, exclude=tried, prefer=prefer)
+            if backend is None:
+                # Все цепи разомкнуты: отказ без попытки подключения
+                raise last_error or backend_pool.unavailable()
+            backend_pool.acquire(backend)
+            client = self._client_for(backend.url)
+            try:
+                response = await client.send(client.build_request("POST", path, json=payload), stream=stream)
+            except (httpx.ConnectError, httpx.ConnectTimeout) as e:
+                backend_pool.release(backend)
+                backend_pool.mark_failed(backend, e)
+                tried.append(backend.url)
+                last_error = e
+                continue
+            except BaseException:
+                backend_pool.release(backend)
+                raise
+            backend_pool.record_success(backend)
+            return response, backend
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            await self._lifespan(receive, send)
+            return
+        session = self.SESSION_CHAT.fullmatch(scope["path"]) if scope["type"] == "http" else None
+        if scope["type"] == "http" and scope["method"] == "POST" and scope["path"] in self.ROUTES:
+            await self._completion(self.ROUTES[scope["path"]], scope, receive, send)
+        elif session is not None and scope["method"] == "POST":
+            await self._session_chat(session.group(1), scope, receive, send)
+        else:
+            await self.wsgi(scope, receive, send)
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                # Восстановление очереди пакетов читает SQLite — не в цикле событий
+                await asyncio.to_thread(start_background_workers)
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                for clients in self._clients.values():
+                    for client in clients:
+                        await client.aclose()
+                self.wsgi.executor.shutdown(wait=False)
+                log_manager.close()
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    @staticmethod
+    async def _read_body(receive) -> bytes:
+        body = b""
+        while True:
+            message = await receive()
+            body += message.get("body", b"")
+            if not message.get("more_body"):
+                return body
+
+    @staticmethod
+    async def _send_json(send, data, status: int = 200, headers=None):
+        body = json.dumps(data, ensure_ascii=False).encode("utf-8")
+        raw_headers = [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())]
+        for name, value in (headers or {}).items():
+            raw_headers.append((name.lower().encode(), str(value).encode()))
+        await send({"type": "http.response.start", "status": status, "headers": raw_headers})
+        await send({"type": "http.response.body", "body": body})
+
+    async def _rejected(self, send, action: str, error: SchedulerRejected):
+        log_manager.add_log(LogEntry(action=action, details=str(error), status="warning"))
+        await self._send_json(send, {"error": str(error), "retry_after": error.retry_after},
+                              error.status_code, {"Retry-After": error.retry_after})
+
+    async def _connection_error(self, send, action: str, error: Exception):
+        if isinstance(error, BackendUnavailable):
+            log_manager.add_log(LogEntry(action=action, details=str(error), status="warning"))
+            await self._send_json(send, {"error": str(error), "retry_after": error.retry_after},
+                                  503, {"Retry-After": error.retry_after})
+            return
+        error_msg = f"Ошибка соединения: {str(error)}"
+        log_manager.add_log(LogEntry(action=action, details=error_msg, status="error"))
+        await self._send_json(send, {"error": error_msg}, 500)
+
+    async def _read_json(self, receive):
+        try:
+            return json.loads(await self._read_body(receive) or b"null")
+        except ValueError:
+            return None
+
+    @staticmethod
+    def _wants_sse(scope, data) -> bool:
+        fmt = data.get("stream_format")
+        if fmt:
+            return fmt == "sse"
+        return "text/event-stream" in dict(scope["headers"]).get(b"accept", b"").decode("latin-1")
+
+    async def _completion(self, action: str, scope, receive, send):
+        data = await self._read_json(receive)
+        try:
+            model, payload, priority = prepare_completion(action, data)
+        except ValueError as e:
+            await self._send_json(send, {"error": str(e)}, 400)
+            return
+        # Пересказ старых ходов может обращаться к Ollama — выполняем вне цикла событий
+        payload = await asyncio.to_thread(fit_context, action, model, payload)
+
+        if data.get("stream"):
+            await self._stream(action, payload, model, priority, self._wants_sse(scope, data), receive, send)
+            return
+
+        # Кэш и список моделей обращаются к SQLite и requests — выполняем вне цикла событий
+        cache_key, cached = None, None
+        if data.get("cache"):
+            cache_key, cached = await asyncio.to_thread(cached_completion, action, model, payload, data)
+        if cached is not None:
+            await self._send_json(send, cached, headers={"X-Completion-Cache": "HIT"})
+            return
+
+        outcome = await self._generate(action, payload, model, priority, send)
+        if outcome is None:
+            return
+        result, _ = outcome
+        if cache_key:
+            await asyncio.to_thread(completion_cache.put, cache_key, model, result)
+        log_manager.add_log(LogEntry(action=action, details=COMPLETIONS[action]["success"].format(model=model),
+                                     status="success"))
+        await self._send_json(send, result)
+
+    async def _session_chat(self, session_id: str, scope, receive, send):
+        """Ход чат-сессии (см. session_chat в контроллере) без потока Flask на время генерации"""
+        data = await self._read_json(receive)
+        try:
+            # История читается из SQLite, пересказ может обращаться к Ollama — вне цикла событий
+            session, history, message, model, payload, priority = await asyncio.to_thread(
+                prepare_session_turn, session_id, data
+            )
+        except LookupError as e:
+            await self._send_json(send, {"error": str(e)}, 404)
+            return
+        except ValueError as e:
+            await self._send_json(send, {"error": str(e)}, 400)
+            return
+
+        if data.get("stream"):
+            await self._stream("chat", payload, model, priority, self._wants_sse(scope, data), receive, send,
+                               prefer=session["backend"], on_done=session_stream_done(session, history, message))
+            return
+
+        outcome = await self._generate("chat", payload, model, priority, send, prefer=session["backend"])
+        if outcome is None:
+            return
+        result, backend = outcome
+        body, status = await asyncio.to_thread(finish_session_turn, session, history, message, result, backend)
+        await self._send_json(send, body, status)
+
+    async def _generate(self, action: str, payload: dict, model: str, priority: str, send,
+                        prefer: Optional[str] = None):
+        """Обычный (не потоковый) запрос к Ollama со слотом планировщика.
+
+        Возвращает (результат, URL сервера); при ошибке отвечает клиенту сам
+        и возвращает None.
+        """
+        try:
+            waited = await ollama_scheduler.acquire_async(model, priority)
+        except SchedulerRejected as e:
+            await self._rejected(send, action, e)
+            return None
+
+        started = time.monotonic()
+        try:
+            response, backend = await self._send_upstream(f"/api/{action}", dict(payload, stream=False), model,
+                                                           prefer=prefer)
+            backend_pool.release(backend)
+        except (httpx.HTTPError, BackendUnavailable) as e:
+            await self._connection_error(send, action, e)
+            return None
+        finally:
+            ollama_scheduler.release(model, time.monotonic() - started)
+
+        if response.status_code != 200:
+            error_msg = f"{COMPLETIONS[action]['error']}: {response.status_code}"
+            log_manager.add_log(LogEntry(action=action, details=error_msg, status="error"))
+            await self._send_json(send, {"error": error_msg}, response.status_code)
+            return None
+
+        result = response.json()
+        observe_completion(model, result, wait=waited)
+        return result, backend.url
+
+    async def _stream(self, action: str, payload: dict, model: str, priority: str, sse: bool, receive, send,
+                      prefer: Optional[str] = None, on_done: Optional[Callable] = None):
+        """Потоковая ретрансляция; отключение клиента отменяет запрос к Ollama.
+
+        on_done(фрагменты, сервер) вызывается после успешного завершения генерации.
+        """
+        started = time.monotonic()
+        try:
+            waited = await ollama_scheduler.acquire_async(model, priority)
+        except SchedulerRejected as e:
+            await self._rejected(send, action, e)
+            return
+
+        slot_started = time.monotonic()
+        state = {"ttft": None, "outcome": None}
+
+        async def relay():
+            upstream, backend = await self._send_upstream(f"/api/{action}", dict(payload, stream=True), model,
+                                                          stream=True, prefer=prefer)
+            try:
+                if upstream.status_code != 200:
+                    state["outcome"] = "error"
+                    error_msg = f"{COMPLETIONS[action]['error']}: {upstream.status_code}"
+                    log_manager.add_log(LogEntry(action=action, details=error_msg, status="error"))
+                    await self._send_json(send, {"error": error_msg}, upstream.status_code)
+                    return
+
+                content_type = b"text/event-stream" if sse else b"application/x-ndjson"
+                await send({"type": "http.response.start", "status": 200, "headers": [
+                    (b"content-type", content_type), (b"cache-control", b"no-cache"), (b"x-accel-buffering", b"no")
+                ]})
+                chunks = []
+                try:
+                    async for line in upstream.aiter_lines():
+                        if not line:
+                            continue
+                        if state["ttft"] is None:
+                            state["ttft"] = (time.monotonic() - started) * 1000
+                        if on_done:
+                            chunks.append(line.encode("utf-8"))
+                        chunk, done = finish_chunk(line.encode("utf-8"), state["ttft"], model, waited)
+                        await send({"type": "http.response.body", "body": frame_chunk(chunk, sse), "more_body": True})
+                        if done:
+                            state["outcome"] = "done"
+                            break
+                    if state["outcome"] is None:
+                        raise ValueError("Ollama закрыла поток без финального фрагмента")
+                    if on_done:
+                        await asyncio.to_thread(on_done, chunks, backend.url)
+                except (httpx.HTTPError, ValueError) as e:
+                    state["outcome"] = "error"
+                    error_msg = f"Поток прерван: {str(e)}"
+                    log_manager.add_log(LogEntry(action=action, details=error_msg, status="error"))
+                    error = json.dumps({"error": error_msg, "done": True}, ensure_ascii=False).encode("utf-8")
+                    await send({"type": "http.response.body", "body": frame_chunk(error, sse), "more_body": True})
+                await send({"type": "http.response.body", "body": b""})
+            finally:
+                # Закрытие ответа (в том числе при отмене) прерывает генерацию в Ollama
+                await upstream.aclose()
+                backend_pool.release(backend)
+
+        async def wait_disconnect():
+            while (await receive())["type"] != "http.disconnect":
+                pass
+
+        relay_task = asyncio.ensure_future(relay())
+        disconnect_task = asyncio.ensure_future(wait_disconnect())
+        try:
+            await asyncio.wait({relay_task, disconnect_task}, return_when=asyncio.FIRST_COMPLETED)
+            # Выход из relay() по отмене закрывает соединение с Ollama и прерывает генерацию
+            for task in (relay_task, disconnect_task):
+                if not task.done():
+                    task.cancel()
+            await asyncio.gather(relay_task, disconnect_task, return_exceptions=True)
+            if relay_task.done() and not relay_task.cancelled() and relay_task.exception() is not None:
+                error = relay_task.exception()
+                if isinstance(error, (httpx.HTTPError, BackendUnavailable)):
+                    state["outcome"] = "error"
+                    await self._connection_error(send, action, error)
+                else:
+                    raise error
+        finally:
+            ollama_scheduler.release(model, time.monotonic() - slot_started)
+            log_stream_outcome(action, model, state["outcome"], state["ttft"])
+
+
+app = AsyncOllamaProxy(flask_app)
@@ -0,0 +1,142 @@
+"""Сравнение синхронного (gunicorn gthread) и асинхронного (uvicorn, asgi.py) режимов.
+
+Поднимается заглушка Ollama, которая отвечает на /api/generate с заданной
+задержкой, и приложение в каждом из режимов с одним воркером. Затем
+отправляется N одновременных запросов на генерацию и во время нагрузки
+замеряется задержка лёгкого маршрута, чтобы увидеть, не голодают ли
+остальные запросы.
+
+Запуск (нужны gunicorn и зависимости из ".[async]"):
+    python benchmarks/async_proxy.py --concurrency 32 128 --latency 1.0 --threads 8
+"""
+import os
+import sys
+import time
+import socket
+import asyncio
+import argparse
+import tempfile
+import subprocess
+import statistics
+import multiprocessing
+
+import httpx
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_ollama import serve_fake
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_app(mode: str, port: int, upstream: str, threads: int, workdir: str,
+              unlimited_scheduler: bool = True) -> subprocess.Popen:
+    env = dict(
+        os.environ,
+        PYTHONPATH=ROOT,
+        OLLAMA_API_URLS=upstream,
+        OLLAMA_MAX_QUEUE="100000",
+        OLLAMA_POOL_SIZE="1024",
+        OLLAMA_ASYNC_POOL_SIZE="1024"
+    )
+    if unlimited_scheduler:
+        # Планировщик не должен ограничивать замер самого прокси
+        env.update(OLLAMA_MAX_IN_FLIGHT="100000", OLLAMA_MODEL_MAX_IN_FLIGHT="100000")
+    if mode == "sync":
+        cmd = [sys.executable, "-m", "gunicorn", "main:app", "--workers", "1", "--worker-class", "gthread",
+               "--threads", str(threads), "--bind", f"127.0.0.1:{port}", "--log-level", "warning"]
+    else:
+        cmd = [sys.executable, "-m", "uvicorn", "asgi:app", "--workers", "1",
+               "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"]
+    process = subprocess.Popen(cmd, cwd=workdir, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        try:
+            httpx.get(f"http://127.0.0.1:{port}/api/ollama/scheduler/stats", timeout=1)
+            return process
+        except httpx.HTTPError:
+            time.sleep(0.2)
+    process.kill()
+    raise RuntimeError(f"Приложение в режиме {mode} не запустилось")
+
+
+async def load(base: str, upstream: str, concurrency: int):
+    """N одновременных генераций и замер задержки лёгкого маршрута во время нагрузки"""
+    # Несколько клиентов: пул одного httpx-клиента медленный при сотнях соединений
+    limits = httpx.Limits(max_connections=concurrency // 8 + 8)
+    shards = [httpx.AsyncClient(base_url=base, limits=limits, timeout=600) for _ in range(8)]
+    client = shards[0]
+    try:
+        probes = []
+        finished = asyncio.Event()
+
+        async def probe():
+            while not finished.is_set():
+                started = time.perf_counter()
+                await client.get("/api/ollama/scheduler/stats")
+                probes.append(time.perf_counter() - started)
+                await asyncio.sleep(0.1)
+
+        async def generate(i):
+            response = await shards[i % len(shards)].post("/api/ollama/generate", json={"model": "bench", "prompt": f"p{i}"})
+            return response.status_code
+
+        # Прогрев: соединения с Ollama и ленивые инициализации приложения
+        await generate(-1)
+
+        probe_task = asyncio.create_task(probe())
+        await client.get(f"{upstream}/__bench/peak")
+        started = time.perf_counter()
+        codes = await asyncio.gather(*(generate(i) for i in range(concurrency)))
+        elapsed = time.perf_counter() - started
+        finished.set()
+        await probe_task
+        peak = (await client.get(f"{upstream}/__bench/peak")).json()["peak"]
+    finally:
+        for shard in shards:
+            await shard.aclose()
+    return elapsed, codes, probes, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[32, 128])
+    parser.add_argument("--latency", type=float, default=1.0, help="задержка ответа заглушки Ollama, с")
+    parser.add_argument("--threads", type=int, default=8, help="потоков в синхронном воркере gunicorn")
+    parser.add_argument("--modes", nargs="+", default=["sync", "async"], choices=["sync", "async"])
+    args = parser.parse_args()
+
+    upstream = f"http://127.0.0.1:{free_port()}"
+    fake = multiprocessing.Process(target=serve_fake, args=(int(upstream.rsplit(":", 1)[1]), args.latency),
+                                   daemon=True)
+    fake.start()
+
+    print(f"Задержка Ollama {args.latency:.1f} с, 1 воркер, {args.threads} потоков в режиме sync")
+    print(f"{'режим':<6} {'запросов':>8} {'время, с':>9} {'запр/с':>8} {'пик к Ollama':>13} "
+          f"{'проба p50, мс':>14} {'проба max, мс':>14} {'ошибок':>7}")
+    for mode in args.modes:
+        workdir = tempfile.mkdtemp(prefix=f"bench_{mode}_")
+        port = free_port()
+        process = start_app(mode, port, upstream, args.threads, workdir)
+        try:
+            for concurrency in args.concurrency:
+                elapsed, codes, probes, peak = asyncio.run(load(f"http://127.0.0.1:{port}", upstream, concurrency))
+                errors = sum(1 for code in codes if code != 200)
+                probe_ms = [p * 1000 for p in probes] or [0.0]
+                print(f"{mode:<6} {concurrency:>8} {elapsed:>9.2f} {concurrency / elapsed:>8.1f} "
+                      f"{peak:>13} {statistics.median(probe_ms):>14.1f} {max(probe_ms):>14.1f} {errors:>7}")
+        finally:
+            process.terminate()
+            process.wait(timeout=10)
+    fake.terminate()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+"""Рост пропускной способности с числом серверов Ollama.
+
+Каждый сервер-заглушка выполняет одну генерацию за раз с заданной
+задержкой (как Ollama на одном GPU). Запросы идут через приложение с
+пулом серверов (OLLAMA_API_URLS); пропускная способность должна расти
+пропорционально числу серверов.
+
+Запуск (нужны зависимости из ".[async]"):
+    python benchmarks/backend_pool.py --backends 1 2 4 --requests 64 --latency 0.2
+"""
+import os
+import sys
+import time
+import asyncio
+import argparse
+import tempfile
+import multiprocessing
+
+import httpx
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from async_proxy import serve_fake, free_port, start_app
+
+
+async def drive(base: str, requests: int, concurrency: int) -> float:
+    semaphore = asyncio.Semaphore(concurrency)
+    async with httpx.AsyncClient(base_url=base, timeout=600) as client:
+        async def generate(i):
+            async with semaphore:
+                response = await client.post("/api/ollama/generate", json={"model": "bench", "prompt": f"p{i}"})
+                response.raise_for_status()
+
+        await generate(-1)
+        started = time.perf_counter()
+        await asyncio.gather(*(generate(i) for i in range(requests)))
+        return time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--backends", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--requests", type=int, default=64)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--latency", type=float, default=0.2, help="время одной генерации на заглушке, с")
+    parser.add_argument("--mode", default="async", choices=["sync", "async"])
+    args = parser.parse_args()
+
+    print(f"Генерация {args.latency:.2f} с, {args.requests} запросов, {args.concurrency} одновременно, режим {args.mode}")
+    print(f"{'серверов':>8} {'время, с':>9} {'запр/с':>8} {'ускорение':>10}")
+    baseline = None
+    for count in args.backends:
+        ports = [free_port() for _ in range(count)]
+        fakes = [multiprocessing.Process(target=serve_fake, args=(port, args.latency, 1), daemon=True) for port in ports]
+        for fake in fakes:
+            fake.start()
+        urls = ",".join(f"http://127.0.0.1:{port}" for port in ports)
+        os.environ["OLLAMA_API_URLS"] = urls
+        # Лимиты планировщика по умолчанию: 2 запроса к модели на сервер
+        os.environ.pop("OLLAMA_MODEL_MAX_IN_FLIGHT", None)
+
+        app_port = free_port()
+        process = start_app(args.mode, app_port, urls, 32, tempfile.mkdtemp(prefix="bench_pool_"),
+                            unlimited_scheduler=False)
+        try:
+            elapsed = asyncio.run(drive(f"http://127.0.0.1:{app_port}", args.requests, args.concurrency))
+        finally:
+            process.terminate()
+            process.wait(timeout=10)
+            for fake in fakes:
+                fake.terminate()
+        rate = args.requests / elapsed
+        baseline = baseline or rate
+        print(f"{count:>8} {elapsed:>9.2f} {rate:>8.1f} {rate / baseline:>9.2f}x")
+
+
+if __name__ == "__main__":
+    main()
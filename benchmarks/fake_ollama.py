@@ -0,0 +1,222 @@
+"""Детерминированная заглушка Ollama для бенчмарков и ручной проверки без GPU.
+
+Реализует /api/version, /api/tags, /api/ps, /api/show, /api/generate,
+/api/chat (обычные и потоковые ответы) и /api/pull (поток прогресса).
+Текст ответа зависит только от запроса, тайминги задаются параметрами:
+задержка до первого токена, скорость генерации в токенах в секунду и
+число токенов в ответе. Пик одновременных генераций доступен по
+GET /__bench/peak (с обнулением).
+
+Запуск отдельно:
+    python benchmarks/fake_ollama.py --port 11434 --latency 0.05 --token-rate 200 --tokens 32
+"""
+import sys
+import json
+import time
+import hashlib
+import argparse
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+WORDS = ("альфа", "бета", "гамма", "дельта", "эпсилон", "дзета", "эта", "тета",
+         "йота", "каппа", "лямбда", "мю", "ню", "кси", "омикрон", "пи")
+
+
+def reply_tokens(material: str, count: int):
+    """Токены ответа, однозначно определяемые текстом запроса"""
+    digest = hashlib.sha256(material.encode("utf-8")).digest()
+    return [WORDS[digest[i % len(digest)] % len(WORDS)] + " " for i in range(count)]
+
+
+class FakeOllama(BaseHTTPRequestHandler):
+    """Заглушка Ollama: отвечает на генерацию после задержки и считает одновременные запросы"""
+
+    protocol_version = "HTTP/1.1"
+    # Задержка до первого токена (загрузка модели и обработка промпта), с
+    latency = 1.0
+    # Токенов в ответе и скорость их выдачи (0 — все сразу после latency)
+    tokens = 1
+    token_rate = 0.0
+    models = ("bench:latest",)
+    # Сколько генераций сервер выполняет одновременно (None — без ограничения)
+    slots = None
+    lock = threading.Lock()
+    active = 0
+    peak = 0
+
+    def log_message(self, *args):
+        pass
+
+    def _send(self, payload, code=200):
+        body = json.dumps(payload, ensure_ascii=False).encode()
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _start_stream(self):
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+    def _chunk(self, payload):
+        data = json.dumps(payload, ensure_ascii=False).encode() + b"\n"
+        self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+        self.wfile.flush()
+
+    def _end_stream(self):
+        self.wfile.write(b"0\r\n\r\n")
+
+    def do_GET(self):
+        cls = type(self)
+        if self.path == "/__bench/peak":
+            # Пик одновременных запросов с прошлого вызова
+            with cls.lock:
+                peak, cls.peak = cls.peak, cls.active
+            self._send({"peak": peak})
+        elif self.path == "/api/tags":
+            self._send({"models": [
+                {"name": name, "model": name, "digest": hashlib.sha256(name.encode()).hexdigest(), "size": 1}
+                for name in cls.models
+            ]})
+        elif self.path == "/api/ps":
+            self._send({"models": [
+                {"name": name, "model": name, "size": 1, "size_vram": 0, "expires_at": "2100-01-01T00:00:00Z"}
+                for name in cls.models
+            ]})
+        else:
+            self._send({"version": "bench"})
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        try:
+            request = json.loads(body or b"{}")
+        except ValueError:
+            self._send({"error": "invalid JSON"}, 400)
+            return
+        if self.path in ("/api/generate", "/api/chat"):
+            self._generate(request, chat=self.path == "/api/chat")
+        elif self.path == "/api/pull":
+            self._pull(request)
+        elif self.path == "/api/show":
+            self._send({"modelfile": "", "parameters": "", "details": {"format": "gguf"}})
+        else:
+            self._send({"error": "not found"}, 404)
+
+    def _generate(self, request, chat: bool):
+        cls = type(self)
+        with cls.lock:
+            cls.active += 1
+            cls.peak = max(cls.peak, cls.active)
+        try:
+            if cls.slots is not None:
+                with cls.slots:
+                    self._respond(request, chat)
+            else:
+                self._respond(request, chat)
+        finally:
+            with cls.lock:
+                cls.active -= 1
+
+    def _respond(self, request, chat: bool):
+        cls = type(self)
+        started = time.perf_counter()
+        material = json.dumps(request.get("messages") if chat else request.get("prompt"), ensure_ascii=False)
+        # Пустой запрос — загрузка или выгрузка модели (keep_alive), ответ без текста
+        empty = not request.get("messages" if chat else "prompt")
+        tokens = [] if empty else reply_tokens(material, cls.tokens)
+        model = request.get("model", cls.models[0])
+        time.sleep(cls.latency)
+        prompt_done = time.perf_counter()
+
+        def piece(token):
+            if chat:
+                return {"message": {"role": "assistant", "content": token}}
+            return {"response": token}
+
+        def final():
+            now = time.perf_counter()
+            result = dict(piece(""), model=model, done=True, done_reason="stop",
+                          total_duration=int((now - started) * 1e9), load_duration=0,
+                          prompt_eval_count=len(material) // 4 + 1,
+                          prompt_eval_duration=int((prompt_done - started) * 1e9) or 1,
+                          eval_count=len(tokens), eval_duration=int((now - prompt_done) * 1e9) or 1)
+            if not chat:
+                result["context"] = [1, 2, 3]
+            return result
+
+        delay = 1.0 / cls.token_rate if cls.token_rate else 0.0
+        if request.get("stream", True):
+            self._start_stream()
+            for token in tokens:
+                if delay:
+                    time.sleep(delay)
+                self._chunk(dict(piece(token), model=model, done=False))
+            self._chunk(final())
+            self._end_stream()
+            return
+
+        if delay:
+            time.sleep(delay * len(tokens))
+        result = final()
+        if chat:
+            result["message"]["content"] = "".join(tokens)
+        else:
+            result["response"] = "".join(tokens)
+        self._send(result)
+
+    def _pull(self, request):
+        """Поток прогресса загрузки: один слой, десять шагов"""
+        cls = type(self)
+        total = 10 * 1024 * 1024
+        self._start_stream()
+        self._chunk({"status": "pulling manifest"})
+        for step in range(1, 11):
+            time.sleep(cls.latency / 10)
+            self._chunk({"status": "pulling bench", "digest": "sha256:bench", "total": total,
+                         "completed": total * step // 10})
+        self._chunk({"status": "success"})
+        self._end_stream()
+
+
+class _Server(ThreadingHTTPServer):
+    # Очередь соединений по умолчанию (5) сама ограничила бы параллелизм
+    request_queue_size = 1024
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # Клиент закрыл соединение (отмена потока, проверка доступности) — не ошибка заглушки
+        if not isinstance(sys.exc_info()[1], (ConnectionResetError, BrokenPipeError)):
+            super().handle_error(request, client_address)
+
+
+def serve_fake(port: int, latency: float, capacity: int = None, tokens: int = 1, token_rate: float = 0.0,
+               models=None):
+    """Заглушка работает в отдельном процессе, чтобы не делить GIL с генератором нагрузки"""
+    FakeOllama.latency = latency
+    FakeOllama.tokens = tokens
+    FakeOllama.token_rate = token_rate
+    if models:
+        FakeOllama.models = tuple(models)
+    if capacity:
+        FakeOllama.slots = threading.Semaphore(capacity)
+    _Server(("127.0.0.1", port), FakeOllama).serve_forever()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=11434)
+    parser.add_argument("--latency", type=float, default=0.05, help="задержка до первого токена, с")
+    parser.add_argument("--tokens", type=int, default=32, help="токенов в ответе")
+    parser.add_argument("--token-rate", type=float, default=200.0, help="токенов в секунду (0 — без задержки)")
+    parser.add_argument("--capacity", type=int, default=None, help="одновременных генераций")
+    parser.add_argument("--models", nargs="+", default=["bench:latest"])
+    args = parser.parse_args()
+    print(f"Заглушка Ollama на http://127.0.0.1:{args.port}")
+    serve_fake(args.port, args.latency, args.capacity, args.tokens, args.token_rate, args.models)
+
+
+if __name__ == "__main__":
+    main()
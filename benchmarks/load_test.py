@@ -0,0 +1,200 @@
+"""Нагрузочный прогон всех блюпринтов приложения с заглушкой Ollama.
+
+Поднимается заглушка Ollama (benchmarks/fake_ollama.py) и приложение в
+выбранном режиме, затем каждый сценарий (маршруты ollama, file, terminal,
+extensions и ext/system_monitor) выполняется заданным числом запросов с
+фиксированным числом одновременных клиентов. Для каждого сценария
+выводятся запросы в секунду, p50 и p99 задержки и число ошибок.
+
+Результаты можно сохранить (--save) и сравнить с сохранёнными ранее
+(--baseline): сценарий, у которого p99 вырос или пропускная способность
+упала больше чем на --tolerance, считается регрессией, и скрипт
+завершается с кодом 1.
+
+Запуск (нужны gunicorn и зависимости из ".[async]"):
+    python benchmarks/load_test.py --mode sync --concurrency 16 --requests 400
+    python benchmarks/load_test.py --save bench.json
+    python benchmarks/load_test.py --baseline bench.json --tolerance 0.2
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import tempfile
+import multiprocessing
+
+import httpx
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_ollama import serve_fake
+from async_proxy import free_port, start_app
+
+MODEL = "bench:latest"
+
+# (блюпринт, сценарий, метод, путь, тело JSON, доля от --requests)
+SCENARIOS = [
+    ("ollama", "status", "GET", "/api/ollama/status", None, 1.0),
+    ("ollama", "models", "GET", "/api/ollama/models", None, 1.0),
+    ("ollama", "generate", "POST", "/api/ollama/generate", {"model": MODEL, "prompt": "{i}"}, 1.0),
+    ("ollama", "generate_stream", "POST", "/api/ollama/generate",
+     {"model": MODEL, "prompt": "{i}", "stream": True}, 1.0),
+    ("ollama", "chat", "POST", "/api/ollama/chat",
+     {"model": MODEL, "messages": [{"role": "user", "content": "{i}"}]}, 1.0),
+    ("ollama", "generate_cached", "POST", "/api/ollama/generate",
+     {"model": MODEL, "prompt": "кэш", "cache": True, "options": {"temperature": 0}}, 1.0),
+    ("ollama", "logs", "GET", "/api/ollama/logs?limit=100", None, 1.0),
+    ("ollama", "metrics", "GET", "/api/ollama/metrics", None, 1.0),
+    ("file", "list", "GET", "/api/file/list?path=.", None, 1.0),
+    ("file", "read", "GET", "/api/file/read?path=app.py", None, 1.0),
+    ("file", "self", "GET", "/api/file/self", None, 0.25),
+    ("terminal", "execute", "POST", "/api/terminal/execute", {"command": "echo {i}"}, 0.25),
+    ("extensions", "list", "GET", "/api/extensions/list", None, 1.0),
+    ("ext/system_monitor", "info", "GET", "/api/ext/system_monitor/info", None, 1.0),
+    # Замер загрузки CPU внутри маршрута занимает полсекунды
+    ("ext/system_monitor", "system-info", "GET", "/api/ext/system_monitor/system-info", None, 0.1),
+    ("ext/system_monitor", "processes", "GET", "/api/ext/system_monitor/processes", None, 0.25),
+    ("ext/system_monitor", "network", "GET", "/api/ext/system_monitor/network", None, 1.0),
+]
+
+
+def _fill(body, i: int):
+    """Подстановка номера запроса в тело, чтобы запросы не совпадали"""
+    if body is None:
+        return None
+    return json.loads(json.dumps(body, ensure_ascii=False).replace("{i}", str(i)))
+
+
+def percentile(values, q: float) -> float:
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))]
+
+
+async def run_scenario(client: httpx.AsyncClient, method: str, path: str, body, requests: int,
+                       concurrency: int):
+    """requests запросов, concurrency одновременно; возвращает (время, задержки, ошибки)"""
+    latencies = []
+    errors = 0
+    counter = iter(range(requests))
+
+    async def worker():
+        nonlocal errors
+        for i in counter:
+            started = time.perf_counter()
+            try:
+                # Ответ читается целиком, включая потоковые
+                response = await client.request(method, path, json=_fill(body, i))
+                if response.status_code >= 400:
+                    errors += 1
+            except httpx.HTTPError:
+                errors += 1
+            latencies.append(time.perf_counter() - started)
+
+    # Прогрев: ленивые инициализации и соединения с Ollama
+    await client.request(method, path, json=_fill(body, -1))
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return time.perf_counter() - started, latencies, errors
+
+
+async def run_all(base: str, scenarios, requests: int, concurrency: int):
+    limits = httpx.Limits(max_connections=concurrency * 2)
+    results = []
+    async with httpx.AsyncClient(base_url=base, limits=limits, timeout=120) as client:
+        for blueprint, name, method, path, body, share in scenarios:
+            count = max(concurrency, int(requests * share))
+            elapsed, latencies, errors = await run_scenario(client, method, path, body, count, concurrency)
+            results.append({
+                "blueprint": blueprint,
+                "scenario": name,
+                "requests": count,
+                "rps": count / elapsed if elapsed else 0.0,
+                "p50_ms": percentile(latencies, 0.5) * 1000,
+                "p99_ms": percentile(latencies, 0.99) * 1000,
+                "errors": errors
+            })
+            print_row(results[-1])
+    return results
+
+
+def print_row(row):
+    print(f"{row['blueprint']:<19} {row['scenario']:<16} {row['requests']:>8} {row['rps']:>9.1f} "
+          f"{row['p50_ms']:>9.1f} {row['p99_ms']:>9.1f} {row['errors']:>7}", flush=True)
+
+
+def compare(results, baseline, tolerance: float):
+    """Регрессии относительно сохранённого прогона"""
+    previous = {(row["blueprint"], row["scenario"]): row for row in baseline["results"]}
+    regressions = []
+    for row in results:
+        old = previous.get((row["blueprint"], row["scenario"]))
+        if old is None:
+            continue
+        if old["p99_ms"] and row["p99_ms"] > old["p99_ms"] * (1 + tolerance):
+            regressions.append(f"{row['blueprint']}/{row['scenario']}: p99 {old['p99_ms']:.1f} → {row['p99_ms']:.1f} мс")
+        if old["rps"] and row["rps"] < old["rps"] * (1 - tolerance):
+            regressions.append(f"{row['blueprint']}/{row['scenario']}: {old['rps']:.1f} → {row['rps']:.1f} запр/с")
+        if row["errors"] > old["errors"]:
+            regressions.append(f"{row['blueprint']}/{row['scenario']}: ошибок {old['errors']} → {row['errors']}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mode", default="sync", choices=["sync", "async"])
+    parser.add_argument("--threads", type=int, default=16, help="потоков в синхронном воркере gunicorn")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--requests", type=int, default=400, help="запросов на сценарий")
+    parser.add_argument("--latency", type=float, default=0.02, help="задержка до первого токена заглушки, с")
+    parser.add_argument("--tokens", type=int, default=16, help="токенов в ответе заглушки")
+    parser.add_argument("--token-rate", type=float, default=1000.0, help="токенов в секунду у заглушки")
+    parser.add_argument("--only", nargs="+", help="только эти блюпринты")
+    parser.add_argument("--save", help="сохранить результаты в JSON")
+    parser.add_argument("--baseline", help="сравнить с сохранёнными результатами")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="допустимое ухудшение (доля)")
+    args = parser.parse_args()
+
+    scenarios = [s for s in SCENARIOS if not args.only or s[0] in args.only]
+    upstream_port = free_port()
+    fake = multiprocessing.Process(
+        target=serve_fake,
+        args=(upstream_port, args.latency, None, args.tokens, args.token_rate, [MODEL]),
+        daemon=True
+    )
+    fake.start()
+
+    workdir = tempfile.mkdtemp(prefix="bench_load_")
+    port = free_port()
+    # Планировщик не ограничивается: замеряются накладные расходы приложения
+    process = start_app(args.mode, port, f"http://127.0.0.1:{upstream_port}", args.threads, workdir)
+    print(f"Режим {args.mode}, {args.concurrency} одновременных клиентов, заглушка Ollama: "
+          f"{args.latency * 1000:.0f} мс до первого токена, {args.tokens} токенов по {args.token_rate:.0f}/с")
+    print(f"{'блюпринт':<19} {'сценарий':<16} {'запросов':>8} {'запр/с':>9} {'p50, мс':>9} {'p99, мс':>9} {'ошибок':>7}")
+    try:
+        results = asyncio.run(run_all(f"http://127.0.0.1:{port}", scenarios, args.requests, args.concurrency))
+    finally:
+        process.terminate()
+        process.wait(timeout=10)
+        fake.terminate()
+
+    report = {"mode": args.mode, "concurrency": args.concurrency, "results": results}
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        if regressions:
+            print("Регрессии:")
+            for line in regressions:
+                print(f"  {line}")
+            sys.exit(1)
+        print("Регрессий нет")
+
+
+if __name__ == "__main__":
+    main()
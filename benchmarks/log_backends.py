@@ -0,0 +1,112 @@
+"""Сравнение хранилищ логов: JSON Lines журнал и SQLite.
+
+Замеряется скорость вставки пачками, загрузки окна последних записей
+(старт приложения) и выборок с фильтрами по всей истории.
+
+Запуск:
+    python benchmarks/log_backends.py --sizes 10000 100000 1000000
+"""
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from log_storage import LogJournal, SQLiteLogBackend
+
+ACTIONS = ["get_models", "list_files", "read_file", "check_status", "terminal_command", "generate", "chat"]
+STATUSES = ["info", "success", "warning", "error"]
+
+
+def make_records(count: int):
+    """Детерминированный набор записей с равномерным временем"""
+    base = datetime(2025, 1, 1)
+    for seq in range(1, count + 1):
+        yield {
+            "seq": seq,
+            "action": ACTIONS[seq % len(ACTIONS)],
+            "details": f"Тестовое событие номер {seq} для проверки производительности хранилища",
+            "status": STATUSES[seq % len(STATUSES)],
+            "timestamp": (base + timedelta(seconds=seq)).isoformat()
+        }
+
+
+def make_backend(kind: str, directory: str):
+    if kind == "jsonl":
+        return LogJournal(os.path.join(directory, "logs.jsonl"), max_entries=10000)
+    return SQLiteLogBackend(os.path.join(directory, "logs.db"))
+
+
+def timed(func, repeat: int = 1):
+    started = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    return (time.perf_counter() - started) / repeat
+
+
+def run(kind: str, count: int, batch_size: int, repeat: int):
+    directory = tempfile.mkdtemp(prefix=f"bench_{kind}_")
+    try:
+        backend = make_backend(kind, directory)
+
+        batch = []
+        started = time.perf_counter()
+        for record in make_records(count):
+            batch.append(record)
+            if len(batch) >= batch_size:
+                if backend.append(batch):
+                    backend.maintain()
+                batch = []
+        if batch and backend.append(batch):
+            backend.maintain()
+        insert_time = time.perf_counter() - started
+        backend.close()
+
+        backend = make_backend(kind, directory)
+        load_time = timed(lambda: backend.load_recent(10000))
+
+        middle = (datetime(2025, 1, 1) + timedelta(seconds=count // 2)).isoformat()
+        window_end = (datetime(2025, 1, 1) + timedelta(seconds=count // 2 + 600)).isoformat()
+        queries = {
+            "action+status, limit 50": lambda: list(backend.query(action="chat", status="error", limit=50)),
+            "старые записи, limit 50": lambda: list(backend.query(before_seq=count // 10, limit=50)),
+            "интервал 10 минут": lambda: list(backend.query(start=middle, end=window_end)),
+            "редкое значение, без limit": lambda: list(backend.query(action="read_file", status="warning",
+                                                                      before_seq=count // 100)),
+        }
+        query_times = {name: timed(query, repeat) for name, query in queries.items()}
+        backend.close()
+
+        return {
+            "insert_per_sec": count / insert_time,
+            "load_recent_ms": load_time * 1000,
+            "queries_ms": {name: value * 1000 for name, value in query_times.items()}
+        }
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк хранилищ логов")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000, 1000000])
+    parser.add_argument("--backends", nargs="+", default=["jsonl", "sqlite"])
+    parser.add_argument("--batch-size", type=int, default=100)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    for count in args.sizes:
+        print(f"\n=== {count} записей ===")
+        for kind in args.backends:
+            result = run(kind, count, args.batch_size, args.repeat)
+            print(f"[{kind}] вставка: {result['insert_per_sec']:,.0f} зап/с, "
+                  f"загрузка окна: {result['load_recent_ms']:.1f} мс")
+            for name, value in result["queries_ms"].items():
+                print(f"    {name}: {value:.2f} мс")
+
+
+if __name__ == "__main__":
+    main()
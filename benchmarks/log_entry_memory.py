@@ -0,0 +1,106 @@
+"""Память и скорость сериализации записей лога: прежний LogEntry с __dict__
+против компактного LogEntry со __slots__.
+
+Запуск:
+    python benchmarks/log_entry_memory.py --count 100000
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import tracemalloc
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# models при импорте создаёт глобальный log_manager в текущем каталоге
+os.chdir(tempfile.mkdtemp(prefix="bench_log_entry_"))
+
+from models import LogEntry, iter_json
+
+ACTIONS = ["get_models", "list_files", "read_file", "check_status", "terminal_command", "generate", "chat"]
+STATUSES = ["info", "success", "warning", "error"]
+
+
+class DictLogEntry:
+    """Прежнее представление записи: обычный объект с __dict__ и ISO-строкой времени"""
+
+    def __init__(self, action, details, status="info", timestamp=None, seq=None):
+        self.action = action
+        self.details = details
+        self.status = status
+        self.timestamp = timestamp or datetime.now().isoformat()
+        self.seq = seq
+
+    def to_dict(self):
+        return {
+            "seq": self.seq,
+            "action": self.action,
+            "details": self.details,
+            "status": self.status,
+            "timestamp": self.timestamp
+        }
+
+
+def make_lines(count: int):
+    """Строки журнала; каждая разбирается заново, как при загрузке с диска"""
+    base = datetime(2025, 1, 1)
+    return [json.dumps({
+        "seq": seq,
+        "action": ACTIONS[seq % len(ACTIONS)],
+        "details": f"Событие {seq}",
+        "status": STATUSES[seq % len(STATUSES)],
+        "timestamp": (base + timedelta(seconds=seq, microseconds=seq % 999983)).isoformat()
+    }) for seq in range(1, count + 1)]
+
+
+def measure_memory(cls, lines):
+    tracemalloc.start()
+    entries = []
+    for line in lines:
+        data = json.loads(line)
+        entries.append(cls(data["action"], data["details"], data["status"], data["timestamp"], data["seq"]))
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return entries, current
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк представления записей лога")
+    parser.add_argument("--count", type=int, default=100000)
+    args = parser.parse_args()
+
+    lines = make_lines(args.count)
+
+    dict_entries, dict_memory = measure_memory(DictLogEntry, lines)
+    slot_entries, slot_memory = measure_memory(LogEntry, lines)
+
+    print(f"Записей: {args.count}")
+    print(f"Память, __dict__: {dict_memory / 1024 / 1024:.1f} МБ ({dict_memory / args.count:.0f} Б/запись)")
+    print(f"Память, __slots__: {slot_memory / 1024 / 1024:.1f} МБ ({slot_memory / args.count:.0f} Б/запись)")
+
+    tracemalloc.start()
+    started = time.perf_counter()
+    json.dumps([entry.to_dict() for entry in dict_entries])
+    dict_time = time.perf_counter() - started
+    _, dict_peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    tracemalloc.start()
+    started = time.perf_counter()
+    for _ in iter_json(slot_entries):
+        pass
+    stream_time = time.perf_counter() - started
+    _, stream_peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    print(f"Сериализация to_dict + json.dumps: {args.count / dict_time:,.0f} зап/с, "
+          f"пик памяти {dict_peak / 1024 / 1024:.1f} МБ")
+    print(f"Потоковая сериализация iter_json: {args.count / stream_time:,.0f} зап/с, "
+          f"пик памяти {stream_peak / 1024:.1f} КБ")
+
+
+if __name__ == "__main__":
+    main()
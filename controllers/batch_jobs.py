@@ -0,0 +1,460 @@
+import os
+import json
+import time
+import uuid
+import sqlite3
+import logging
+import threading
+from typing import Callable, Dict, Iterator, List, Optional
+
+import requests
+
+from models import log_manager, LogEntry
+from controllers.ollama_backends import BackendUnavailable
+from controllers.ollama_scheduler import SchedulerRejected
+
+# Настройка логирования
+logger = logging.getLogger(__name__)
+
+# Сколько элементов пакетов выполняется одновременно (на все воркеры вместе)
+BATCH_CONCURRENCY = int(os.environ.get("OLLAMA_BATCH_CONCURRENCY", "4"))
+BATCH_MAX_ITEMS = int(os.environ.get("OLLAMA_BATCH_MAX_ITEMS", "10000"))
+# Попыток на элемент при ошибках подключения и ответах 5xx
+BATCH_MAX_ATTEMPTS = int(os.environ.get("OLLAMA_BATCH_MAX_ATTEMPTS", "3"))
+# Как часто свободный поток проверяет очередь, в которую могли добавить задачи другие воркеры
+BATCH_POLL_INTERVAL = 2.0
+
+FINAL_STATUSES = ("done", "failed", "cancelled")
+
+
+class BatchItemError(Exception):
+    """Ошибка выполнения элемента пакета; retryable — можно повторить позже"""
+
+    def __init__(self, message: str, retryable: bool = False):
+        super().__init__(message)
+        self.retryable = retryable
+
+
+class BatchJobManager:
+    """Очередь пакетной генерации, сохраняемая в SQLite.
+
+    Пакет — набор запросов generate/chat (строки JSONL). Задача и её
+    элементы хранятся в базе, общей для всех воркеров, поэтому клиенту не
+    нужно держать соединение, а после перезапуска выполнение продолжается:
+    элементы, захваченные завершившимся процессом, возвращаются в очередь.
+    Потоки-исполнители захватывают элементы по одному в транзакции, и
+    одновременно выполняется не больше OLLAMA_BATCH_CONCURRENCY элементов
+    на все воркеры. Запросы идут в планировщик с приоритетом batch, поэтому
+    интерактивные запросы обслуживаются раньше. Ошибки подключения и ответы
+    5xx повторяются с паузой, недоступность всех серверов (разомкнутые
+    цепи) не расходует попытки. Сам запрос к Ollama выполняет обработчик,
+    который задаёт контроллер (set_handler).
+    """
+
+    def __init__(self, path: Optional[str] = None, concurrency: int = BATCH_CONCURRENCY):
+        self.path = path or os.environ.get("BATCH_JOBS_PATH", "batch_jobs.db")
+        self.concurrency = max(1, concurrency)
+
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+        self._pid = None
+        self._threads: List[threading.Thread] = []
+        self._threads_pid = None
+        self._wakeup = threading.Event()
+        # Элементы, которые выполняет этот процесс
+        self._inflight: set = set()
+        self._handler: Optional[Callable[[str, Dict], Dict]] = None
+
+    def set_handler(self, handler: Callable[[str, Dict], Dict]):
+        """Обработчик элемента: handler(action, request) возвращает ответ Ollama"""
+        self._handler = handler
+
+    def _connection(self) -> sqlite3.Connection:
+        # Соединение не наследуется от родительского процесса после fork
+        if self._conn is None or self._pid != os.getpid():
+            self._conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False, isolation_level=None)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS batch_jobs ("
+                "id TEXT PRIMARY KEY, status TEXT NOT NULL, total INTEGER NOT NULL, "
+                "created REAL NOT NULL, finished REAL)"
+            )
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS batch_items ("
+                "id INTEGER PRIMARY KEY, job_id TEXT NOT NULL, idx INTEGER NOT NULL, "
+                "action TEXT NOT NULL, request TEXT NOT NULL, status TEXT NOT NULL, "
+                "response TEXT, error TEXT, attempts INTEGER NOT NULL DEFAULT 0, "
+                "not_before REAL NOT NULL DEFAULT 0, worker INTEGER, started REAL, finished REAL, "
+                "done_order INTEGER, UNIQUE (job_id, idx))"
+            )
+            # Индекс по статусу упорядочен по rowid: элементы берутся в порядке поступления
+            self._conn.execute("CREATE INDEX IF NOT EXISTS batch_items_status ON batch_items (status)")
+            self._pid = os.getpid()
+        return self._conn
+
+    def submit(self, items: List[Dict]) -> Dict:
+        """Постановка пакета в очередь; items — [{"action": ..., "request": {...}}, ...]"""
+        now = time.time()
+        job_id = uuid.uuid4().hex
+        with self._lock:
+            conn = self._connection()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                conn.execute(
+                    "INSERT INTO batch_jobs (id, status, total, created) VALUES (?, 'queued', ?, ?)",
+                    (job_id, len(items), now)
+                )
+                conn.executemany(
+                    "INSERT INTO batch_items (job_id, idx, action, request, status) VALUES (?, ?, ?, ?, 'pending')",
+                    [(job_id, idx, item["action"], json.dumps(item["request"], ensure_ascii=False))
+                     for idx, item in enumerate(items)]
+                )
+                conn.execute("COMMIT")
+            except sqlite3.Error:
+                conn.execute("ROLLBACK")
+                raise
+        log_manager.add_log(LogEntry(
+            action="batch",
+            details=f"Пакет {job_id} поставлен в очередь: {len(items)} запросов",
+            status="info"
+        ))
+        self.start()
+        self._wakeup.set()
+        return self.get(job_id)
+
+    def _job_dict(self, conn: sqlite3.Connection, row) -> Dict:
+        job_id, status, total, created, finished = row
+        counts = dict(conn.execute(
+            "SELECT status, COUNT(*) FROM batch_items WHERE job_id = ? GROUP BY status", (job_id,)
+        ).fetchall())
+        done = sum(counts.get(s, 0) for s in FINAL_STATUSES)
+        return {
+            "id": job_id,
+            "status": status,
+            "total": total,
+            "counts": {s: counts.get(s, 0) for s in ("pending", "running") + FINAL_STATUSES},
+            "percent": round(done / total * 100, 1) if total else 100.0,
+            "created": created,
+            "finished": finished
+        }
+
+    def get(self, job_id: str) -> Optional[Dict]:
+        with self._lock:
+            conn = self._connection()
+            row = conn.execute(
+                "SELECT id, status, total, created, finished FROM batch_jobs WHERE id = ?", (job_id,)
+            ).fetchone()
+            return self._job_dict(conn, row) if row else None
+
+    def list(self, limit: int = 50) -> List[Dict]:
+        with self._lock:
+            conn = self._connection()
+            rows = conn.execute(
+                "SELECT id, status, total, created, finished FROM batch_jobs ORDER BY created DESC LIMIT ?", (limit,)
+            ).fetchall()
+            return [self._job_dict(conn, row) for row in rows]
+
+    def items(self, job_id: str, status: Optional[str] = None, offset: int = 0, limit: int = 100) -> List[Dict]:
+        """Состояние элементов пакета (без текста ответов)"""
+        query = ("SELECT idx, action, status, error, attempts, started, finished FROM batch_items "
+                 "WHERE job_id = ?")
+        params: list = [job_id]
+        if status:
+            query += " AND status = ?"
+            params.append(status)
+        query += " ORDER BY idx LIMIT ? OFFSET ?"
+        params += [limit, offset]
+        with self._lock:
+            rows = self._connection().execute(query, params).fetchall()
+        return [
+            {"index": idx, "action": action, "status": item_status, "error": error, "attempts": attempts,
+             "started": started, "finished": finished}
+            for idx, action, item_status, error, attempts, started, finished in rows
+        ]
+
+    @staticmethod
+    def _result_line(idx: int, request: str, status: str, response: Optional[str], error: Optional[str]) -> str:
+        result = {"index": idx, "status": status}
+        custom_id = json.loads(request).get("id")
+        if custom_id is not None:
+            result["id"] = custom_id
+        if response is not None:
+            result["response"] = json.loads(response)
+        if error is not None:
+            result["error"] = error
+        return json.dumps(result, ensure_ascii=False) + "\n"
+
+    def results(self, job_id: str, follow: bool = False, poll: float = 0.5) -> Iterator[str]:
+        """Результаты пакета строками JSONL.
+
+        Без follow — завершённые на данный момент элементы по порядку строк
+        пакета; с follow — элементы по мере завершения, пока пакет не будет
+        выполнен целиком.
+        """
+        if not follow:
+            with self._lock:
+                rows = self._connection().execute(
+                    "SELECT idx, request, status, response, error FROM batch_items "
+                    "WHERE job_id = ? AND done_order IS NOT NULL ORDER BY idx", (job_id,)
+                ).fetchall()
+            for row in rows:
+                yield self._result_line(*row)
+            return
+
+        last = 0
+        while True:
+            with self._lock:
+                conn = self._connection()
+                rows = conn.execute(
+                    "SELECT done_order, idx, request, status, response, error FROM batch_items "
+                    "WHERE job_id = ? AND done_order > ? ORDER BY done_order LIMIT 100", (job_id, last)
+                ).fetchall()
+                finished = conn.execute("SELECT finished FROM batch_jobs WHERE id = ?", (job_id,)).fetchone()
+            for row in rows:
+                last = row[0]
+                yield self._result_line(*row[1:])
+            if rows:
+                continue
+            if finished is None or finished[0] is not None:
+                return
+            time.sleep(poll)
+
+    def cancel(self, job_id: str) -> Optional[Dict]:
+        """Отмена пакета: ожидающие элементы не выполняются, выполняемые завершаются"""
+        now = time.time()
+        with self._lock:
+            conn = self._connection()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                updated = conn.execute(
+                    "UPDATE batch_jobs SET status = 'cancelled', finished = COALESCE(finished, ?) "
+                    "WHERE id = ? AND finished IS NULL", (now, job_id)
+                ).rowcount
+                if updated:
+                    self._finish_items(conn, job_id, "status = 'pending'", "cancelled", now)
+                conn.execute("COMMIT")
+            except sqlite3.Error:
+                conn.execute("ROLLBACK")
+                raise
+        if updated:
+            log_manager.add_log(LogEntry(action="batch", details=f"Пакет {job_id} отменён", status="warning"))
+        return self.get(job_id)
+
+    def delete(self, job_id: str) -> bool:
+        """Удаление завершённого пакета вместе с результатами"""
+        with self._lock:
+            conn = self._connection()
+            conn.execute("BEGIN IMMEDIATE")
+            deleted = conn.execute(
+                "DELETE FROM batch_jobs WHERE id = ? AND finished IS NOT NULL", (job_id,)
+            ).rowcount
+            if deleted:
+                conn.execute("DELETE FROM batch_items WHERE job_id = ?", (job_id,))
+            conn.execute("COMMIT")
+        return bool(deleted)
+
+    @staticmethod
+    def _finish_items(conn: sqlite3.Connection, job_id: str, where: str, status: str, now: float):
+        """Перевод элементов в конечный статус с порядковым номером завершения"""
+        ids = [row[0] for row in conn.execute(
+            f"SELECT id FROM batch_items WHERE job_id = ? AND {where} ORDER BY idx", (job_id,)
+        ).fetchall()]
+        order = conn.execute(
+            "SELECT COALESCE(MAX(done_order), 0) FROM batch_items WHERE job_id = ?", (job_id,)
+        ).fetchone()[0]
+        conn.executemany(
+            "UPDATE batch_items SET status = ?, finished = ?, done_order = ? WHERE id = ?",
+            [(status, now, order + i + 1, item_id) for i, item_id in enumerate(ids)]
+        )
+
+    def _recover(self):
+        """Возврат в очередь элементов, захваченных завершившимися процессами"""
+        with self._lock:
+            conn = self._connection()
+            rows = conn.execute("SELECT id, worker FROM batch_items WHERE status = 'running'").fetchall()
+            stale = [item_id for item_id, worker in rows if not self._worker_alive(worker, item_id)]
+            if stale:
+                conn.executemany(
+                    "UPDATE batch_items SET status = 'pending', worker = NULL WHERE id = ? AND status = 'running'",
+                    [(item_id,) for item_id in stale]
+                )
+        if stale:
+            logger.info(f"Возвращено в очередь пакетной генерации: {len(stale)} элементов")
+
+    def _worker_alive(self, pid: Optional[int], item_id: int) -> bool:
+        if pid == os.getpid():
+            return item_id in self._inflight
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return False
+        except (PermissionError, TypeError):
+            return pid is not None
+        return True
+
+    def _claim(self) -> Optional[tuple]:
+        now = time.time()
+        with self._lock:
+            conn = self._connection()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                running = conn.execute("SELECT COUNT(*) FROM batch_items WHERE status = 'running'").fetchone()[0]
+                row = None
+                if running < self.concurrency:
+                    # Элементы отменённых и завершённых пакетов не выполняются
+                    row = conn.execute(
+                        "SELECT i.id, i.job_id, i.idx, i.action, i.request, i.attempts FROM batch_items i "
+                        "JOIN batch_jobs j ON j.id = i.job_id "
+                        "WHERE i.status = 'pending' AND i.not_before <= ? AND j.finished IS NULL "
+                        "ORDER BY i.id LIMIT 1", (now,)
+                    ).fetchone()
+                if row is not None:
+                    conn.execute(
+                        "UPDATE batch_items SET status = 'running', worker = ?, started = ?, attempts = attempts + 1 "
+                        "WHERE id = ?", (os.getpid(), now, row[0])
+                    )
+                    conn.execute("UPDATE batch_jobs SET status = 'running' WHERE id = ? AND status = 'queued'",
+                                 (row[1],))
+                    self._inflight.add(row[0])
+                conn.execute("COMMIT")
+            except sqlite3.Error:
+                conn.execute("ROLLBACK")
+                raise
+        return row
+
+    def _complete(self, item_id: int, job_id: str, status: str, response: Optional[Dict] = None,
+                  error: Optional[str] = None, retry_at: Optional[float] = None, refund: bool = False):
+        now = time.time()
+        finished_job = False
+        with self._lock:
+            conn = self._connection()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                if status == "pending":
+                    finished = conn.execute("SELECT finished FROM batch_jobs WHERE id = ?", (job_id,)).fetchone()
+                    if finished is None or finished[0] is not None:
+                        # Пакет отменён, пока элемент выполнялся: повтор не нужен
+                        status = "cancelled"
+                if status == "pending":
+                    conn.execute(
+                        "UPDATE batch_items SET status = 'pending', worker = NULL, error = ?, not_before = ?, "
+                        "attempts = attempts - ? WHERE id = ?", (error, retry_at or now, int(refund), item_id)
+                    )
+                else:
+                    order = conn.execute(
+                        "SELECT COALESCE(MAX(done_order), 0) FROM batch_items WHERE job_id = ?", (job_id,)
+                    ).fetchone()[0]
+                    conn.execute(
+                        "UPDATE batch_items SET status = ?, response = ?, error = ?, finished = ?, done_order = ? "
+                        "WHERE id = ?",
+                        (status, json.dumps(response, ensure_ascii=False) if response is not None else None,
+                         error, now, order + 1, item_id)
+                    )
+                    left = conn.execute(
+                        "SELECT COUNT(*) FROM batch_items WHERE job_id = ? AND status IN ('pending', 'running')",
+                        (job_id,)
+                    ).fetchone()[0]
+                    if not left:
+                        finished_job = bool(conn.execute(
+                            "UPDATE batch_jobs SET status = 'completed', finished = ? "
+                            "WHERE id = ? AND finished IS NULL", (now, job_id)
+                        ).rowcount)
+                conn.execute("COMMIT")
+            except sqlite3.Error:
+                conn.execute("ROLLBACK")
+                raise
+            finally:
+                self._inflight.discard(item_id)
+        if finished_job:
+            job = self.get(job_id)
+            failed = job["counts"]["failed"] if job else 0
+            log_manager.add_log(LogEntry(
+                action="batch",
+                details=f"Пакет {job_id} выполнен: {job['total'] - failed} из {job['total']} запросов"
+                        + (f", ошибок: {failed}" if failed else ""),
+                status="warning" if failed else "success"
+            ))
+
+    def _execute(self, row: tuple):
+        item_id, job_id, idx, action, request_json, attempts = row
+        attempts += 1
+        try:
+            response = self._handler(action, json.loads(request_json))
+        except BackendUnavailable as e:
+            # Все серверы недоступны: элемент ждёт закрытия цепи, попытка не засчитывается
+            self._complete(item_id, job_id, "pending", error=str(e), retry_at=time.time() + e.retry_after,
+                           refund=True)
+            return
+        except (requests.RequestException, SchedulerRejected, BatchItemError) as e:
+            retryable = getattr(e, "retryable", True)
+            if retryable and attempts < BATCH_MAX_ATTEMPTS:
+                self._complete(item_id, job_id, "pending", error=str(e), retry_at=time.time() + 2 ** attempts)
+            else:
+                self._complete(item_id, job_id, "failed", error=str(e))
+            return
+        except Exception as e:
+            logger.error(f"Ошибка выполнения элемента {idx} пакета {job_id}: {e}")
+            self._complete(item_id, job_id, "failed", error=str(e))
+            return
+        self._complete(item_id, job_id, "done", response=response)
+
+    def start(self):
+        """Запуск потоков-исполнителей; элементы прерванных процессов возвращаются в очередь"""
+        # Потоки не наследуются при fork, поэтому проверяется PID
+        if self._threads and self._threads_pid == os.getpid():
+            return
+        with self._lock:
+            if self._threads and self._threads_pid == os.getpid():
+                return
+            self._threads_pid = os.getpid()
+            self._inflight = set()
+            self._threads = [
+                threading.Thread(target=self._loop, name=f"batch-{i}", daemon=True)
+                for i in range(self.concurrency)
+            ]
+        try:
+            self._recover()
+        except sqlite3.Error as e:
+            logger.error(f"Ошибка восстановления очереди пакетной генерации: {e}")
+        for thread in self._threads:
+            thread.start()
+
+    def _loop(self):
+        last_recover = time.monotonic()
+        while True:
+            try:
+                row = self._claim() if self._handler is not None else None
+            except sqlite3.Error as e:
+                logger.error(f"Ошибка очереди пакетной генерации: {e}")
+                row = None
+            if row is None:
+                self._wakeup.wait(BATCH_POLL_INTERVAL)
+                self._wakeup.clear()
+                # Воркер мог завершиться аварийно, не вернув захваченные элементы
+                if time.monotonic() - last_recover > 30:
+                    last_recover = time.monotonic()
+                    try:
+                        self._recover()
+                    except sqlite3.Error as e:
+                        logger.error(f"Ошибка восстановления очереди пакетной генерации: {e}")
+                continue
+            self._execute(row)
+            # Освободившийся слот может занять ожидающий поток
+            self._wakeup.set()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            conn = self._connection()
+            counts = dict(conn.execute("SELECT status, COUNT(*) FROM batch_items GROUP BY status").fetchall())
+            jobs = dict(conn.execute("SELECT status, COUNT(*) FROM batch_jobs GROUP BY status").fetchall())
+            return {
+                "concurrency": self.concurrency,
+                "max_attempts": BATCH_MAX_ATTEMPTS,
+                "inflight": len(self._inflight),
+                "items": counts,
+                "jobs": jobs
+            }
+
+
+# Глобальный экземпляр
+batch_jobs = BatchJobManager()
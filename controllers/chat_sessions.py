@@ -0,0 +1,166 @@
+import os
+import json
+import time
+import uuid
+import sqlite3
+import logging
+import threading
+from typing import Dict, List, Optional
+
+# Настройка логирования
+logger = logging.getLogger(__name__)
+
+# Сколько Ollama держит модель сессии загруженной после ответа
+SESSION_KEEP_ALIVE = os.environ.get("CHAT_SESSION_KEEP_ALIVE", "30m")
+
+
+class SessionConflict(Exception):
+    """История сессии изменилась параллельным запросом"""
+
+
+class ChatSessionStore:
+    """Хранилище чат-сессий на стороне сервера.
+
+    Клиент отправляет только новое сообщение, а история хранится в SQLite
+    (общем для всех воркеров): сессия и её сообщения в отдельных таблицах,
+    каждый ход дописывает две строки, не переписывая историю. Прочитанная
+    история кэшируется в памяти процесса, и при следующем ходе из базы
+    читаются только новые сообщения. Для каждой сессии запоминается сервер
+    Ollama, который ответил последним: пока модель на нём загружена
+    (keep_alive), Ollama переиспользует KV-кэш общего префикса диалога и
+    вычисляет только новое сообщение.
+    """
+
+    def __init__(self, path: Optional[str] = None, max_cached: int = 256):
+        self.path = path or os.environ.get("CHAT_SESSIONS_PATH", "chat_sessions.db")
+        self.max_cached = max_cached
+
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+        self._pid = None
+        # session_id -> список сообщений, уже прочитанных из базы
+        self._history: Dict[str, List[Dict]] = {}
+
+    def _connection(self) -> sqlite3.Connection:
+        # Соединение не наследуется от родительского процесса после fork
+        if self._conn is None or self._pid != os.getpid():
+            self._conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False, isolation_level=None)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS sessions ("
+                "id TEXT PRIMARY KEY, model TEXT NOT NULL, system TEXT, options TEXT, "
+                "keep_alive TEXT, backend TEXT, created REAL NOT NULL, updated REAL NOT NULL)"
+            )
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS session_messages ("
+                "session_id TEXT NOT NULL, seq INTEGER NOT NULL, role TEXT NOT NULL, "
+                "content TEXT NOT NULL, created REAL NOT NULL, PRIMARY KEY (session_id, seq))"
+            )
+            self._history = {}
+            self._pid = os.getpid()
+        return self._conn
+
+    @staticmethod
+    def _row_to_session(row) -> Dict:
+        return {
+            "id": row[0],
+            "model": row[1],
+            "system": row[2],
+            "options": json.loads(row[3]) if row[3] else None,
+            "keep_alive": row[4],
+            "backend": row[5],
+            "created": row[6],
+            "updated": row[7]
+        }
+
+    def create(self, model: str, system: Optional[str] = None, options: Optional[Dict] = None,
+               keep_alive: Optional[str] = None) -> Dict:
+        now = time.time()
+        session_id = uuid.uuid4().hex
+        with self._lock:
+            self._connection().execute(
+                "INSERT INTO sessions (id, model, system, options, keep_alive, backend, created, updated) "
+                "VALUES (?, ?, ?, ?, ?, NULL, ?, ?)",
+                (session_id, model, system, json.dumps(options) if options else None,
+                 keep_alive or SESSION_KEEP_ALIVE, now, now)
+            )
+            self._history[session_id] = []
+        return self.get(session_id)
+
+    def get(self, session_id: str) -> Optional[Dict]:
+        with self._lock:
+            row = self._connection().execute(
+                "SELECT id, model, system, options, keep_alive, backend, created, updated "
+                "FROM sessions WHERE id = ?", (session_id,)
+            ).fetchone()
+        return self._row_to_session(row) if row else None
+
+    def list(self, limit: int = 50) -> List[Dict]:
+        with self._lock:
+            rows = self._connection().execute(
+                "SELECT id, model, system, options, keep_alive, backend, created, updated, "
+                "(SELECT COUNT(*) FROM session_messages WHERE session_id = sessions.id) "
+                "FROM sessions ORDER BY updated DESC LIMIT ?", (limit,)
+            ).fetchall()
+        return [dict(self._row_to_session(row), messages=row[8]) for row in rows]
+
+    def history(self, session_id: str) -> List[Dict]:
+        """История сессии; из базы читаются только сообщения, которых ещё нет в памяти"""
+        with self._lock:
+            conn = self._connection()
+            cached = self._history.get(session_id)
+            if cached is None:
+                if len(self._history) >= self.max_cached:
+                    self._history.pop(next(iter(self._history)))
+                cached = self._history[session_id] = []
+            rows = conn.execute(
+                "SELECT role, content FROM session_messages WHERE session_id = ? AND seq >= ? ORDER BY seq",
+                (session_id, len(cached))
+            ).fetchall()
+            cached.extend({"role": role, "content": content} for role, content in rows)
+            return list(cached)
+
+    def append(self, session_id: str, start: int, messages: List[Dict], backend: Optional[str] = None):
+        """Добавление сообщений хода, начиная с позиции start.
+
+        Если другой запрос уже дописал сообщения на эти позиции, выбрасывает
+        SessionConflict, чтобы ответ не попал в историю не на своё место.
+        """
+        now = time.time()
+        with self._lock:
+            conn = self._connection()
+            try:
+                conn.execute("BEGIN IMMEDIATE")
+                conn.executemany(
+                    "INSERT INTO session_messages (session_id, seq, role, content, created) VALUES (?, ?, ?, ?, ?)",
+                    [(session_id, start + i, message["role"], message["content"], now)
+                     for i, message in enumerate(messages)]
+                )
+                conn.execute(
+                    "UPDATE sessions SET updated = ?, backend = COALESCE(?, backend) WHERE id = ?",
+                    (now, backend, session_id)
+                )
+                conn.execute("COMMIT")
+            except sqlite3.IntegrityError:
+                conn.execute("ROLLBACK")
+                raise SessionConflict(f"История сессии {session_id} изменена параллельным запросом")
+            except sqlite3.Error:
+                conn.execute("ROLLBACK")
+                raise
+            cached = self._history.get(session_id)
+            if cached is not None and len(cached) == start:
+                cached.extend({"role": message["role"], "content": message["content"]} for message in messages)
+
+    def delete(self, session_id: str) -> bool:
+        with self._lock:
+            conn = self._connection()
+            conn.execute("BEGIN IMMEDIATE")
+            deleted = conn.execute("DELETE FROM sessions WHERE id = ?", (session_id,)).rowcount
+            conn.execute("DELETE FROM session_messages WHERE session_id = ?", (session_id,))
+            conn.execute("COMMIT")
+            self._history.pop(session_id, None)
+        return bool(deleted)
+
+
+# Глобальный экземпляр
+chat_sessions = ChatSessionStore()
@@ -0,0 +1,208 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+# Настройка логирования
+logger = logging.getLogger(__name__)
+
+
+def is_deterministic(options: Optional[Dict]) -> bool:
+    """Детерминирован ли ответ модели при этих параметрах сэмплирования"""
+    if not options:
+        return False
+    if options.get("seed") is not None and options.get("seed") != -1:
+        return True
+    return options.get("temperature") == 0
+
+
+def normalize_model(name: str) -> str:
+    """Имя модели с тегом: 'llama3' и 'llama3:latest' — одна и та же модель"""
+    return name if ":" in name else f"{name}:latest"
+
+
+class CompletionCache:
+    """Кэш ответов генерации, адресуемый по содержимому запроса.
+
+    Ключ — SHA-256 от дайджеста модели, промпта или сообщений и параметров
+    сэмплирования, поэтому после pull новой версии модели старые ответы
+    не используются. Два уровня: LRU в памяти процесса и SQLite на диске,
+    общий для всех воркеров. Оба уровня ограничены по размеру и вытесняют
+    записи, к которым дольше всего не обращались.
+    """
+
+    def __init__(self, path: Optional[str] = None, memory_bytes: Optional[int] = None,
+                 disk_bytes: Optional[int] = None):
+        self.path = path or os.environ.get("COMPLETION_CACHE_PATH", "completion_cache.db")
+        self.memory_bytes = memory_bytes or int(os.environ.get("COMPLETION_CACHE_MEMORY_MB", "32")) * 1024 * 1024
+        self.disk_bytes = disk_bytes or int(os.environ.get("COMPLETION_CACHE_DISK_MB", "512")) * 1024 * 1024
+
+        self._lock = threading.Lock()
+        self._memory: "OrderedDict[str, tuple]" = OrderedDict()
+        self._memory_size = 0
+        self._conn: Optional[sqlite3.Connection] = None
+        self._pid = None
+
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+
+    @staticmethod
+    def make_key(endpoint: str, digest: str, payload: Dict) -> str:
+        """Ключ кэша; payload — промпт или сообщения и параметры запроса"""
+        material = json.dumps({"endpoint": endpoint, "digest": digest, "payload": payload},
+                              sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+        return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+    def _connection(self) -> sqlite3.Connection:
+        # Соединение не наследуется от родительского процесса после fork
+        if self._conn is None or self._pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            # Иначе INSERT OR REPLACE удаляет старую запись без срабатывания триггера
+            conn.execute("PRAGMA recursive_triggers=ON")
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                conn.execute(
+                    "CREATE TABLE IF NOT EXISTS completions ("
+                    "key TEXT PRIMARY KEY, model TEXT NOT NULL, value BLOB NOT NULL, "
+                    "size INTEGER NOT NULL, accessed REAL NOT NULL)"
+                )
+                conn.execute("CREATE INDEX IF NOT EXISTS idx_completions_accessed ON completions (accessed)")
+                conn.execute("CREATE INDEX IF NOT EXISTS idx_completions_model ON completions (model)")
+                # Общий для воркеров размер кэша поддерживается триггерами, без SUM по таблице
+                conn.execute("CREATE TABLE IF NOT EXISTS completions_size (id INTEGER PRIMARY KEY, total INTEGER NOT NULL)")
+                conn.execute(
+                    "INSERT OR IGNORE INTO completions_size (id, total) "
+                    "SELECT 0, COALESCE(SUM(size), 0) FROM completions"
+                )
+                conn.execute(
+                    "CREATE TRIGGER IF NOT EXISTS completions_size_insert AFTER INSERT ON completions "
+                    "BEGIN UPDATE completions_size SET total = total + NEW.size WHERE id = 0; END"
+                )
+                conn.execute(
+                    "CREATE TRIGGER IF NOT EXISTS completions_size_delete AFTER DELETE ON completions "
+                    "BEGIN UPDATE completions_size SET total = total - OLD.size WHERE id = 0; END"
+                )
+                conn.execute("COMMIT")
+            except sqlite3.Error:
+                conn.execute("ROLLBACK")
+                raise
+            self._conn = conn
+            self._pid = os.getpid()
+        return self._conn
+
+    def _remember(self, key: str, model: str, value: bytes):
+        """Запись в LRU в памяти (под self._lock)"""
+        old = self._memory.pop(key, None)
+        if old is not None:
+            self._memory_size -= len(old[1])
+        if len(value) > self.memory_bytes:
+            return
+        self._memory[key] = (model, value)
+        self._memory_size += len(value)
+        while self._memory_size > self.memory_bytes:
+            _, (_, evicted) = self._memory.popitem(last=False)
+            self._memory_size -= len(evicted)
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                self._memory.move_to_end(key)
+                self.memory_hits += 1
+                return json.loads(entry[1])
+
+            try:
+                conn = self._connection()
+                row = conn.execute("SELECT model, value FROM completions WHERE key = ?", (key,)).fetchone()
+                if row is not None:
+                    conn.execute("UPDATE completions SET accessed = ? WHERE key = ?", (time.time(), key))
+            except sqlite3.Error as e:
+                logger.error(f"Ошибка чтения кэша ответов: {e}")
+                row = None
+
+            if row is None:
+                self.misses += 1
+                return None
+            self.disk_hits += 1
+            self._remember(key, row[0], row[1])
+            return json.loads(row[1])
+
+    def put(self, key: str, model: str, result: Any):
+        value = json.dumps(result, ensure_ascii=False).encode("utf-8")
+        model = normalize_model(model)
+        with self._lock:
+            self._remember(key, model, value)
+            self.stores += 1
+            try:
+                conn = self._connection()
+                conn.execute(
+                    "INSERT OR REPLACE INTO completions (key, model, value, size, accessed) VALUES (?, ?, ?, ?, ?)",
+                    (key, model, value, len(value), time.time())
+                )
+                self._evict_disk(conn)
+            except sqlite3.Error as e:
+                logger.error(f"Ошибка записи кэша ответов: {e}")
+
+    def _evict_disk(self, conn: sqlite3.Connection):
+        """Удаление давно не использованных записей, пока кэш на диске больше лимита"""
+        total = conn.execute("SELECT total FROM completions_size WHERE id = 0").fetchone()[0]
+        if total <= self.disk_bytes:
+            return
+        # Освобождаем с запасом, чтобы не вытеснять на каждой записи
+        excess = total - int(self.disk_bytes * 0.9)
+        freed = 0
+        doomed = []
+        for key, size in conn.execute("SELECT key, size FROM completions ORDER BY accessed"):
+            doomed.append((key,))
+            freed += size
+            if freed >= excess:
+                break
+        conn.executemany("DELETE FROM completions WHERE key = ?", doomed)
+        self.evictions += len(doomed)
+
+    def invalidate_model(self, model: str) -> int:
+        """Удаление всех ответов модели (например, после pull новой версии)"""
+        model = normalize_model(model)
+        with self._lock:
+            for key in [key for key, (name, _) in self._memory.items() if name == model]:
+                self._memory_size -= len(self._memory.pop(key)[1])
+            try:
+                return self._connection().execute("DELETE FROM completions WHERE model = ?", (model,)).rowcount
+            except sqlite3.Error as e:
+                logger.error(f"Ошибка очистки кэша ответов: {e}")
+                return 0
+
+    def stats(self) -> Dict:
+        with self._lock:
+            try:
+                disk_entries, disk_size = self._connection().execute(
+                    "SELECT (SELECT COUNT(*) FROM completions), total FROM completions_size WHERE id = 0"
+                ).fetchone()
+            except sqlite3.Error:
+                disk_entries, disk_size = None, None
+            return {
+                "memory_entries": len(self._memory),
+                "memory_bytes": self._memory_size,
+                "memory_limit": self.memory_bytes,
+                "disk_entries": disk_entries,
+                "disk_bytes": disk_size,
+                "disk_limit": self.disk_bytes,
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "stores": self.stores,
+                "evictions": self.evictions
+            }
+
+
+# Глобальный экземпляр
+completion_cache = CompletionCache()
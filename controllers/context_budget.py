@@ -0,0 +1,210 @@
+import os
+import json
+import hashlib
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+import requests
+
+from models import log_manager, LogEntry
+from controllers.ollama_client import ollama_client
+from controllers.ollama_scheduler import ollama_scheduler, SchedulerRejected
+from controllers.completion_cache import completion_cache
+
+# Настройка логирования
+logger = logging.getLogger(__name__)
+
+# Размер контекста модели, если клиент не передал options.num_ctx (значение Ollama по умолчанию)
+DEFAULT_NUM_CTX = int(os.environ.get("OLLAMA_NUM_CTX", "2048"))
+# Доля контекста под историю диалога; остальное остаётся на ответ модели
+CONTEXT_BUDGET_RATIO = float(os.environ.get("CONTEXT_BUDGET_RATIO", "0.75"))
+# Модель для пересказа старых ходов (по умолчанию — модель самого чата)
+SUMMARY_MODEL = os.environ.get("CONTEXT_SUMMARY_MODEL")
+# Старые сообщения сворачиваются порциями, чтобы пересказ не пересчитывался на каждом ходе
+FOLD_STEP = int(os.environ.get("CONTEXT_FOLD_STEP", "8"))
+
+SUMMARY_PROMPT = (
+    "Кратко перескажи диалог ниже, сохранив факты, договорённости, имена, "
+    "код и открытые вопросы. Пиши только пересказ.\n\n{previous}{dialog}"
+)
+
+
+def estimate_tokens(message: Dict) -> int:
+    """Быстрая оценка числа токенов сообщения без токенизатора.
+
+    BPE-токен в среднем занимает около 4 байт UTF-8 (для кириллицы — около
+    двух символов); 4 токена добавляются на роль и разметку шаблона.
+    """
+    return len(str(message.get("content") or "").encode("utf-8")) // 4 + 4
+
+
+class ContextBudget:
+    """Укладывание истории чата в контекстное окно модели.
+
+    Системные сообщения и последние ходы передаются как есть, пока их
+    оценка в токенах укладывается в бюджет (CONTEXT_BUDGET_RATIO от num_ctx).
+    Более старые сообщения заменяются пересказом, который делает дешёвая
+    модель (CONTEXT_SUMMARY_MODEL). Граница сворачивания сдвигается порциями
+    по CONTEXT_FOLD_STEP сообщений, а пересказ каждого префикса истории
+    хранится в кэше ответов (общем для воркеров) под хэшем этого префикса,
+    поэтому он строится один раз и дополняется инкрементально: к пересказу
+    предыдущего префикса добавляются только новые сообщения. Когда история
+    приближается к следующей границе, пересказ готовится заранее в фоне.
+    """
+
+    def __init__(self, fold_step: int = FOLD_STEP):
+        self.fold_step = max(2, fold_step)
+        self._lock = threading.Lock()
+        self._pending: set = set()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="context-summary")
+
+        self.fitted = 0
+        self.folded = 0
+        self.summaries_built = 0
+        self.summary_failures = 0
+
+    @staticmethod
+    def budget(options: Optional[Dict]) -> int:
+        num_ctx = (options or {}).get("num_ctx") or DEFAULT_NUM_CTX
+        return int(num_ctx * CONTEXT_BUDGET_RATIO)
+
+    @staticmethod
+    def _prefix_hashes(messages: List[Dict]) -> List[str]:
+        """Цепочка хэшей: hashes[i] — хэш первых i сообщений"""
+        hashes = [hashlib.sha256(b"").hexdigest()]
+        for message in messages:
+            material = json.dumps([hashes[-1], message.get("role"), message.get("content")], ensure_ascii=False)
+            hashes.append(hashlib.sha256(material.encode("utf-8")).hexdigest())
+        return hashes
+
+    def _cut(self, dialog: List[Dict], limit: int) -> int:
+        """Наименьшая граница, кратная шагу, после которой хвост укладывается в limit"""
+        tail = sum(estimate_tokens(message) for message in dialog)
+        cut = 0
+        while tail > limit and cut + self.fold_step < len(dialog):
+            tail -= sum(estimate_tokens(message) for message in dialog[cut:cut + self.fold_step])
+            cut += self.fold_step
+        return cut
+
+    def fit(self, model: str, messages: List[Dict], options: Optional[Dict] = None) -> List[Dict]:
+        """Сообщения, укладывающиеся в контекст модели; исходный список не меняется"""
+        if not isinstance(messages, list) or not all(isinstance(message, dict) for message in messages):
+            # Некорректную историю не сворачиваем: её отклонит проверка запроса или сама Ollama
+            return messages
+        system = [message for message in messages if message.get("role") == "system"]
+        dialog = [message for message in messages if message.get("role") != "system"]
+        limit = self.budget(options) - sum(estimate_tokens(message) for message in system)
+        with self._lock:
+            self.fitted += 1
+
+        # На пересказ оставляется четверть бюджета
+        target = limit - limit // 4
+        cut = 0 if sum(estimate_tokens(message) for message in dialog) <= limit else self._cut(dialog, target)
+
+        # Хвост приближается к следующей границе: её пересказ готовится заранее в фоне
+        upcoming = self._cut(dialog, int(target * 0.8))
+        if upcoming > cut:
+            self._prefetch(model, dialog, upcoming)
+        if cut == 0:
+            return messages
+
+        summary = self._summary(model, dialog, cut, priority="interactive")
+        with self._lock:
+            self.folded += 1
+        if summary is None:
+            # Пересказ недоступен: остаётся скользящее окно последних ходов
+            return system + dialog[cut:]
+        folded = {"role": "system", "content": f"Краткое содержание начала диалога:\n{summary}"}
+        return system + [folded] + dialog[cut:]
+
+    def _key(self, summary_model: str, prefix_hash: str) -> str:
+        return completion_cache.make_key("summary", summary_model, {"prefix": prefix_hash})
+
+    def _summary(self, model: str, dialog: List[Dict], cut: int, priority: str) -> Optional[str]:
+        """Пересказ dialog[:cut]: из кэша или поверх пересказа предыдущей порции"""
+        summary_model = SUMMARY_MODEL or model
+        hashes = self._prefix_hashes(dialog[:cut])
+        cached = completion_cache.get(self._key(summary_model, hashes[cut]))
+        if cached is not None:
+            return cached["summary"]
+
+        # Самый длинный уже пересказанный префикс на границах порций
+        start, previous = 0, None
+        for boundary in range(cut - self.fold_step, 0, -self.fold_step):
+            entry = completion_cache.get(self._key(summary_model, hashes[boundary]))
+            if entry is not None:
+                start, previous = boundary, entry["summary"]
+                break
+
+        dialog_text = "\n".join(f"{message.get('role')}: {message.get('content', '')}" for message in dialog[start:cut])
+        prompt = SUMMARY_PROMPT.format(
+            previous=f"Пересказ более ранней части:\n{previous}\n\nПродолжение:\n" if previous else "",
+            dialog=dialog_text
+        )
+        try:
+            with ollama_scheduler.slot(summary_model, priority):
+                response = ollama_client.post(
+                    "/api/generate",
+                    json={"model": summary_model, "prompt": prompt, "stream": False, "options": {"temperature": 0}},
+                    model=summary_model
+                )
+            if response.status_code != 200:
+                raise requests.RequestException(f"код ответа {response.status_code}")
+            summary = response.json().get("response", "").strip()
+        except (requests.RequestException, SchedulerRejected, ValueError) as e:
+            with self._lock:
+                self.summary_failures += 1
+            log_manager.add_log(LogEntry(
+                action="context_budget",
+                details=f"Не удалось пересказать начало диалога моделью {summary_model}: {str(e)}",
+                status="warning"
+            ))
+            return None
+
+        completion_cache.put(self._key(summary_model, hashes[cut]), summary_model, {"summary": summary})
+        with self._lock:
+            self.summaries_built += 1
+        log_manager.add_log(LogEntry(
+            action="context_budget",
+            details=f"Начало диалога ({cut} сообщений) свёрнуто в пересказ моделью {summary_model}",
+            status="info"
+        ))
+        return summary
+
+    def _prefetch(self, model: str, dialog: List[Dict], cut: int):
+        if cut == 0:
+            return
+        key = (SUMMARY_MODEL or model, self._prefix_hashes(dialog[:cut])[cut])
+        with self._lock:
+            if key in self._pending:
+                return
+            self._pending.add(key)
+
+        def build():
+            try:
+                self._summary(model, dialog, cut, priority="batch")
+            finally:
+                with self._lock:
+                    self._pending.discard(key)
+
+        self._executor.submit(build)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "num_ctx_default": DEFAULT_NUM_CTX,
+                "budget_ratio": CONTEXT_BUDGET_RATIO,
+                "summary_model": SUMMARY_MODEL,
+                "fold_step": self.fold_step,
+                "fitted": self.fitted,
+                "folded": self.folded,
+                "summaries_built": self.summaries_built,
+                "summary_failures": self.summary_failures,
+                "pending": len(self._pending)
+            }
+
+
+# Глобальный экземпляр
+context_budget = ContextBudget()
@@ -3,8 +3,9 @@ import importlib
 import logging
 import json
 import sys
-from flask import Blueprint, jsonify, request
+from flask import Blueprint, jsonify, request, has_app_context
 from models import log_manager, LogEntry
+from shared_state import shared_state, is_shared_mode
 
 # Настройка логирования
 logger = logging.getLogger(__name__)
@@ -19,6 +20,14 @@ EXTENSIONS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__
 extensions_info = {}
 loaded_extensions = {}
 
+# Блюпринты всех установленных расширений, включённых и выключенных. Flask не позволяет
+# регистрировать блюпринты после первого запроса, поэтому маршруты регистрируются при
+# старте, а запрос к расширению, не загруженному в этом воркере, получает 404
+extension_blueprints = {}
+
+# Поколение состояния расширений, которое видел этот воркер
+extensions_generation = 0
+
 # Создаем директорию для расширений, если её нет
 if not os.path.exists(EXTENSIONS_DIR):
     try:
@@ -81,6 +90,42 @@ def discover_extensions():
     return extensions_info
 
 
+def import_extension(extension_id):
+    """Импорт модуля расширения"""
+    # Добавляем директорию с расширениями в путь импорта
+    if EXTENSIONS_DIR not in sys.path:
+        sys.path.append(EXTENSIONS_DIR)
+    return importlib.import_module(f"{extensions_info[extension_id]['directory']}.extension")
+
+
+def build_blueprint(extension_id, ext_module):
+    """Блюпринт с маршрутами расширения; запросы обслуживаются, пока расширение загружено"""
+    ext_blueprint = Blueprint(f"ext_{extension_id}", __name__, url_prefix=f"/api/ext/{extension_id}")
+
+    @ext_blueprint.before_request
+    def require_loaded():
+        # loaded_extensions уже синхронизирован с другими воркерами (sync_extensions)
+        if extension_id not in loaded_extensions:
+            return jsonify({"error": f"Расширение {extension_id} отключено"}), 404
+
+    ext_module.register_routes(ext_blueprint)
+    return ext_blueprint
+
+
+def build_extension_blueprints():
+    """Создание блюпринтов всех установленных расширений для регистрации при старте"""
+    for ext_id in extensions_info:
+        if ext_id in extension_blueprints:
+            continue
+        try:
+            ext_module = import_extension(ext_id)
+            if hasattr(ext_module, 'register_routes'):
+                extension_blueprints[ext_id] = build_blueprint(ext_id, ext_module)
+        except Exception as e:
+            logger.error(f"Ошибка при регистрации маршрутов расширения {ext_id}: {e}")
+    return extension_blueprints
+
+
 def load_extension(extension_id):
     """Загрузка расширения"""
     global loaded_extensions
@@ -107,12 +152,8 @@ def load_extension(extension_id):
         return True
     
     try:
-        # Добавляем директорию с расширениями в путь импорта
-        if EXTENSIONS_DIR not in sys.path:
-            sys.path.append(EXTENSIONS_DIR)
-        
         # Импортируем модуль расширения
-        ext_module = importlib.import_module(f"{ext_info['directory']}.extension")
+        ext_module = import_extension(extension_id)
         
         # Проверяем наличие необходимых функций
         if not hasattr(ext_module, 'init_extension') or not hasattr(ext_module, 'register_routes'):
@@ -126,9 +167,16 @@ def load_extension(extension_id):
         # Инициализируем расширение
         ext_module.init_extension()
         
-        # Регистрируем маршруты расширения
-        ext_blueprint = Blueprint(f"ext_{extension_id}", __name__, url_prefix=f"/api/ext/{extension_id}")
-        ext_module.register_routes(ext_blueprint)
+        # Маршруты зарегистрированы при старте; расширение, созданное позже, получит их после перезапуска
+        ext_blueprint = extension_blueprints.get(extension_id)
+        if ext_blueprint is None:
+            ext_blueprint = extension_blueprints[extension_id] = build_blueprint(extension_id, ext_module)
+            if has_app_context():
+                log_manager.add_log(LogEntry(
+                    action="load_extension",
+                    details=f"Маршруты расширения {extension_id} станут доступны после перезапуска приложения",
+                    status="warning"
+                ))
         
         # Сохраняем информацию о загруженном расширении
         loaded_extensions[extension_id] = {
@@ -188,6 +236,27 @@ def unload_extension(extension_id):
         return False
 
 
+@extensions_bp.before_app_request
+def sync_extensions():
+    """Синхронизация загруженных расширений с изменениями, сделанными в других воркерах"""
+    global extensions_generation
+    if not is_shared_mode():
+        # Один воркер: других источников изменений нет
+        return
+    generation = shared_state.get("extensions_generation", 0)
+    if generation == extensions_generation:
+        return
+    extensions_generation = generation
+
+    discover_extensions()
+    for ext_id, ext_info in extensions_info.items():
+        if ext_info.get('enabled', False) and ext_id not in loaded_extensions:
+            load_extension(ext_id)
+    for ext_id in list(loaded_extensions):
+        if not extensions_info.get(ext_id, {}).get('enabled', False):
+            unload_extension(ext_id)
+
+
 @extensions_bp.route('/list', methods=['GET'])
 def list_extensions():
     """Получение списка доступных расширений"""
@@ -247,6 +316,11 @@ def toggle_extension():
         
         # Обновляем информацию в памяти
         ext_info['enabled'] = enabled
+
+        # Сообщаем остальным воркерам, что состояние расширений изменилось
+        global extensions_generation
+        if is_shared_mode():
+            extensions_generation = shared_state.increment("extensions_generation")
         
         # Загружаем или выгружаем расширение
         if enabled:
@@ -394,6 +468,9 @@ def register_routes(blueprint):
 
 # Инициализация - обнаружение расширений при запуске
 discover_extensions()
+build_extension_blueprints()
+if is_shared_mode():
+    extensions_generation = shared_state.get("extensions_generation", 0)
 
 # Загрузка включенных расширений
 for ext_id, ext_info in extensions_info.items():
@@ -1,7 +1,10 @@
 import os
 import logging
-from flask import Blueprint, jsonify, request
+from flask import Blueprint, Response, jsonify, request, send_file
+from werkzeug.exceptions import HTTPException
 from models import log_manager, LogEntry
+from controllers.file_index import file_index
+from controllers.line_index import line_index
 
 # Настройка логирования
 logger = logging.getLogger(__name__)
@@ -12,6 +15,10 @@ file_bp = Blueprint('file', __name__, url_prefix='/api/file')
 # Ограничиваем доступные директории текущей директорией и её поддиректориями
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 
+# Файлы больше этого размера (байт) в JSON отдаются первой страницей строк
+FILE_READ_JSON_LIMIT = int(os.environ.get("FILE_READ_JSON_LIMIT", str(8 * 1024 * 1024)))
+FILE_READ_PAGE_LINES = int(os.environ.get("FILE_READ_PAGE_LINES", "5000"))
+
 def is_path_allowed(path):
     """Проверяет, что путь находится внутри разрешенной директории"""
     # Получаем абсолютный путь
@@ -71,9 +78,29 @@ def list_files():
             "error": f"Ошибка при получении списка файлов: {str(e)}"
         }), 500
 
+def _line_arg(name):
+    """Номер строки из параметра запроса (с единицы) или None"""
+    value = request.args.get(name)
+    if value is None or value == '':
+        return None
+    line = int(value)
+    if line < 1:
+        raise ValueError(f"{name} должен быть не меньше 1")
+    return line
+
 @file_bp.route('/read', methods=['GET'])
 def read_file():
-    """Чтение содержимого файла"""
+    """Чтение содержимого файла.
+
+    По умолчанию возвращает JSON с содержимым; файл больше
+    FILE_READ_JSON_LIMIT отдаётся первыми FILE_READ_PAGE_LINES строками.
+    start_line/end_line (с единицы, включительно) выбирают диапазон строк
+    по кэшированному индексу смещений; если возвращена только часть файла,
+    в ответе truncated: true, и редактор листает файл страницами без
+    возможности сохранения. raw=1
+    отдаёт содержимое как есть потоком блоками: целый файл — с поддержкой
+    заголовка Range (ответ 206), диапазон строк — только нужные байты.
+    """
     path = request.args.get('path', '')
     
     if not path:
@@ -93,6 +120,13 @@ def read_file():
             "error": "Доступ запрещен"
         }), 403
     
+    try:
+        start_line = _line_arg('start_line')
+        end_line = _line_arg('end_line')
+    except ValueError as e:
+        return jsonify({"error": f"Некорректный номер строки: {str(e)}"}), 400
+    raw = request.args.get('raw') in ('1', 'true')
+    
     try:
         # Проверяем, что это файл
         if not os.path.isfile(full_path):
@@ -100,6 +134,56 @@ def read_file():
                 "error": "Указанный путь не является файлом"
             }), 400
         
+        size = os.path.getsize(full_path)
+        if start_line is None and end_line is None:
+            if raw:
+                log_manager.add_log(LogEntry(
+                    action="read_file",
+                    details=f"Прочитан файл: {path}",
+                    status="info"
+                ))
+                # send_file отдаёт файл блоками и сам обрабатывает Range и If-None-Match
+                return send_file(full_path, conditional=True, etag=True)
+            if size > FILE_READ_JSON_LIMIT:
+                start_line, end_line = 1, FILE_READ_PAGE_LINES
+        
+        if start_line is not None or end_line is not None:
+            start_line = start_line or 1
+            start, end, index = line_index.line_range(full_path, start_line, end_line)
+            end_line = min(end_line or index.total_lines, index.total_lines)
+            # Часть файла: сохранение такого содержимого перезаписало бы остальные строки
+            truncated = start_line > 1 or end_line < index.total_lines
+            headers = {
+                "X-Total-Lines": str(index.total_lines),
+                "X-Start-Line": str(start_line),
+                "X-End-Line": str(end_line)
+            }
+            log_manager.add_log(LogEntry(
+                action="read_file",
+                details=f"Прочитан файл: {path} (строки {start_line}–{end_line} из {index.total_lines})",
+                status="info"
+            ))
+            if raw:
+                # Без Content-Length: если файл успел уменьшиться, тело просто окажется короче
+                return Response(line_index.iter_bytes(full_path, start, end), headers=headers,
+                                mimetype='text/plain')
+            
+            with open(full_path, 'rb') as f:
+                f.seek(start)
+                content = f.read(end - start).decode('utf-8', errors='replace')
+            response = jsonify({
+                "path": path,
+                "content": content,
+                "start_line": start_line,
+                "end_line": end_line,
+                "total_lines": index.total_lines,
+                "size": size,
+                "truncated": truncated,
+                "page_lines": FILE_READ_PAGE_LINES
+            })
+            response.headers.update(headers)
+            return response
+        
         # Читаем содержимое файла
         with open(full_path, 'r', encoding='utf-8') as f:
             content = f.read()
@@ -115,6 +199,9 @@ def read_file():
             "content": content
         })
     
+    except HTTPException:
+        # Например, 416 от send_file для диапазона за концом файла
+        raise
     except Exception as e:
         log_manager.add_log(LogEntry(
             action="read_file",
@@ -156,6 +243,8 @@ def write_file():
         # Записываем содержимое в файл
         with open(full_path, 'w', encoding='utf-8') as f:
             f.write(content)
+        # Новый файл должен сразу появиться в списке исходного кода
+        file_index.invalidate()
         
         log_manager.add_log(LogEntry(
             action="write_file",
@@ -180,37 +269,29 @@ def write_file():
 
 @file_bp.route('/self', methods=['GET'])
 def get_self_code():
-    """Получение исходного кода приложения"""
+    """Получение списка файлов исходного кода.
+
+    Список берётся из индекса (см. FileIndex) с размером, mtime и хэшем
+    каждого файла. Ответ содержит ETag, и при неизменившемся дереве
+    повторный запрос с If-None-Match получает 304 без тела.
+    """
     try:
-        files = []
-        
-        # Функция для рекурсивного обхода директорий
-        def scan_dir(directory, relative_path=""):
-            for item in os.listdir(directory):
-                full_path = os.path.join(directory, item)
-                rel_path = os.path.join(relative_path, item)
-                
-                # Исключаем директории __pycache__, .git и т.д.
-                if os.path.isdir(full_path) and not item.startswith('.') and item != "__pycache__":
-                    scan_dir(full_path, rel_path)
-                elif os.path.isfile(full_path) and item.endswith(('.py', '.html', '.js', '.css')):
-                    files.append({
-                        "path": rel_path.replace("\\", "/"),
-                        "type": os.path.splitext(item)[1][1:]  # Расширение без точки
-                    })
-        
-        # Начинаем сканирование с корневой директории
-        scan_dir(BASE_DIR)
-        
-        log_manager.add_log(LogEntry(
-            action="get_self_code",
-            details="Получен список файлов исходного кода",
-            status="info"
-        ))
-        
-        return jsonify({
-            "files": files
-        })
+        files, etag = file_index.snapshot()
+        if etag in request.if_none_match:
+            response = Response(status=304)
+        else:
+            log_manager.add_log(LogEntry(
+                action="get_self_code",
+                details="Получен список файлов исходного кода",
+                status="info"
+            ))
+            response = jsonify({
+                "files": files
+            })
+        response.set_etag(etag)
+        # Браузер хранит ответ, но перепроверяет его по ETag при каждом запросе
+        response.headers['Cache-Control'] = 'no-cache'
+        return response
     
     except Exception as e:
         log_manager.add_log(LogEntry(
@@ -0,0 +1,259 @@
+import os
+import re
+import json
+import time
+import hashlib
+import logging
+import threading
+from typing import Dict, List, Optional, Tuple
+
+# Настройка логирования
+logger = logging.getLogger(__name__)
+
+# Корень проекта (как BASE_DIR файлового контроллера)
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SOURCE_EXTENSIONS = ('.py', '.html', '.js', '.css')
+# Правила в формате .gitignore, применяемые всегда; FILE_INDEX_IGNORE добавляет свои через запятую
+DEFAULT_IGNORE = [".*/", "__pycache__/", "node_modules/", "attached_assets/"]
+EXTRA_IGNORE = [rule.strip() for rule in os.environ.get("FILE_INDEX_IGNORE", "").split(",") if rule.strip()]
+# Не чаще этого интервала (секунды) дерево проверяется на изменения
+FILE_INDEX_TTL = float(os.environ.get("FILE_INDEX_TTL", "2"))
+
+
+def _translate(pattern: str) -> str:
+    """Шаблон .gitignore в регулярное выражение для пути с разделителями /"""
+    regex = ""
+    i = 0
+    while i < len(pattern):
+        if pattern.startswith("**/", i):
+            regex += "(?:.*/)?"
+            i += 3
+        elif pattern.startswith("**", i):
+            regex += ".*"
+            i += 2
+        elif pattern[i] == "*":
+            regex += "[^/]*"
+            i += 1
+        elif pattern[i] == "?":
+            regex += "[^/]"
+            i += 1
+        elif pattern[i] == "[" and "]" in pattern[i + 1:]:
+            end = pattern.index("]", i + 1)
+            regex += "[" + pattern[i + 1:end].replace("!", "^", 1) + "]"
+            i = end + 1
+        else:
+            regex += re.escape(pattern[i])
+            i += 1
+    return regex
+
+
+class IgnoreRules:
+    """Набор правил одного .gitignore (или правил по умолчанию) относительно каталога base"""
+
+    def __init__(self, lines: List[str], base: str = ""):
+        self.base = base
+        self.rules: List[Tuple[re.Pattern, bool, bool, bool]] = []
+        for line in lines:
+            line = line.rstrip("\n").rstrip()
+            if not line or line.startswith("#"):
+                continue
+            negate = line.startswith("!")
+            if negate:
+                line = line[1:]
+            dir_only = line.endswith("/")
+            line = line.rstrip("/")
+            # Шаблон со слешем привязан к каталогу .gitignore, без слеша — совпадает на любой глубине
+            anchored = "/" in line
+            line = line.lstrip("/")
+            if line:
+                self.rules.append((re.compile(_translate(line) + r"\Z"), negate, dir_only, anchored))
+
+    def match(self, rel_path: str, is_dir: bool) -> Optional[bool]:
+        """True — игнорировать, False — явно включён (!), None — правила не применимы"""
+        if self.base:
+            if not rel_path.startswith(self.base + "/"):
+                return None
+            rel_path = rel_path[len(self.base) + 1:]
+        name = rel_path.rsplit("/", 1)[-1]
+        result = None
+        # Как в git, решает последнее подходящее правило
+        for regex, negate, dir_only, anchored in self.rules:
+            if dir_only and not is_dir:
+                continue
+            if regex.match(rel_path if anchored else name):
+                result = not negate
+        return result
+
+
+class FileIndex:
+    """Индекс исходных файлов проекта для /api/file/self.
+
+    Дерево обходится через os.scandir, каталоги, исключённые правилами
+    (.gitignore в корне и вложенных каталогах, правила по умолчанию и
+    FILE_INDEX_IGNORE), не просматриваются. Для каждого файла хранятся
+    размер, mtime и SHA-256 содержимого; хэш пересчитывается только у
+    файлов, у которых изменились размер или mtime. Проверка выполняется
+    не чаще раза в FILE_INDEX_TTL секунд, индекс сохраняется на диск, так
+    что после перезапуска файлы заново не хэшируются. ETag — хэш всего
+    индекса, поэтому неизменившееся дерево отдаётся ответом 304.
+    """
+
+    def __init__(self, root: str = ROOT_DIR, path: Optional[str] = None, ttl: float = FILE_INDEX_TTL):
+        self.root = root
+        self.path = path or os.environ.get("FILE_INDEX_PATH", "file_index.json")
+        self.ttl = ttl
+        self.defaults = IgnoreRules(DEFAULT_IGNORE + EXTRA_IGNORE)
+
+        self._lock = threading.Lock()
+        self._loaded = False
+        # Относительный путь -> {"size", "mtime", "hash"}
+        self._files: Dict[str, Dict] = {}
+        self._listing: List[Dict] = []
+        self._etag: Optional[str] = None
+        self._checked = 0.0
+        # Путь .gitignore -> (mtime_ns, правила)
+        self._gitignores: Dict[str, Tuple[int, IgnoreRules]] = {}
+
+        self.refreshes = 0
+        self.hashed = 0
+
+    def invalidate(self):
+        """Следующий запрос проверит дерево, не дожидаясь FILE_INDEX_TTL"""
+        self._checked = 0.0
+
+    def _load(self):
+        self._loaded = True
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                data = json.load(f)
+            if data.get("root") == self.root:
+                self._files = data.get("files", {})
+        except (OSError, ValueError):
+            pass
+
+    def _save(self):
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump({"root": self.root, "files": self._files}, f, ensure_ascii=False)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            logger.error(f"Не удалось сохранить индекс файлов: {e}")
+
+    def _gitignore(self, directory: str, rel_dir: str) -> Optional[IgnoreRules]:
+        path = os.path.join(directory, ".gitignore")
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except OSError:
+            self._gitignores.pop(path, None)
+            return None
+        cached = self._gitignores.get(path)
+        if cached is None or cached[0] != mtime:
+            try:
+                with open(path, encoding="utf-8", errors="replace") as f:
+                    cached = self._gitignores[path] = (mtime, IgnoreRules(f.readlines(), rel_dir))
+            except OSError:
+                return None
+        return cached[1]
+
+    @staticmethod
+    def _ignored(rules: List[IgnoreRules], rel_path: str, is_dir: bool) -> bool:
+        ignored = False
+        # Правила вложенных .gitignore перекрывают правила внешних
+        for rule_set in rules:
+            result = rule_set.match(rel_path, is_dir)
+            if result is not None:
+                ignored = result
+        return ignored
+
+    @staticmethod
+    def _hash(path: str) -> str:
+        digest = hashlib.sha256()
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1024 * 1024), b""):
+                digest.update(block)
+        return digest.hexdigest()
+
+    def _scan(self) -> Dict[str, Dict]:
+        files: Dict[str, Dict] = {}
+        stack = [(self.root, "", [self.defaults])]
+        while stack:
+            directory, rel_dir, rules = stack.pop()
+            local = self._gitignore(directory, rel_dir)
+            if local is not None:
+                rules = rules + [local]
+            try:
+                entries = list(os.scandir(directory))
+            except OSError as e:
+                logger.warning(f"Не удалось прочитать каталог {directory}: {e}")
+                continue
+            for entry in entries:
+                rel_path = f"{rel_dir}/{entry.name}" if rel_dir else entry.name
+                try:
+                    # Тип берётся из записи каталога без отдельного stat; ссылки на каталоги не обходятся
+                    if entry.is_dir(follow_symlinks=False):
+                        if not self._ignored(rules, rel_path, True):
+                            stack.append((entry.path, rel_path, rules))
+                        continue
+                    if not entry.name.endswith(SOURCE_EXTENSIONS) or not entry.is_file():
+                        continue
+                    if self._ignored(rules, rel_path, False):
+                        continue
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                previous = self._files.get(rel_path)
+                if previous and previous["size"] == stat.st_size and previous["mtime"] == stat.st_mtime_ns:
+                    files[rel_path] = previous
+                    continue
+                try:
+                    content_hash = self._hash(entry.path)
+                except OSError:
+                    continue
+                self.hashed += 1
+                files[rel_path] = {"size": stat.st_size, "mtime": stat.st_mtime_ns, "hash": content_hash}
+        return files
+
+    def snapshot(self) -> Tuple[List[Dict], str]:
+        """Список файлов и ETag; дерево проверяется, если прошло больше FILE_INDEX_TTL"""
+        with self._lock:
+            if not self._loaded:
+                self._load()
+            now = time.monotonic()
+            if self._etag is None or now - self._checked >= self.ttl:
+                files = self._scan()
+                self._checked = time.monotonic()
+                if files != self._files or self._etag is None:
+                    changed = files != self._files
+                    self._files = files
+                    self._listing = [
+                        {
+                            "path": rel_path,
+                            "type": os.path.splitext(rel_path)[1][1:],  # Расширение без точки
+                            "size": info["size"],
+                            "mtime": info["mtime"] / 1e9,
+                            "hash": info["hash"]
+                        }
+                        for rel_path, info in sorted(files.items())
+                    ]
+                    material = "\n".join(f"{item['path']}:{item['hash']}" for item in self._listing)
+                    self._etag = hashlib.sha256(material.encode("utf-8")).hexdigest()[:32]
+                    if changed:
+                        self._save()
+                self.refreshes += 1
+            return self._listing, self._etag
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "files": len(self._files),
+                "etag": self._etag,
+                "refreshes": self.refreshes,
+                "hashed": self.hashed,
+                "ttl": self.ttl
+            }
+
+
+# Глобальный экземпляр
+file_index = FileIndex()
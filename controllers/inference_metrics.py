@@ -0,0 +1,216 @@
+import os
+import time
+import bisect
+import logging
+import threading
+from typing import Dict, List, Optional
+
+import psutil
+
+from shared_state import shared_state, is_shared_mode
+from controllers.completion_cache import normalize_model
+
+# Настройка логирования
+logger = logging.getLogger(__name__)
+
+# Окно скользящих гистограмм в секундах и число интервалов, на которые оно делится
+METRICS_WINDOW = int(os.environ.get("OLLAMA_METRICS_WINDOW", "3600"))
+METRICS_SLOTS = int(os.environ.get("OLLAMA_METRICS_SLOTS", "12"))
+# Как часто воркер публикует свои гистограммы для остальных воркеров, в секундах
+METRICS_PUBLISH_INTERVAL = 5.0
+
+
+def _log_bounds(low: float, high: float, per_decade: int = 10) -> List[float]:
+    """Геометрические границы корзин: ошибка перцентиля не больше шага (~26% при 10 на порядок)"""
+    bounds = []
+    step = 0
+    while low * 10 ** (step / per_decade) <= high:
+        bounds.append(round(low * 10 ** (step / per_decade), 6))
+        step += 1
+    return bounds
+
+
+# Метрика -> границы корзин гистограммы
+METRICS = {
+    "tokens_per_sec": _log_bounds(0.1, 10000),
+    "prompt_tokens_per_sec": _log_bounds(0.1, 100000),
+    "ttft_ms": _log_bounds(1, 1000000),
+    "load_ms": _log_bounds(1, 1000000),
+    "queue_wait_ms": _log_bounds(0.1, 1000000),
+    "total_ms": _log_bounds(1, 1000000)
+}
+
+
+class _Histogram:
+    """Счётчики по корзинам за окно, разбитое на интервалы: старые интервалы обнуляются по кругу"""
+
+    __slots__ = ("bounds", "slots", "epochs")
+
+    def __init__(self, bounds: List[float]):
+        self.bounds = bounds
+        # Каждый интервал: [счётчики корзин..., сумма, количество]
+        self.slots = [[0.0] * (len(bounds) + 3) for _ in range(METRICS_SLOTS)]
+        self.epochs = [None] * METRICS_SLOTS
+
+    def add(self, value: float, epoch: int):
+        index = epoch % METRICS_SLOTS
+        if self.epochs[index] != epoch:
+            self.slots[index] = [0.0] * (len(self.bounds) + 3)
+            self.epochs[index] = epoch
+        slot = self.slots[index]
+        slot[bisect.bisect_left(self.bounds, value)] += 1
+        slot[-2] += value
+        slot[-1] += 1
+
+    def window(self, epoch: int) -> List[float]:
+        """Сумма интервалов, попадающих в окно"""
+        total = [0.0] * (len(self.bounds) + 3)
+        for slot, slot_epoch in zip(self.slots, self.epochs):
+            if slot_epoch is not None and epoch - slot_epoch < METRICS_SLOTS:
+                for i, value in enumerate(slot):
+                    total[i] += value
+        return total
+
+
+def summarize(bounds: List[float], counts: List[float]) -> Dict:
+    """Число значений, среднее и перцентили (линейная интерполяция внутри корзины)"""
+    count = counts[-1]
+    if not count:
+        return {"count": 0}
+
+    def percentile(q: float) -> float:
+        rank = q * count
+        seen = 0.0
+        for i, bucket in enumerate(counts[:-2]):
+            if bucket and seen + bucket >= rank:
+                low = bounds[i - 1] if i > 0 else 0.0
+                high = bounds[i] if i < len(bounds) else bounds[-1]
+                return round(low + (high - low) * (rank - seen) / bucket, 2)
+            seen += bucket
+        return round(bounds[-1], 2)
+
+    return {
+        "count": int(count),
+        "mean": round(counts[-2] / count, 2),
+        "p50": percentile(0.5),
+        "p90": percentile(0.9),
+        "p99": percentile(0.99)
+    }
+
+
+class InferenceMetrics:
+    """Скользящие гистограммы скорости и задержек генерации по моделям.
+
+    Значения берутся из таймингов, которые Ollama возвращает с каждым
+    ответом (eval_count/eval_duration, prompt_eval_*, load_duration,
+    total_duration), плюс время ожидания в очереди планировщика и время до
+    первого токена. Для потоковых ответов TTFT измеряется прокси, для
+    обычных — оценивается как загрузка модели плюс обработка промпта.
+    Окно OLLAMA_METRICS_WINDOW делится на OLLAMA_METRICS_SLOTS интервалов,
+    и самый старый интервал обнуляется, когда окно сдвигается. Гистограммы
+    складываются, поэтому в режиме нескольких воркеров каждый публикует
+    свои в общее состояние, а отчёт объединяет их.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._models: Dict[str, Dict[str, _Histogram]] = {}
+        self._published = 0.0
+
+    def _epoch(self) -> int:
+        return int(time.time() // (METRICS_WINDOW / METRICS_SLOTS))
+
+    def record(self, model: str, result: Dict, ttft_ms: Optional[float] = None,
+               queue_wait: Optional[float] = None):
+        """Учёт ответа Ollama (или последнего фрагмента потока)"""
+        model = normalize_model(result.get("model") or model)
+        values = {}
+        if result.get("eval_count") and result.get("eval_duration"):
+            values["tokens_per_sec"] = result["eval_count"] / (result["eval_duration"] / 1e9)
+        if result.get("prompt_eval_count") and result.get("prompt_eval_duration"):
+            values["prompt_tokens_per_sec"] = result["prompt_eval_count"] / (result["prompt_eval_duration"] / 1e9)
+        if result.get("load_duration") is not None:
+            values["load_ms"] = result["load_duration"] / 1e6
+        if result.get("total_duration"):
+            values["total_ms"] = result["total_duration"] / 1e6
+        if ttft_ms is None and result.get("prompt_eval_duration") is not None:
+            ttft_ms = ((result.get("load_duration") or 0) + result["prompt_eval_duration"]) / 1e6
+        if ttft_ms is not None:
+            values["ttft_ms"] = ttft_ms
+        if queue_wait is not None:
+            values["queue_wait_ms"] = queue_wait * 1000
+
+        epoch = self._epoch()
+        with self._lock:
+            histograms = self._models.get(model)
+            if histograms is None:
+                histograms = self._models[model] = {name: _Histogram(bounds) for name, bounds in METRICS.items()}
+            for name, value in values.items():
+                histograms[name].add(value, epoch)
+        self._publish()
+
+    def _snapshot(self) -> Dict[str, Dict[str, List[float]]]:
+        epoch = self._epoch()
+        with self._lock:
+            return {
+                model: {name: histogram.window(epoch) for name, histogram in histograms.items()}
+                for model, histograms in self._models.items()
+            }
+
+    def _publish(self, force: bool = False):
+        if not is_shared_mode():
+            return
+        now = time.monotonic()
+        if not force and now - self._published < METRICS_PUBLISH_INTERVAL:
+            return
+        self._published = now
+        try:
+            shared_state.set(f"inference_metrics:{os.getpid()}", {"time": time.time(), "models": self._snapshot()})
+            workers = set(shared_state.get("inference_metrics_workers", []))
+            if os.getpid() not in workers:
+                shared_state.set("inference_metrics_workers", sorted(workers | {os.getpid()}))
+        except Exception as e:
+            logger.error(f"Ошибка публикации метрик генерации: {e}")
+
+    def stats(self, model: Optional[str] = None) -> Dict:
+        snapshots = [self._snapshot()]
+        if is_shared_mode():
+            self._publish(force=True)
+            snapshots = []
+            workers = shared_state.get("inference_metrics_workers", [])
+            alive = [pid for pid in workers if psutil.pid_exists(pid)]
+            if len(alive) != len(workers):
+                # Воркеры, перезапущенные gunicorn, удаляются из списка вместе с их данными,
+                # иначе список рос бы без ограничения
+                for pid in set(workers) - set(alive):
+                    shared_state.set(f"inference_metrics:{pid}", None)
+                shared_state.set("inference_metrics_workers", alive)
+            for pid in alive:
+                published = shared_state.get(f"inference_metrics:{pid}")
+                if published and time.time() - published["time"] < METRICS_WINDOW:
+                    snapshots.append(published["models"])
+
+        merged: Dict[str, Dict[str, List[float]]] = {}
+        for snapshot in snapshots:
+            for name, metrics in snapshot.items():
+                target = merged.setdefault(name, {})
+                for metric, counts in metrics.items():
+                    if metric in target:
+                        target[metric] = [a + b for a, b in zip(target[metric], counts)]
+                    else:
+                        target[metric] = list(counts)
+
+        if model:
+            model = normalize_model(model)
+            merged = {model: merged[model]} if model in merged else {}
+        return {
+            "window": METRICS_WINDOW,
+            "models": {
+                name: {metric: summarize(METRICS[metric], counts) for metric, counts in metrics.items()}
+                for name, metrics in merged.items()
+            }
+        }
+
+
+# Глобальный экземпляр
+inference_metrics = InferenceMetrics()
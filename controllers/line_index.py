@@ -0,0 +1,169 @@
+import os
+import mmap
+import hashlib
+import logging
+import threading
+from array import array
+from collections import OrderedDict
+from itertools import accumulate
+from typing import Dict, Iterator, Optional, Tuple
+
+# Настройка логирования
+logger = logging.getLogger(__name__)
+
+# Смещение запоминается для каждой LINE_INDEX_STEP-й строки: 200 МБ лога с 5 млн строк — около 160 КБ
+LINE_INDEX_STEP = int(os.environ.get("LINE_INDEX_STEP", "256"))
+LINE_INDEX_FILES = int(os.environ.get("LINE_INDEX_FILES", "32"))
+CHUNK_SIZE = 1024 * 1024
+# По хвосту проиндексированной части проверяется, что файл только дописывался
+TAIL_BYTES = 4096
+
+
+class LineIndex:
+    """Разреженный индекс смещений строк одного файла"""
+
+    __slots__ = ("size", "mtime", "checkpoints", "newlines", "ends_with_newline", "tail_hash")
+
+    def __init__(self):
+        self.size = 0
+        self.mtime = 0
+        # checkpoints[k] — смещение начала строки k * LINE_INDEX_STEP (строки с нуля)
+        self.checkpoints = array("q", [0])
+        self.newlines = 0
+        self.ends_with_newline = True
+        self.tail_hash = None
+
+    @property
+    def total_lines(self) -> int:
+        if self.size == 0:
+            return 0
+        return self.newlines + (0 if self.ends_with_newline else 1)
+
+    def extend(self, f, start: int, end: int):
+        """Индексирование байтов [start, end) файла; строки до start уже учтены"""
+        f.seek(start)
+        offset = start
+        while offset < end:
+            chunk = f.read(min(CHUNK_SIZE, end - offset))
+            if not chunk:
+                break
+            count = chunk.count(b"\n")
+            next_line = len(self.checkpoints) * LINE_INDEX_STEP
+            if count and self.newlines + count >= next_line:
+                # Начала строк внутри блока: после каждого перевода строки
+                starts = list(accumulate(len(part) + 1 for part in chunk.split(b"\n")[:-1]))
+                for line in range(next_line, self.newlines + count + 1, LINE_INDEX_STEP):
+                    self.checkpoints.append(offset + starts[line - self.newlines - 1])
+            self.newlines += count
+            offset += len(chunk)
+            self.ends_with_newline = chunk.endswith(b"\n")
+        self.size = offset
+
+
+class LineIndexCache:
+    """Кэш индексов строк для постраничного чтения больших файлов.
+
+    Индекс хранит смещение каждой LINE_INDEX_STEP-й строки, поэтому поиск
+    строки — переход к ближайшей опорной точке и не больше шага поисков
+    перевода строки в отображённом в память файле (mmap). Индекс строится
+    блоками (подсчёт и разбиение выполняются в C), проверяется по размеру
+    и mtime файла, а если файл только дописывался (лог), индексируется
+    лишь новая часть.
+    """
+
+    def __init__(self, max_files: int = LINE_INDEX_FILES):
+        self.max_files = max_files
+        self._lock = threading.Lock()
+        self._indexes: "OrderedDict[str, LineIndex]" = OrderedDict()
+
+        self.builds = 0
+        self.extends = 0
+        self.hits = 0
+
+    @staticmethod
+    def _tail_hash(f, size: int) -> str:
+        f.seek(max(0, size - TAIL_BYTES))
+        return hashlib.sha256(f.read(min(size, TAIL_BYTES))).hexdigest()
+
+    def get(self, path: str) -> LineIndex:
+        stat = os.stat(path)
+        with self._lock:
+            index = self._indexes.get(path)
+            if index is not None:
+                self._indexes.move_to_end(path)
+        if index is not None and index.size == stat.st_size and index.mtime == stat.st_mtime_ns:
+            self.hits += 1
+            return index
+
+        with open(path, "rb") as f:
+            if (index is not None and stat.st_size > index.size
+                    and self._tail_hash(f, index.size) == index.tail_hash):
+                # Файл дописан: старые смещения верны, индексируется только новая часть
+                self.extends += 1
+                updated = LineIndex()
+                updated.checkpoints = array("q", index.checkpoints)
+                updated.newlines = index.newlines
+                updated.extend(f, index.size, stat.st_size)
+            else:
+                self.builds += 1
+                updated = LineIndex()
+                updated.extend(f, 0, stat.st_size)
+            updated.mtime = stat.st_mtime_ns
+            updated.tail_hash = self._tail_hash(f, updated.size)
+
+        with self._lock:
+            self._indexes[path] = updated
+            self._indexes.move_to_end(path)
+            while len(self._indexes) > self.max_files:
+                self._indexes.popitem(last=False)
+        return updated
+
+    @staticmethod
+    def _offset(mm: mmap.mmap, index: LineIndex, line: int) -> int:
+        """Смещение начала строки line (с нуля); за концом файла — размер файла"""
+        if line >= index.total_lines:
+            return index.size
+        checkpoint = line // LINE_INDEX_STEP
+        offset = index.checkpoints[checkpoint]
+        for _ in range(line - checkpoint * LINE_INDEX_STEP):
+            offset = mm.find(b"\n", offset) + 1
+        return offset
+
+    def line_range(self, path: str, start_line: int, end_line: Optional[int]) -> Tuple[int, int, LineIndex]:
+        """Байтовый диапазон [начало, конец) строк start_line..end_line (с единицы, включительно)"""
+        index = self.get(path)
+        total = index.total_lines
+        end_line = total if end_line is None else min(end_line, total)
+        if index.size == 0 or start_line > end_line:
+            return 0, 0, index
+        with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            start = self._offset(mm, index, start_line - 1)
+            end = self._offset(mm, index, end_line)
+        return start, end, index
+
+    @staticmethod
+    def iter_bytes(path: str, start: int, end: int, chunk_size: int = 64 * 1024) -> Iterator[bytes]:
+        """Байты [start, end) файла блоками, без чтения файла целиком"""
+        with open(path, "rb") as f:
+            f.seek(start)
+            remaining = end - start
+            while remaining > 0:
+                chunk = f.read(min(chunk_size, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                yield chunk
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "files": len(self._indexes),
+                "step": LINE_INDEX_STEP,
+                "builds": self.builds,
+                "extends": self.extends,
+                "hits": self.hits
+            }
+
+
+# Глобальный экземпляр
+line_index = LineIndexCache()
@@ -1,46 +1,65 @@
-
 from flask import Blueprint, jsonify, request
-from models.log_manager import LogEntry, log_manager
+from models import log_manager, LogEntry
+from controllers.model_settings import model_settings, OPTION_TYPES
 
 model_params_bp = Blueprint('model_params', __name__, url_prefix='/api/model-params')
 
-@model_params_bp.route('/settings/<model_name>', methods=['GET'])
+@model_params_bp.route('/settings', methods=['GET'])
+def list_model_settings():
+    """Сохранённые параметры всех моделей и список допустимых параметров"""
+    return jsonify({
+        "settings": model_settings.all(),
+        "options": sorted(OPTION_TYPES)
+    })
+
+@model_params_bp.route('/settings/<path:model_name>', methods=['GET'])
 def get_model_settings(model_name):
-    """Получение настроек модели"""
-    try:
-        # TODO: Реализовать получение настроек из базы данных
-        default_settings = {
-            'temperature': 0.7,
-            'top_p': 0.9,
-            'max_tokens': 2048,
-            'presence_penalty': 0,
-            'frequency_penalty': 0
-        }
-        return jsonify(default_settings)
-    except Exception as e:
-        log_manager.add_log(LogEntry(
-            action="get_model_settings",
-            details=f"Ошибка при получении настроек модели {model_name}: {str(e)}",
-            status="error"
-        ))
-        return jsonify({"error": str(e)}), 500
-
-@model_params_bp.route('/settings/<model_name>', methods=['POST'])
+    """Получение настроек модели; пустые options — значения Ollama по умолчанию"""
+    settings = model_settings.get(model_name)
+    return jsonify({
+        "model": model_name,
+        "options": settings.get("options", {}),
+        "keep_alive": settings.get("keep_alive")
+    })
+
+@model_params_bp.route('/settings/<path:model_name>', methods=['POST'])
 def update_model_settings(model_name):
-    """Обновление настроек модели"""
+    """Обновление настроек модели.
+
+    Принимает {"options": {...}, "keep_alive": ...} или параметры на
+    верхнем уровне (num_ctx, num_thread, num_batch, num_gpu, temperature
+    и т.д.); null удаляет параметр. Настройки применяются ко всем
+    последующим запросам к модели.
+    """
+    data = request.json
+    if not isinstance(data, dict):
+        return jsonify({"error": "Неверный формат данных"}), 400
+
     try:
-        data = request.json
-        # TODO: Сохранение настроек в базу данных
-        log_manager.add_log(LogEntry(
-            action="update_model_settings",
-            details=f"Настройки модели {model_name} обновлены",
-            status="success"
-        ))
-        return jsonify({"message": "Настройки обновлены"})
-    except Exception as e:
-        log_manager.add_log(LogEntry(
-            action="update_model_settings", 
-            details=f"Ошибка при обновлении настроек модели {model_name}: {str(e)}",
-            status="error"
-        ))
-        return jsonify({"error": str(e)}), 500
+        settings = model_settings.update(model_name, data)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    log_manager.add_log(LogEntry(
+        action="update_model_settings",
+        details=f"Настройки модели {model_name} обновлены: {settings or 'по умолчанию'}",
+        status="success"
+    ))
+    return jsonify({
+        "message": "Настройки обновлены",
+        "model": model_name,
+        "options": settings.get("options", {}),
+        "keep_alive": settings.get("keep_alive")
+    })
+
+@model_params_bp.route('/settings/<path:model_name>', methods=['DELETE'])
+def reset_model_settings(model_name):
+    """Сброс настроек модели к значениям Ollama по умолчанию"""
+    if not model_settings.reset(model_name):
+        return jsonify({"error": "Настройки модели не заданы"}), 404
+    log_manager.add_log(LogEntry(
+        action="update_model_settings",
+        details=f"Настройки модели {model_name} сброшены",
+        status="info"
+    ))
+    return jsonify({"message": "Настройки сброшены"})
@@ -0,0 +1,298 @@
+import os
+import time
+import logging
+import threading
+from typing import Dict, List, Optional
+from urllib.parse import urlparse
+
+import psutil
+import requests
+
+from models import log_manager, LogEntry
+from shared_state import shared_state, FileLock
+from controllers.ollama_client import ollama_client
+from controllers.ollama_backends import backend_pool
+from controllers.ollama_scheduler import ollama_scheduler
+from controllers.completion_cache import normalize_model
+from controllers.model_settings import model_settings
+
+# Настройка логирования
+logger = logging.getLogger(__name__)
+
+# Модели, загружаемые при старте (через запятую), и сколько Ollama держит их в памяти
+PREWARM_MODELS = [model.strip() for model in os.environ.get("OLLAMA_PREWARM_MODELS", "").split(",") if model.strip()]
+PREWARM_KEEP_ALIVE = os.environ.get("OLLAMA_PREWARM_KEEP_ALIVE", "30m")
+# Загрузка модели дольше этого порога (мс) считается холодным стартом
+COLD_START_MS = float(os.environ.get("OLLAMA_COLD_START_MS", "500"))
+# Порог занятой памяти (в процентах), выше которого выгружаются простаивающие модели
+EVICT_MEMORY_PERCENT = float(os.environ.get("OLLAMA_EVICT_MEMORY_PERCENT", "90"))
+RESIDENCY_INTERVAL = float(os.environ.get("OLLAMA_RESIDENCY_INTERVAL", "15"))
+
+LOCAL_HOSTS = ("localhost", "127.0.0.1", "::1", "0.0.0.0")
+
+
+class _ModelUsage:
+    __slots__ = ("requests", "cold_starts", "cold_load_ms_total", "cold_load_ms_max", "last_used")
+
+    def __init__(self):
+        self.requests = 0
+        self.cold_starts = 0
+        self.cold_load_ms_total = 0.0
+        self.cold_load_ms_max = 0.0
+        self.last_used = None
+
+
+class ResidencyManager:
+    """Управление тем, какие модели Ollama держит в памяти.
+
+    Загруженные модели берутся из /api/ps, который опрашивает пул серверов.
+    Закреплённые модели (pin) загружаются с keep_alive=-1 и получают тот же
+    keep_alive в каждом запросе, иначе Ollama вернул бы им срок по умолчанию.
+    Модели из OLLAMA_PREWARM_MODELS загружаются при старте. Когда занятая
+    память (psutil, как в мониторе системы) превышает порог, с локальных
+    серверов Ollama выгружается модель, которая дольше всех простаивает и не
+    закреплена. Холодный старт определяется по load_duration в ответе Ollama.
+    Фоновая проверка выполняется в одном воркере за интервал (блокировка на
+    файле), закрепления хранятся в общем состоянии.
+    """
+
+    def __init__(self, lock_path: Optional[str] = None):
+        self._lock = threading.Lock()
+        self._usage: Dict[str, _ModelUsage] = {}
+        self._tick_lock = FileLock(lock_path or os.environ.get("OLLAMA_RESIDENCY_LOCK", "residency.lock"))
+        self._thread: Optional[threading.Thread] = None
+        self._thread_pid = None
+        self.evictions = 0
+        self.prewarmed: List[str] = []
+
+    def _model(self, model: str) -> _ModelUsage:
+        usage = self._usage.get(model)
+        if usage is None:
+            usage = self._usage[model] = _ModelUsage()
+        return usage
+
+    def pinned(self) -> Dict:
+        return shared_state.get("pinned_models", {})
+
+    def keep_alive_for(self, model: str):
+        """keep_alive закреплённой модели или None"""
+        return self.pinned().get(normalize_model(model))
+
+    def observe(self, result: Dict, model: Optional[str] = None):
+        """Учёт ответа Ollama (последнего фрагмента потока): время загрузки модели"""
+        model = result.get("model") or model
+        if not model:
+            return
+        self.start()
+        load_ms = (result.get("load_duration") or 0) / 1e6
+        with self._lock:
+            usage = self._model(normalize_model(model))
+            usage.requests += 1
+            usage.last_used = time.time()
+            if load_ms >= COLD_START_MS:
+                usage.cold_starts += 1
+                usage.cold_load_ms_total += load_ms
+                usage.cold_load_ms_max = max(usage.cold_load_ms_max, load_ms)
+        if load_ms >= COLD_START_MS:
+            log_manager.add_log(LogEntry(
+                action="model_residency",
+                details=f"Холодный старт модели {model}: загрузка {load_ms:.0f} мс",
+                status="warning"
+            ))
+
+    def load(self, model: str, keep_alive, backends=None) -> List[str]:
+        """Загрузка модели в память серверов (пустой запрос к /api/generate); возвращает ошибки"""
+        payload = {"model": model, "stream": False}
+        # Другие num_ctx или num_gpu в первом запросе заставили бы Ollama загрузить модель заново
+        options = model_settings.options_for(model)
+        if options:
+            payload["options"] = options
+        if keep_alive is not None:
+            payload["keep_alive"] = keep_alive
+        errors = []
+        for backend in backends or [backend for backend in backend_pool.backends() if backend.healthy]:
+            try:
+                response = ollama_client.post(
+                    "/api/generate",
+                    json=payload,
+                    # Загрузка большой модели с диска занимает десятки секунд
+                    read_timeout=600,
+                    backend=backend
+                )
+                if response.status_code != 200:
+                    errors.append(f"{backend.url}: код ответа {response.status_code}")
+            except requests.RequestException as e:
+                errors.append(f"{backend.url}: {str(e)}")
+        return errors
+
+    def pin(self, model: str, keep_alive=-1) -> List[str]:
+        """Закрепление модели в памяти на всех серверах"""
+        pinned = dict(self.pinned())
+        pinned[normalize_model(model)] = keep_alive
+        shared_state.set("pinned_models", pinned)
+        errors = self.load(model, keep_alive)
+        log_manager.add_log(LogEntry(
+            action="model_residency",
+            details=f"Модель {model} закреплена в памяти (keep_alive {keep_alive})"
+                    + (f"; ошибки: {'; '.join(errors)}" if errors else ""),
+            status="error" if errors else "success"
+        ))
+        return errors
+
+    def unpin(self, model: str) -> bool:
+        """Снятие закрепления: модель выгрузится по обычному сроку keep_alive"""
+        pinned = dict(self.pinned())
+        if pinned.pop(normalize_model(model), None) is None:
+            return False
+        shared_state.set("pinned_models", pinned)
+        # Запрос без keep_alive возвращает модели срок по умолчанию сервера Ollama. Только там,
+        # где модель в памяти (/api/ps): иначе этот запрос загрузил бы её с диска
+        name = normalize_model(model)
+        resident = [backend for backend in backend_pool.backends() if backend.healthy and name in backend.resident]
+        if resident:
+            self.load(model, None, resident)
+        log_manager.add_log(LogEntry(
+            action="model_residency",
+            details=f"Снято закрепление модели {model}",
+            status="info"
+        ))
+        return True
+
+    def evict(self, model: str, backends=None) -> List[str]:
+        """Выгрузка модели из памяти (keep_alive 0); закрепление модели снимается"""
+        pinned = dict(self.pinned())
+        name = normalize_model(model)
+        if pinned.pop(name, None) is not None:
+            shared_state.set("pinned_models", pinned)
+        if backends is None:
+            # Как и в unpin: запрос с keep_alive=0 к серверу без модели загрузил бы её с диска
+            backends = [backend for backend in backend_pool.backends()
+                        if backend.healthy and name in backend.resident]
+        if not backends:
+            log_manager.add_log(LogEntry(
+                action="model_residency",
+                details=f"Модель {model} не загружена ни на одном сервере",
+                status="info"
+            ))
+            return []
+        errors = self.load(model, 0, backends)
+        with self._lock:
+            self.evictions += 1
+        log_manager.add_log(LogEntry(
+            action="model_residency",
+            details=f"Модель {model} выгружена из памяти"
+                    + (f"; ошибки: {'; '.join(errors)}" if errors else ""),
+            status="error" if errors else "info"
+        ))
+        return errors
+
+    def prewarm(self):
+        """Загрузка моделей из OLLAMA_PREWARM_MODELS; в нескольких воркерах — один раз"""
+        if not PREWARM_MODELS:
+            return
+        with self._tick_lock:
+            if shared_state.get("prewarmed_at", 0) > time.time() - 60:
+                return
+            shared_state.set("prewarmed_at", time.time())
+        for model in PREWARM_MODELS:
+            keep_alive = self.keep_alive_for(model) or PREWARM_KEEP_ALIVE
+            errors = self.load(model, keep_alive)
+            if not errors:
+                self.prewarmed.append(model)
+            log_manager.add_log(LogEntry(
+                action="model_residency",
+                details=f"Предварительная загрузка модели {model}"
+                        + (f" не удалась: {'; '.join(errors)}" if errors else " выполнена"),
+                status="error" if errors else "success"
+            ))
+
+    def _evict_idle(self):
+        """Выгрузка одной простаивающей модели с локальных серверов при нехватке памяти"""
+        memory = psutil.virtual_memory()
+        if memory.percent < EVICT_MEMORY_PERCENT:
+            return
+        pinned = self.pinned()
+        busy = {normalize_model(name) for name, stats in ollama_scheduler.stats()["models"].items()
+                if stats["in_flight"]}
+        candidates = []
+        for backend in backend_pool.backends():
+            # psutil видит память только этой машины
+            if urlparse(backend.url).hostname not in LOCAL_HOSTS:
+                continue
+            for name, info in backend.resident.items():
+                if normalize_model(name) in pinned or normalize_model(name) in busy:
+                    continue
+                # Раньше всех истекает срок у модели, к которой дольше всех не обращались
+                candidates.append((info.get("expires_at") or "", name, backend))
+        if not candidates:
+            return
+        _, name, backend = min(candidates, key=lambda candidate: candidate[0])
+        logger.warning(f"Память занята на {memory.percent}%: выгружается модель {name} с {backend.url}")
+        self.evict(name, [backend])
+        backend_pool.probe(backend)
+
+    def start(self):
+        """Запуск фоновой проверки (предзагрузка и выгрузка при нехватке памяти)"""
+        # Поток не наследуется при fork, поэтому проверяется PID
+        if self._thread is not None and self._thread_pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is not None and self._thread_pid == os.getpid():
+                return
+            self._thread_pid = os.getpid()
+            self._thread = threading.Thread(target=self._loop, name="ollama-residency", daemon=True)
+            self._thread.start()
+
+    def _loop(self):
+        try:
+            self.prewarm()
+        except Exception as e:
+            logger.error(f"Ошибка предварительной загрузки моделей: {e}")
+        while True:
+            time.sleep(RESIDENCY_INTERVAL)
+            try:
+                with self._tick_lock:
+                    # Проверку за интервал выполняет только один воркер
+                    last = float(self._tick_lock.read_value() or 0)
+                    if time.time() - last < RESIDENCY_INTERVAL * 0.9:
+                        continue
+                    self._tick_lock.write_value(f"{time.time():.3f}")
+                self._evict_idle()
+            except Exception as e:
+                logger.error(f"Ошибка проверки загруженных моделей: {e}")
+
+    def stats(self) -> Dict:
+        memory = psutil.virtual_memory()
+        pinned = self.pinned()
+        loaded = {
+            backend.url: {name: dict(info, pinned=name in pinned) for name, info in backend.resident.items()}
+            for backend in backend_pool.backends()
+        }
+        with self._lock:
+            models = {}
+            for name, usage in self._usage.items():
+                models[name] = {
+                    "requests": usage.requests,
+                    "cold_starts": usage.cold_starts,
+                    "cold_start_rate": round(usage.cold_starts / usage.requests, 3) if usage.requests else 0.0,
+                    "cold_load_avg_ms": round(usage.cold_load_ms_total / usage.cold_starts, 1)
+                                        if usage.cold_starts else 0.0,
+                    "cold_load_max_ms": round(usage.cold_load_ms_max, 1),
+                    "last_used": usage.last_used
+                }
+            return {
+                "pinned": pinned,
+                "prewarm": PREWARM_MODELS,
+                "prewarmed": list(self.prewarmed),
+                "cold_start_ms": COLD_START_MS,
+                "cold_starts": sum(usage.cold_starts for usage in self._usage.values()),
+                "evictions": self.evictions,
+                "memory_percent": memory.percent,
+                "evict_memory_percent": EVICT_MEMORY_PERCENT,
+                "loaded": loaded,
+                "models": models
+            }
+
+
+# Глобальный экземпляр
+residency_manager = ResidencyManager()
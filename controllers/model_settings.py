@@ -0,0 +1,135 @@
+import logging
+from typing import Dict, Optional
+
+from shared_state import shared_state
+from controllers.completion_cache import normalize_model
+
+# Настройка логирования
+logger = logging.getLogger(__name__)
+
+# Параметры Ollama (options запроса), которые можно задать для модели, и их типы
+OPTION_TYPES = {
+    # Скорость и память: размер контекста, потоки CPU, размер пакета, слои на GPU
+    "num_ctx": int,
+    "num_thread": int,
+    "num_batch": int,
+    "num_gpu": int,
+    # Сэмплирование
+    "num_predict": int,
+    "temperature": float,
+    "top_p": float,
+    "top_k": int,
+    "min_p": float,
+    "repeat_penalty": float,
+    "presence_penalty": float,
+    "frequency_penalty": float,
+    "seed": int
+}
+# Старые имена параметров из интерфейса
+OPTION_ALIASES = {"max_tokens": "num_predict"}
+
+
+class ModelSettings:
+    """Сохранённые параметры запуска моделей.
+
+    Параметры хранятся в общем состоянии (SQLite, общий для воркеров и
+    переживающий перезапуск), а чтение обслуживается из его копии в
+    памяти, поэтому добавление параметров к каждому запросу ничего не
+    стоит. options модели подставляются в запросы generate и chat, а
+    параметры, явно переданные клиентом, имеют приоритет. keep_alive
+    модели передаётся Ollama вместе с запросом.
+    """
+
+    KEY = "model_settings"
+
+    def all(self) -> Dict[str, Dict]:
+        return shared_state.get(self.KEY, {})
+
+    def get(self, model: str) -> Dict:
+        return self.all().get(normalize_model(model), {})
+
+    def options_for(self, model: str) -> Dict:
+        return self.get(model).get("options", {})
+
+    def keep_alive_for(self, model: str):
+        return self.get(model).get("keep_alive")
+
+    @staticmethod
+    def parse(data: Dict) -> Dict:
+        """Проверка и приведение типов; ValueError для неизвестного параметра или значения.
+
+        Принимает {"options": {...}, "keep_alive": ...} или параметры на
+        верхнем уровне; значение null удаляет параметр.
+        """
+        if not isinstance(data.get("options") or {}, dict):
+            raise ValueError("options должен быть объектом")
+        values = dict(data.get("options") or {})
+        values.update({key: value for key, value in data.items() if key != "options"})
+        options, keep_alive = {}, None
+        for key, value in values.items():
+            if key == "keep_alive":
+                keep_alive = value
+                continue
+            name = OPTION_ALIASES.get(key, key)
+            if name not in OPTION_TYPES:
+                raise ValueError(f"Неизвестный параметр модели: {key}")
+            if value is None:
+                options[name] = None
+                continue
+            try:
+                options[name] = OPTION_TYPES[name](value)
+            except (TypeError, ValueError):
+                raise ValueError(f"Некорректное значение параметра {key}: {value!r}")
+        if keep_alive is not None and not isinstance(keep_alive, (int, float, str)):
+            raise ValueError(f"Некорректное значение keep_alive: {keep_alive!r}")
+        if isinstance(keep_alive, str) and keep_alive.strip().lstrip("-").isdigit():
+            # Ollama принимает строку только с единицей ("5m"), число без единицы — в секундах
+            keep_alive = int(keep_alive)
+        return {"options": options, "keep_alive": keep_alive, "reset_keep_alive": "keep_alive" in values}
+
+    def update(self, model: str, data: Dict) -> Dict:
+        """Изменение параметров модели; возвращает сохранённые параметры"""
+        parsed = self.parse(data)
+        name = normalize_model(model)
+        settings = dict(self.all())
+        current = settings.get(name, {})
+        options = dict(current.get("options", {}))
+        for key, value in parsed["options"].items():
+            if value is None:
+                options.pop(key, None)
+            else:
+                options[key] = value
+
+        updated = {"options": options} if options else {}
+        keep_alive = parsed["keep_alive"] if parsed["reset_keep_alive"] else current.get("keep_alive")
+        if keep_alive is not None:
+            updated["keep_alive"] = keep_alive
+        if updated:
+            settings[name] = updated
+        else:
+            settings.pop(name, None)
+        shared_state.set(self.KEY, settings)
+        return updated
+
+    def reset(self, model: str) -> bool:
+        settings = dict(self.all())
+        if settings.pop(normalize_model(model), None) is None:
+            return False
+        shared_state.set(self.KEY, settings)
+        return True
+
+    def apply(self, model: str, payload: Dict, client_options: Optional[Dict] = None) -> Dict:
+        """payload с параметрами модели: options клиента перекрывают сохранённые"""
+        settings = self.get(model)
+        if not settings:
+            return payload
+        options = dict(settings.get("options", {}), **(client_options or {}))
+        if options:
+            payload["options"] = options
+        if settings.get("keep_alive") is not None:
+            payload["keep_alive"] = settings["keep_alive"]
+        return payload
+
+
+# Глобальный экземпляр
+model_settings = ModelSettings()
@@ -0,0 +1,347 @@
+import os
+import time
+import random
+import logging
+import threading
+from typing import Dict, Iterable, List, Optional
+
+import requests
+
+from shared_state import shared_state
+from controllers.completion_cache import normalize_model
+
+# Настройка логирования
+logger = logging.getLogger(__name__)
+
+# Серверы Ollama по умолчанию: OLLAMA_API_URLS (через запятую) или один OLLAMA_API_URL
+DEFAULT_OLLAMA_URLS = [
+    url.strip().rstrip("/")
+    for url in os.environ.get("OLLAMA_API_URLS", os.environ.get("OLLAMA_API_URL", "http://localhost:11434")).split(",")
+    if url.strip()
+]
+
+# Интервал фоновой проверки серверов, в секундах
+HEALTH_INTERVAL = float(os.environ.get("OLLAMA_HEALTH_INTERVAL", "10"))
+HEALTH_TIMEOUT = float(os.environ.get("OLLAMA_HEALTH_TIMEOUT", "2"))
+# Автоматический выключатель: сколько ошибок подряд размыкают цепь и на сколько секунд
+BREAKER_THRESHOLD = int(os.environ.get("OLLAMA_BREAKER_THRESHOLD", "2"))
+BREAKER_COOLDOWN = float(os.environ.get("OLLAMA_BREAKER_COOLDOWN", "5"))
+BREAKER_MAX_COOLDOWN = float(os.environ.get("OLLAMA_BREAKER_MAX_COOLDOWN", "60"))
+
+
+class BackendUnavailable(requests.ConnectionError):
+    """Все подходящие серверы отключены выключателем; запрос не отправлялся"""
+
+    def __init__(self, message: str, retry_after: int):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def parse_urls(value) -> List[str]:
+    """Список URL из строки через запятую или из списка"""
+    if isinstance(value, str):
+        value = value.split(",")
+    return [url.strip().rstrip("/") for url in value or [] if url and url.strip()]
+
+
+class Backend:
+    """Сервер Ollama и его состояние по результатам проверок.
+
+    state — состояние автоматического выключателя: closed (запросы идут),
+    open (запросы не отправляются до истечения cooldown) или half_open
+    (пропущен один пробный запрос). healthy равно state == "closed".
+    """
+
+    def __init__(self, url: str):
+        self.url = url
+        # До первой проверки сервер считается доступным
+        self.healthy = True
+        self.state = "closed"
+        self.consecutive_failures = 0
+        self.opened_at = None
+        self.cooldown = BREAKER_COOLDOWN
+        self.trial_started = None
+        self.last_ok = None
+        self.outstanding = 0
+        self.loaded: set = set()
+        # Загруженные модели по данным /api/ps: имя -> size, size_vram, expires_at
+        self.resident: Dict[str, Dict] = {}
+        self.available: set = set()
+        self.version = None
+        self.latency_ms = None
+        self.last_probe = None
+        self.last_error = None
+        self.requests = 0
+        self.failures = 0
+
+    def to_dict(self) -> Dict:
+        return {
+            "url": self.url,
+            "healthy": self.healthy,
+            "state": self.state,
+            "retry_after": self.retry_after(),
+            "last_ok": self.last_ok,
+            "outstanding": self.outstanding,
+            "loaded_models": sorted(self.loaded),
+            "available_models": len(self.available),
+            "version": self.version,
+            "latency_ms": self.latency_ms,
+            "last_probe": self.last_probe,
+            "last_error": self.last_error,
+            "requests": self.requests,
+            "failures": self.failures
+        }
+
+    def retry_after(self) -> Optional[float]:
+        """Через сколько секунд выключатель пропустит пробный запрос"""
+        if self.state != "open":
+            return None
+        return round(max(0.0, self.opened_at + self.cooldown - time.monotonic()), 1)
+
+
+class BackendPool:
+    """Пул серверов Ollama с проверкой доступности и балансировкой.
+
+    Фоновый поток раз в OLLAMA_HEALTH_INTERVAL секунд запрашивает у каждого
+    сервера /api/version, /api/ps (загруженные модели) и /api/tags
+    (установленные модели). Запрос направляется на доступный сервер, где
+    модель уже загружена, иначе — где она установлена, иначе — на любой
+    доступный; среди подходящих выбирается сервер с наименьшим числом
+    незавершённых запросов. Список серверов хранится в общем состоянии и
+    одинаков во всех воркерах.
+
+    Каждый сервер защищён автоматическим выключателем: после
+    OLLAMA_BREAKER_THRESHOLD ошибок подключения подряд (или неудачной
+    проверки) цепь размыкается, и запросы к серверу не отправляются
+    OLLAMA_BREAKER_COOLDOWN секунд. Затем один запрос или проверка
+    пропускается пробно: успех замыкает цепь, ошибка снова размыкает её с
+    удвоенной паузой (до OLLAMA_BREAKER_MAX_COOLDOWN). Если разомкнуты все
+    серверы, запрос завершается сразу с BackendUnavailable.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._backends: Dict[str, Backend] = {}
+        self._urls: List[str] = []
+        self._session = requests.Session()
+        self._prober: Optional[threading.Thread] = None
+        self._prober_pid = None
+        self._wakeup = threading.Event()
+        self._listeners = []
+
+    @property
+    def urls(self) -> List[str]:
+        return parse_urls(shared_state.get("ollama_api_urls", DEFAULT_OLLAMA_URLS)) or DEFAULT_OLLAMA_URLS
+
+    def set_urls(self, urls: Iterable[str]):
+        """Замена списка серверов во всех воркерах"""
+        shared_state.set("ollama_api_urls", list(urls))
+        self._sync()
+        self._wakeup.set()
+
+    def on_change(self, callback):
+        """Подписка на изменение числа доступных серверов (callback(healthy_count))"""
+        self._listeners.append(callback)
+
+    def _sync(self) -> List[Backend]:
+        """Список серверов из общего состояния; состояние известных серверов сохраняется"""
+        urls = self.urls
+        with self._lock:
+            changed = urls != self._urls
+            if changed:
+                self._backends = {url: self._backends.get(url) or Backend(url) for url in urls}
+                self._urls = urls
+            backends = list(self._backends.values())
+        if changed:
+            self._notify()
+        self._ensure_prober()
+        return backends
+
+    def backends(self) -> List[Backend]:
+        return self._sync()
+
+    def healthy_count(self) -> int:
+        return sum(1 for backend in self.backends() if backend.healthy)
+
+    def choose(self, model: Optional[str] = None, exclude: Iterable[str] = (),
+               prefer: Optional[str] = None) -> Optional[Backend]:
+        """Выбор сервера для запроса; None, если все серверы уже перепробованы.
+
+        prefer — URL сервера, который выбирается, пока он доступен (например,
+        сервер с KV-кэшем чат-сессии).
+        """
+        exclude = set(exclude)
+        candidates = [backend for backend in self.backends() if backend.url not in exclude]
+        if not candidates:
+            return None
+        closed = [backend for backend in candidates if backend.state == "closed"]
+        if not closed:
+            # Все цепи разомкнуты: пробный запрос к серверу, у которого истекла пауза
+            for backend in sorted(candidates, key=lambda backend: backend.retry_after() or 0):
+                if self.admit(backend):
+                    return backend
+            return None
+        candidates = closed
+        for backend in candidates:
+            if backend.url == prefer:
+                return backend
+        if model:
+            name = normalize_model(model)
+            candidates = ([backend for backend in candidates if name in backend.loaded]
+                          or [backend for backend in candidates if name in backend.available]
+                          or candidates)
+        with self._lock:
+            least = min(backend.outstanding for backend in candidates)
+            return random.choice([backend for backend in candidates if backend.outstanding == least])
+
+    def acquire(self, backend: Backend):
+        with self._lock:
+            backend.outstanding += 1
+            backend.requests += 1
+
+    def release(self, backend: Backend):
+        with self._lock:
+            backend.outstanding -= 1
+
+    def admit(self, backend: Backend) -> bool:
+        """Можно ли отправить запрос на сервер; для разомкнутой цепи — один пробный запрос"""
+        with self._lock:
+            now = time.monotonic()
+            if backend.state == "closed":
+                return True
+            if backend.state == "half_open":
+                # Пробный запрос мог зависнуть: через паузу пропускается следующий
+                if now - backend.trial_started < backend.cooldown:
+                    return False
+            elif now < backend.opened_at + backend.cooldown:
+                return False
+            backend.state = "half_open"
+            backend.trial_started = now
+            return True
+
+    def unavailable(self) -> BackendUnavailable:
+        """Ошибка для запроса, отклонённого без обращения к серверам"""
+        waits = [backend.retry_after() for backend in self.backends() if backend.state == "open"]
+        retry_after = max(1, int(min(waits) + 0.999)) if waits else 1
+        return BackendUnavailable("Ollama недоступна: цепь разомкнута после ошибок подключения", retry_after)
+
+    def record_success(self, backend: Backend):
+        """Сервер ответил: цепь замыкается"""
+        with self._lock:
+            backend.consecutive_failures = 0
+            backend.last_ok = time.time()
+            if backend.state == "closed":
+                return
+            backend.state = "closed"
+            backend.healthy = True
+            backend.cooldown = BREAKER_COOLDOWN
+            backend.last_error = None
+        logger.info(f"Сервер Ollama {backend.url} снова доступен")
+        self._notify()
+
+    def mark_failed(self, backend: Backend, error: Exception, immediate: bool = False):
+        """Ошибка подключения; immediate размыкает цепь без учёта порога"""
+        with self._lock:
+            backend.failures += 1
+            backend.consecutive_failures += 1
+            backend.last_error = str(error)
+            if backend.state == "half_open":
+                # Пробный запрос не прошёл: пауза удваивается
+                backend.cooldown = min(backend.cooldown * 2, BREAKER_MAX_COOLDOWN)
+            elif backend.state == "open":
+                return
+            elif not immediate and backend.consecutive_failures < BREAKER_THRESHOLD:
+                # Проверка не ждёт полного интервала и быстрее покажет, доступен ли сервер
+                self._wakeup.set()
+                return
+            opened = backend.state == "closed"
+            backend.state = "open"
+            backend.healthy = False
+            backend.opened_at = time.monotonic()
+        if opened:
+            logger.warning(f"Сервер Ollama {backend.url} недоступен, цепь разомкнута: {error}")
+            self._notify()
+
+    def probe(self, backend: Backend):
+        """Проверка сервера: версия, загруженные и установленные модели"""
+        started = time.monotonic()
+        try:
+            version = self._session.get(f"{backend.url}/api/version", timeout=HEALTH_TIMEOUT)
+            version.raise_for_status()
+            latency = (time.monotonic() - started) * 1000
+            resident, available = {}, set()
+            ps = self._session.get(f"{backend.url}/api/ps", timeout=HEALTH_TIMEOUT)
+            if ps.status_code == 200:
+                resident = {
+                    normalize_model(item.get("name") or item.get("model") or ""): {
+                        "size": item.get("size"),
+                        "size_vram": item.get("size_vram"),
+                        "expires_at": item.get("expires_at")
+                    }
+                    for item in ps.json().get("models", [])
+                }
+            tags = self._session.get(f"{backend.url}/api/tags", timeout=HEALTH_TIMEOUT)
+            if tags.status_code == 200:
+                available = {normalize_model(item.get("name") or item.get("model") or "")
+                             for item in tags.json().get("models", [])}
+        except (requests.RequestException, ValueError) as e:
+            with self._lock:
+                backend.last_probe = time.time()
+            self.mark_failed(backend, e, immediate=True)
+            return
+
+        with self._lock:
+            backend.version = version.json().get("version")
+            backend.latency_ms = round(latency, 1)
+            backend.loaded = set(resident)
+            backend.resident = resident
+            backend.available = available
+            backend.last_probe = time.time()
+        self.record_success(backend)
+
+    def probe_all(self):
+        """Проверка серверов; разомкнутые проверяются только после паузы выключателя"""
+        for backend in self.backends():
+            if self.admit(backend):
+                self.probe(backend)
+
+    def _notify(self):
+        healthy = sum(1 for backend in list(self._backends.values()) if backend.healthy)
+        for callback in self._listeners:
+            try:
+                callback(healthy)
+            except Exception as e:
+                logger.error(f"Ошибка обработчика изменения пула серверов: {e}")
+
+    def _ensure_prober(self):
+        # Поток не наследуется при fork, поэтому проверяется PID
+        if self._prober is not None and self._prober_pid == os.getpid():
+            return
+        with self._lock:
+            if self._prober is not None and self._prober_pid == os.getpid():
+                return
+            self._prober_pid = os.getpid()
+            self._prober = threading.Thread(target=self._probe_loop, name="ollama-health", daemon=True)
+            self._prober.start()
+
+    def _probe_loop(self):
+        while True:
+            try:
+                self.probe_all()
+            except Exception as e:
+                logger.error(f"Ошибка проверки серверов Ollama: {e}")
+            self._wakeup.wait(HEALTH_INTERVAL)
+            self._wakeup.clear()
+
+    def stats(self) -> Dict:
+        backends = self.backends()
+        with self._lock:
+            return {
+                "health_interval": HEALTH_INTERVAL,
+                "healthy": sum(1 for backend in backends if backend.healthy),
+                "backends": [backend.to_dict() for backend in backends]
+            }
+
+
+# Глобальный экземпляр
+backend_pool = BackendPool()
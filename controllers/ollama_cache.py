@@ -0,0 +1,112 @@
+import os
+import time
+import sqlite3
+import logging
+import threading
+from typing import Any, Callable, Dict, Hashable, Optional
+
+from shared_state import shared_state, is_shared_mode
+
+# Настройка логирования
+logger = logging.getLogger(__name__)
+
+# Время жизни закэшированных ответов Ollama, в секундах
+STATUS_TTL = float(os.environ.get("OLLAMA_STATUS_TTL", "5"))
+MODELS_TTL = float(os.environ.get("OLLAMA_MODELS_TTL", "30"))
+
+
+class _Flight:
+    """Запрос к Ollama, который уже выполняется для данного ключа"""
+
+    __slots__ = ("event", "value", "error")
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.value = None
+        self.error: Optional[BaseException] = None
+
+
+class TTLCache:
+    """Кэш ответов Ollama с ограниченным временем жизни и объединением запросов.
+
+    Одновременные промахи по одному ключу объединяются: к Ollama идёт только
+    первый запрос, остальные потоки ждут его результат. Сброс кэша увеличивает
+    поколение в общем состоянии, поэтому он действует во всех воркерах.
+    """
+
+    GENERATION_KEY = "ollama_cache_generation"
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries: Dict[Hashable, tuple] = {}
+        self._inflight: Dict[Hashable, _Flight] = {}
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.invalidations = 0
+
+    def _generation(self) -> int:
+        return shared_state.get(self.GENERATION_KEY, 0)
+
+    def get_or_load(self, key: Hashable, loader: Callable[[], Any], ttl: float,
+                    cache_if: Optional[Callable[[Any], bool]] = None) -> Any:
+        """Значение из кэша или результат loader(); cache_if решает, сохранять ли результат"""
+        generation = self._generation()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > time.monotonic() and entry[1] == generation:
+                self.hits += 1
+                return entry[2]
+            flight = self._inflight.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._inflight[key] = _Flight()
+                self.misses += 1
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            flight.event.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.value
+
+        try:
+            flight.value = loader()
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+                if flight.error is None and ttl > 0 and (cache_if is None or cache_if(flight.value)):
+                    self._entries[key] = (time.monotonic() + ttl, generation, flight.value)
+            flight.event.set()
+        return flight.value
+
+    def invalidate(self):
+        """Сброс кэша во всех воркерах"""
+        if is_shared_mode():
+            try:
+                shared_state.increment(self.GENERATION_KEY)
+            except sqlite3.Error as e:
+                logger.error(f"Ошибка сброса кэша в общем состоянии: {e}")
+        with self._lock:
+            self._entries.clear()
+            self.invalidations += 1
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "coalesced": self.coalesced,
+                "invalidations": self.invalidations,
+                "status_ttl": STATUS_TTL,
+                "models_ttl": MODELS_TTL
+            }
+
+
+# Глобальный экземпляр
+ollama_cache = TTLCache()
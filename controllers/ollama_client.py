@@ -0,0 +1,220 @@
+import os
+import logging
+import threading
+from typing import Dict, Optional, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import NewConnectionError
+
+from controllers.ollama_backends import Backend, backend_pool, parse_urls
+
+# Настройка логирования
+logger = logging.getLogger(__name__)
+
+
+class OllamaClient:
+    """Потокобезопасный HTTP-клиент Ollama с пулом keep-alive соединений.
+
+    Все обработчики используют одну requests.Session, поэтому TCP-соединения
+    к серверам Ollama переиспользуются между запросами. Сервер для каждого
+    запроса выбирает пул серверов (backend_pool); если соединение не
+    установлено, запрос повторяется на следующем сервере. Таймауты задаются раздельно:
+    на установку соединения и на чтение ответа.
+    """
+
+    def __init__(self, pool_maxsize: Optional[int] = None, connect_timeout: Optional[float] = None,
+                 read_timeout: Optional[float] = None):
+        self.pool_maxsize = pool_maxsize or int(os.environ.get("OLLAMA_POOL_SIZE", "16"))
+        self.connect_timeout = connect_timeout or float(os.environ.get("OLLAMA_CONNECT_TIMEOUT", "3.05"))
+        # Таймаут чтения по умолчанию рассчитан на долгую генерацию
+        self.read_timeout = read_timeout or float(os.environ.get("OLLAMA_READ_TIMEOUT", "300"))
+
+        self._lock = threading.Lock()
+        self._session: Optional[requests.Session] = None
+        self._adapter: Optional[HTTPAdapter] = None
+
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.requests_total = 0
+        self.errors_total = 0
+        self.failovers = 0
+        # Запросы, отклонённые выключателем без обращения к Ollama
+        self.fast_fails = 0
+        self.pool_rebuilds = 0
+
+    @property
+    def base_url(self) -> str:
+        """Первый сервер из списка (для обратной совместимости и отображения)"""
+        return backend_pool.urls[0]
+
+    def set_base_url(self, url: str):
+        """Смена серверов Ollama для всех воркеров (один URL или несколько через запятую)"""
+        backend_pool.set_urls(parse_urls(url))
+        self.reset()
+
+    def reset(self):
+        """Закрытие пула соединений; новый будет создан при следующем запросе"""
+        with self._lock:
+            if self._session is not None:
+                self._session.close()
+            self._session = None
+            self._adapter = None
+
+    def _get_session(self) -> requests.Session:
+        with self._lock:
+            if self._session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(
+                    # Отдельный пул соединений на каждый сервер Ollama
+                    pool_connections=max(10, len(backend_pool.urls)),
+                    pool_maxsize=self.pool_maxsize,
+                    pool_block=False,
+                    max_retries=0
+                )
+                session.mount("http://", adapter)
+                session.mount("https://", adapter)
+                self._session = session
+                self._adapter = adapter
+                self.pool_rebuilds += 1
+            return self._session
+
+    def timeout(self, read_timeout: Optional[float] = None) -> Tuple[float, float]:
+        return (self.connect_timeout, read_timeout or self.read_timeout)
+
+    def request(self, method: str, path: str, read_timeout: Optional[float] = None,
+                model: Optional[str] = None, backend: Optional[Backend] = None,
+                prefer: Optional[str] = None, **kwargs) -> requests.Response:
+        """Запрос к Ollama API через общий пул соединений.
+
+        model помогает выбрать сервер, где модель уже загружена; backend
+        направляет запрос на конкретный сервер без переключения на другие,
+        а prefer (URL) — на указанный сервер, пока он доступен.
+        Для потоковых ответов (stream=True) сервер считается занятым до
+        response.close().
+        """
+        session = self._get_session()
+        kwargs.setdefault("timeout", self.timeout(read_timeout))
+        fixed = backend
+
+        tried = []
+        last_error: Optional[requests.RequestException] = None
+        while True:
+            if fixed is not None:
+                backend = fixed if not tried and backend_pool.admit(fixed) else None
+            else:
+                backend = backend_pool.choose(model, exclude=tried, prefer=prefer)
+            if backend is None:
+                if last_error is None:
+                    # Цепь разомкнута: ответ без попытки подключения
+                    with self._lock:
+                        self.fast_fails += 1
+                    raise backend_pool.unavailable()
+                raise last_error
+            if tried:
+                with self._lock:
+                    self.failovers += 1
+
+            backend_pool.acquire(backend)
+            with self._lock:
+                self.in_flight += 1
+                self.requests_total += 1
+                self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+            try:
+                response = session.request(method, f"{backend.url}{path}", **kwargs)
+            except requests.ConnectionError as e:
+                if not self._not_sent(e):
+                    # Соединение оборвалось после отправки: повтор на другом сервере продублировал бы генерацию
+                    backend_pool.release(backend)
+                    with self._lock:
+                        self.errors_total += 1
+                    raise
+                # Запрос не дошёл до сервера: пробуем следующий
+                backend_pool.release(backend)
+                backend_pool.mark_failed(backend, e)
+                with self._lock:
+                    self.errors_total += 1
+                tried.append(backend.url)
+                last_error = e
+                continue
+            except requests.RequestException:
+                backend_pool.release(backend)
+                with self._lock:
+                    self.errors_total += 1
+                raise
+            finally:
+                with self._lock:
+                    self.in_flight -= 1
+
+            backend_pool.record_success(backend)
+            response.ollama_backend = backend.url
+            if kwargs.get("stream"):
+                self._release_on_close(response, backend)
+            else:
+                backend_pool.release(backend)
+            return response
+
+    @staticmethod
+    def _not_sent(error: requests.ConnectionError) -> bool:
+        """Ошибка на этапе подключения (отказ, таймаут соединения, DNS): запрос не отправлен"""
+        if isinstance(error, requests.ConnectTimeout):
+            return True
+        reason = getattr(error.args[0], "reason", None) if error.args else None
+        return isinstance(reason, NewConnectionError)
+
+    @staticmethod
+    def _release_on_close(response: requests.Response, backend):
+        close = response.close
+        released = []
+
+        def close_and_release():
+            close()
+            if not released:
+                released.append(True)
+                backend_pool.release(backend)
+
+        response.close = close_and_release
+
+    def get(self, path: str, **kwargs) -> requests.Response:
+        return self.request("GET", path, **kwargs)
+
+    def post(self, path: str, **kwargs) -> requests.Response:
+        return self.request("POST", path, **kwargs)
+
+    def stats(self) -> Dict:
+        """Использование пула, чтобы подобрать OLLAMA_POOL_SIZE"""
+        pools = []
+        with self._lock:
+            adapter = self._adapter
+            result = {
+                "url": self.base_url,
+                "pool_maxsize": self.pool_maxsize,
+                "connect_timeout": self.connect_timeout,
+                "read_timeout": self.read_timeout,
+                "in_flight": self.in_flight,
+                "peak_in_flight": self.peak_in_flight,
+                "requests_total": self.requests_total,
+                "errors_total": self.errors_total,
+                "failovers": self.failovers,
+                "fast_fails": self.fast_fails,
+                "pool_rebuilds": self.pool_rebuilds
+            }
+        if adapter is not None:
+            for key in adapter.poolmanager.pools.keys():
+                pool = adapter.poolmanager.pools.get(key)
+                if pool is None:
+                    continue
+                pools.append({
+                    "host": f"{pool.scheme}://{pool.host}:{pool.port}",
+                    "connections_created": pool.num_connections,
+                    "requests": pool.num_requests,
+                    # В очереди пула свободные слоты хранятся как None
+                    "idle_connections": sum(1 for conn in list(pool.pool.queue) if conn is not None)
+                    if pool.pool is not None else 0
+                })
+        result["pools"] = pools
+        return result
+
+
+# Глобальный экземпляр
+ollama_client = OllamaClient()
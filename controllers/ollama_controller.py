@@ -1,8 +1,21 @@
-import os
+import json
+import time
 import logging
 import requests
-from flask import Blueprint, jsonify, request
-from models import log_manager, LogEntry
+from flask import Blueprint, Response, jsonify, request
+from models import log_manager, LogEntry, LogCounters, iter_json
+from controllers.ollama_client import ollama_client
+from controllers.ollama_backends import backend_pool, parse_urls, BackendUnavailable
+from controllers.ollama_cache import ollama_cache, STATUS_TTL, MODELS_TTL
+from controllers.completion_cache import completion_cache, is_deterministic, normalize_model
+from controllers.ollama_scheduler import ollama_scheduler, SchedulerRejected, PRIORITIES
+from controllers.pull_jobs import pull_jobs
+from controllers.chat_sessions import chat_sessions, SessionConflict
+from controllers.context_budget import context_budget
+from controllers.model_residency import residency_manager
+from controllers.inference_metrics import inference_metrics
+from controllers.model_settings import model_settings
+from controllers.batch_jobs import batch_jobs, BatchItemError, BATCH_MAX_ITEMS
 
 # Настройка логирования
 logger = logging.getLogger(__name__)
@@ -10,25 +23,31 @@ logger = logging.getLogger(__name__)
 # Создание блюпринта
 ollama_bp = Blueprint('ollama', __name__, url_prefix='/api/ollama')
 
-# URL API Ollama по умолчанию
-OLLAMA_API_URL = os.environ.get("OLLAMA_API_URL", "http://localhost:11434")
+# Лимиты планировщика следуют за числом доступных серверов Ollama
+backend_pool.on_change(ollama_scheduler.set_scale)
 
 @ollama_bp.route('/set-api-url', methods=['POST'])
 def set_api_url():
-    """Установка URL API для Ollama"""
-    global OLLAMA_API_URL
+    """Установка URL API для Ollama.
+
+    Принимает один URL, несколько URL через запятую или список urls —
+    запросы распределяются между всеми указанными серверами.
+    """
     data = request.json
     if data is None:
         return jsonify({"error": "Неверный формат данных"}), 400
 
-    url = data.get('url')
-    if not url:
+    urls = parse_urls(data.get('urls') or data.get('url'))
+    if not urls:
         return jsonify({"error": "URL не указан"}), 400
 
-    if not url.startswith(('http://', 'https://')):
-        return jsonify({"error": "URL должен начинаться с http:// или https://"}), 400
+    for url in urls:
+        if not url.startswith(('http://', 'https://')):
+            return jsonify({"error": "URL должен начинаться с http:// или https://"}), 400
 
-    OLLAMA_API_URL = url
+    url = ", ".join(urls)
+    ollama_client.set_base_url(url)
+    ollama_cache.invalidate()
 
     log_manager.add_log(LogEntry(
         action="set_api_url",
@@ -38,216 +57,945 @@ def set_api_url():
 
     return jsonify({
         "message": f"URL API успешно изменен на {url}",
-        "url": url
+        "url": url,
+        "urls": urls
     })
 
-def get_ollama_url():
-    """Получение URL API Ollama"""
-    return OLLAMA_API_URL
+def _wants_sse(data) -> bool:
+    """Формат потока: Server-Sent Events или NDJSON (по умолчанию)"""
+    fmt = data.get('stream_format')
+    if fmt:
+        return fmt == 'sse'
+    return 'text/event-stream' in request.headers.get('Accept', '')
 
-@ollama_bp.route('/status', methods=['GET'])
-def check_status():
-    """Проверка статуса подключения к Ollama API"""
+def _rejected(action: str, error: SchedulerRejected):
+    """Ответ на запрос, отклонённый планировщиком (очередь заполнена или истекло ожидание)"""
+    log_manager.add_log(LogEntry(action=action, details=str(error), status="warning"))
+    response = jsonify({"error": str(error), "retry_after": error.retry_after})
+    response.status_code = error.status_code
+    response.headers['Retry-After'] = str(error.retry_after)
+    return response
+
+def _connection_error(action: str, error: requests.RequestException):
+    """Ответ на ошибку подключения к Ollama; при разомкнутой цепи — 503 с Retry-After"""
+    if isinstance(error, BackendUnavailable):
+        log_manager.add_log(LogEntry(action=action, details=str(error), status="warning"))
+        response = jsonify({"error": str(error), "retry_after": error.retry_after})
+        response.status_code = 503
+        response.headers['Retry-After'] = str(error.retry_after)
+        return response
+
+    error_msg = f"Ошибка соединения: {str(error)}"
+    log_manager.add_log(LogEntry(action=action, details=error_msg, status="error"))
+    return jsonify({"error": error_msg}), 500
+
+def frame_chunk(line: bytes, sse: bool) -> bytes:
+    """Фрагмент потока в формате SSE или NDJSON"""
+    if sse:
+        return b"data: " + line + b"\n\n"
+    return line + b"\n"
+
+def observe_completion(model: str, result: dict, ttft: float = None, wait: float = None):
+    """Учёт таймингов ответа Ollama: холодные старты и гистограммы скорости"""
+    residency_manager.observe(result, model)
+    inference_metrics.record(model, result, ttft, wait)
+
+def finish_chunk(line: bytes, ttft: float, model: str = None, wait: float = None):
+    """Возвращает (фрагмент, done); в последний фрагмент добавляется ttft_ms"""
+    chunk = json.loads(line)
+    if not chunk.get('done'):
+        return line, False
+    observe_completion(model, chunk, ttft, wait)
+    chunk['ttft_ms'] = round(ttft, 1)
+    return json.dumps(chunk, ensure_ascii=False).encode('utf-8'), True
+
+def log_stream_outcome(action: str, model: str, outcome, ttft):
+    """Запись в лог итога потоковой генерации (ошибки логируются в месте возникновения)"""
+    if outcome == "done":
+        log_manager.add_log(LogEntry(
+            action=action,
+            details=f"Потоковая генерация моделью {model} завершена, первый токен через {ttft:.0f} мс",
+            status="success"
+        ))
+    elif outcome is None:
+        log_manager.add_log(LogEntry(
+            action=action,
+            details=f"Потоковая генерация моделью {model} прервана клиентом",
+            status="warning"
+        ))
+
+def _stream_completion(action: str, path: str, payload: dict, model: str, sse: bool = False,
+                       priority: str = "interactive", prefer: str = None, on_done=None):
+    """Потоковая ретрансляция ответа Ollama клиенту по мере генерации.
+
+    Фрагменты NDJSON от Ollama передаются браузеру без буферизации (как NDJSON
+    или как SSE). Генератор читает из Ollama только тогда, когда сервер отдал
+    предыдущий фрагмент клиенту, поэтому медленный клиент притормаживает и
+    чтение из Ollama. При отключении клиента генератор закрывается, а вместе с
+    ним и соединение с Ollama, что прерывает генерацию. В последний фрагмент
+    (done=true) добавляется время до первого токена в мс (ttft_ms).
+    Слот планировщика удерживается до закрытия ответа. on_done(фрагменты,
+    сервер) вызывается после успешного завершения генерации.
+    """
+    started = time.monotonic()
+    payload = dict(payload, stream=True)
     try:
-        response = requests.get(f"{OLLAMA_API_URL}/api/version", timeout=5)
-        if response.status_code == 200:
-            log_manager.add_log(LogEntry(
-                action="check_status",
-                details="Соединение с Ollama API установлено",
-                status="success"
-            ))
-            return jsonify({
-                "status": "online",
-                "url": OLLAMA_API_URL
-            })
-        else:
-            log_manager.add_log(LogEntry(
-                action="check_status",
-                details=f"Ошибка при проверке соединения: {response.status_code}",
-                status="error"
-            ))
-            return jsonify({
-                "status": "error",
-                "message": f"Сервер вернул код ошибки: {response.status_code}"
-            })
+        waited = ollama_scheduler.acquire(model, priority)
+    except SchedulerRejected as e:
+        return _rejected(action, e)
+    slot_started = time.monotonic()
+    released = []
+
+    def release_slot():
+        if not released:
+            released.append(True)
+            ollama_scheduler.release(model, time.monotonic() - slot_started)
+
+    try:
+        upstream = ollama_client.post(path, json=payload, stream=True, model=model, prefer=prefer)
     except requests.RequestException as e:
+        release_slot()
+        return _connection_error(action, e)
+
+    if upstream.status_code != 200:
+        upstream.close()
+        release_slot()
+        error_msg = f"Ошибка при генерации: {upstream.status_code}"
+        log_manager.add_log(LogEntry(action=action, details=error_msg, status="error"))
+        return jsonify({"error": error_msg}), upstream.status_code
+
+    def frame(line: bytes) -> bytes:
+        return frame_chunk(line, sse)
+
+    def relay():
+        ttft = None
+        outcome = None
+        chunks = []
+        try:
+            for line in upstream.iter_lines(chunk_size=None):
+                if not line:
+                    continue
+                if ttft is None:
+                    ttft = (time.monotonic() - started) * 1000
+                if on_done:
+                    chunks.append(line)
+                line, done = finish_chunk(line, ttft, model, waited)
+                if done:
+                    outcome = "done"
+                yield frame(line)
+                if outcome:
+                    break
+            if outcome is None:
+                raise ValueError("Ollama закрыла поток без финального фрагмента")
+            if on_done:
+                on_done(chunks, upstream.ollama_backend)
+        except (requests.RequestException, ValueError) as e:
+            outcome = "error"
+            error_msg = f"Поток прерван: {str(e)}"
+            log_manager.add_log(LogEntry(action=action, details=error_msg, status="error"))
+            yield frame(json.dumps({"error": error_msg, "done": True}, ensure_ascii=False).encode('utf-8'))
+        finally:
+            # Закрытие соединения прерывает генерацию в Ollama, если клиент отключился
+            upstream.close()
+            release_slot()
+            log_stream_outcome(action, model, outcome, ttft)
+
+    response = Response(relay(), mimetype='text/event-stream' if sse else 'application/x-ndjson')
+    # Вызывается и тогда, когда клиент отключился до начала передачи
+    response.call_on_close(upstream.close)
+    response.call_on_close(release_slot)
+    response.headers['Cache-Control'] = 'no-cache'
+    # Отключение буферизации ответа в nginx
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+def get_ollama_url():
+    """Получение URL API Ollama (общего для всех воркеров)"""
+    return ollama_client.base_url
+
+def _pool_key():
+    """Ключ кэша для текущего набора серверов"""
+    return tuple(backend_pool.urls)
+
+def _fetch_status():
+    """Проверка серверов Ollama (вызывается только при промахе кэша)"""
+    backend_pool.probe_all()
+    backends = backend_pool.backends()
+    healthy = [backend for backend in backends if backend.healthy]
+    summary = [{"url": backend.url, "healthy": backend.healthy, "error": backend.last_error,
+                "state": backend.state, "retry_after": backend.retry_after(), "last_ok": backend.last_ok}
+               for backend in backends]
+
+    if healthy:
         log_manager.add_log(LogEntry(
             action="check_status",
-            details=f"Ошибка подключения: {str(e)}",
-            status="error"
+            details=f"Соединение с Ollama API установлено ({len(healthy)} из {len(backends)} серверов)",
+            status="success"
         ))
-        return jsonify({
-            "status": "offline",
-            "message": f"Не удалось подключиться к Ollama API: {str(e)}"
-        })
+        return {
+            "status": "online",
+            "url": healthy[0].url,
+            "backends": summary
+        }
 
-@ollama_bp.route('/models', methods=['GET'])
-def get_models():
-    """Получение списка доступных моделей"""
-    try:
-        response = requests.get(f"{OLLAMA_API_URL}/api/tags")
-        if response.status_code == 200:
-            log_manager.add_log(LogEntry(
-                action="get_models",
-                details="Получен список моделей",
-                status="success"
-            ))
-            return jsonify(response.json())
-        else:
-            error_msg = f"Ошибка при получении моделей: {response.status_code}"
-            log_manager.add_log(LogEntry(
-                action="get_models",
-                details=error_msg,
-                status="error"
-            ))
-            return jsonify({"error": error_msg}), response.status_code
-    except requests.RequestException as e:
-        error_msg = f"Ошибка соединения с Ollama API: {str(e)}"
+    error = backends[0].last_error if backends else "серверы не заданы"
+    log_manager.add_log(LogEntry(
+        action="check_status",
+        details=f"Ошибка подключения: {error}",
+        status="error"
+    ))
+    return {
+        "status": "offline",
+        "message": f"Не удалось подключиться к Ollama API: {error}",
+        "backends": summary
+    }
+
+@ollama_bp.route('/status', methods=['GET'])
+def check_status():
+    """Проверка статуса подключения к Ollama API.
+
+    Результат кэшируется на OLLAMA_STATUS_TTL секунд, так что опрос из
+    нескольких вкладок не создаёт лишних запросов к Ollama.
+    """
+    return jsonify(ollama_cache.get_or_load(("status", _pool_key()), _fetch_status, STATUS_TTL))
+
+# Последний успешно полученный список моделей: отдаётся, пока все серверы недоступны
+_last_models = {}
+
+def _fetch_models():
+    """Объединённый список моделей всех доступных серверов (вызывается только при промахе кэша)"""
+    backends = [backend for backend in backend_pool.backends() if backend.healthy] or backend_pool.backends()
+    models = {}
+    errors = []
+    unavailable = []
+    for backend in backends:
+        try:
+            response = ollama_client.get("/api/tags", read_timeout=10, backend=backend)
+        except BackendUnavailable as e:
+            unavailable.append(e)
+            continue
+        except requests.RequestException as e:
+            errors.append((500, f"Ошибка соединения с Ollama API: {str(e)}"))
+            continue
+        if response.status_code != 200:
+            errors.append((response.status_code, f"Ошибка при получении моделей: {response.status_code}"))
+            continue
+        for item in response.json().get('models', []):
+            name = normalize_model(item.get('name') or item.get('model') or '')
+            merged = models.setdefault(name, dict(item, backends=[]))
+            merged['backends'].append(backend.url)
+
+    if unavailable and not models and len(unavailable) == len(backends):
+        # Цепь разомкнута на всех серверах: быстрый отказ, как в остальных маршрутах
+        error = min(unavailable, key=lambda e: e.retry_after)
+        log_manager.add_log(LogEntry(action="get_models", details=str(error), status="warning"))
+        return {"error": str(error), "retry_after": error.retry_after}, 503
+
+    if errors and not models and len(errors) + len(unavailable) == len(backends):
+        status_code, error_msg = errors[0]
         log_manager.add_log(LogEntry(
             action="get_models",
             details=error_msg,
             status="error"
         ))
-        return jsonify({"error": error_msg}), 500
+        stale = _last_models.get(_pool_key())
+        if stale is not None:
+            # Устаревший список полезнее ошибки: интерфейс остаётся работоспособным
+            return {"models": stale, "stale": True, "error": error_msg}, 200
+        return {"error": error_msg}, status_code
+
+    log_manager.add_log(LogEntry(
+        action="get_models",
+        details="Получен список моделей",
+        status="success"
+    ))
+    _last_models[_pool_key()] = list(models.values())
+    return {"models": list(models.values())}, 200
+
+def _cached_models():
+    """Список моделей и код ответа из кэша (обновляется раз в OLLAMA_MODELS_TTL секунд)"""
+    return ollama_cache.get_or_load(
+        ("models", _pool_key()),
+        _fetch_models,
+        MODELS_TTL,
+        # Устаревший список не кэшируется, чтобы серверы опрашивались снова
+        cache_if=lambda result: result[1] == 200 and not result[0].get("stale")
+    )
+
+@ollama_bp.route('/models', methods=['GET'])
+def get_models():
+    """Получение списка доступных моделей"""
+    body, status_code = _cached_models()
+    response = jsonify(body)
+    response.status_code = status_code
+    if status_code == 503:
+        response.headers['Retry-After'] = str(body["retry_after"])
+    return response
+
+def _on_model_pulled(model: str):
+    """Список моделей изменился, ответы прежней версии модели больше не нужны"""
+    ollama_cache.invalidate()
+    completion_cache.invalidate_model(model)
+
+pull_jobs.on_success(_on_model_pulled)
 
 @ollama_bp.route('/pull', methods=['POST'])
 def pull_model():
-    """Загрузка модели из репозитория"""
+    """Запуск фоновой загрузки модели из репозитория.
+
+    Возвращает задачу загрузки; прогресс доступен через /pull/jobs/<id>
+    и /pull/jobs/<id>/events. Если эта модель уже загружается, возвращается
+    существующая задача.
+    """
     data = request.json
     if not data or 'model' not in data:
         return jsonify({"error": "Имя модели не указано"}), 400
 
     model_name = data['model']
+    job, created = pull_jobs.start(model_name)
+    if created:
+        log_manager.add_log(LogEntry(
+            action="pull_model",
+            details=f"Начата загрузка модели {model_name}",
+            status="info"
+        ))
 
-    try:
-        response = requests.post(
-            f"{OLLAMA_API_URL}/api/pull",
-            json={"name": model_name}
-        )
+    return jsonify({
+        "message": f"Модель {model_name} загружается",
+        "job_id": job.id,
+        "model": job.model,
+        "status": job.status,
+        "deduplicated": not created
+    }), 202
 
-        if response.status_code == 200:
-            log_manager.add_log(LogEntry(
-                action="pull_model",
-                details=f"Модель {model_name} успешно загружена",
-                status="success"
-            ))
-            return jsonify({"message": f"Модель {model_name} загружается"})
-        else:
-            error_msg = f"Ошибка при загрузке модели: {response.status_code}"
-            log_manager.add_log(LogEntry(
-                action="pull_model",
-                details=error_msg,
-                status="error"
-            ))
-            return jsonify({"error": error_msg}), response.status_code
-    except requests.RequestException as e:
-        error_msg = f"Ошибка соединения: {str(e)}"
+@ollama_bp.route('/pull/jobs', methods=['GET'])
+def list_pull_jobs():
+    """Список текущих и недавних загрузок моделей"""
+    return jsonify({"jobs": pull_jobs.list()})
+
+@ollama_bp.route('/pull/jobs/<job_id>', methods=['GET'])
+def get_pull_job(job_id):
+    """Состояние загрузки модели"""
+    job = pull_jobs.get(job_id)
+    if job is None:
+        return jsonify({"error": "Задача загрузки не найдена"}), 404
+    return jsonify(job)
+
+@ollama_bp.route('/pull/jobs/<job_id>', methods=['DELETE'])
+def cancel_pull_job(job_id):
+    """Отмена загрузки модели"""
+    job = pull_jobs.cancel(job_id)
+    if job is None:
+        return jsonify({"error": "Задача загрузки не найдена"}), 404
+    return jsonify({"message": "Загрузка отменяется", "job": job})
+
+@ollama_bp.route('/pull/jobs/<job_id>/events', methods=['GET'])
+def pull_job_events(job_id):
+    """Прогресс загрузки модели в формате Server-Sent Events.
+
+    Каждое событие — снимок задачи; поток закрывается после завершения
+    загрузки. Пока прогресс не меняется, раз в 15 секунд отправляется
+    комментарий, чтобы прокси не закрыли соединение.
+    """
+    if pull_jobs.get(job_id) is None:
+        return jsonify({"error": "Задача загрузки не найдена"}), 404
+
+    def events():
+        version = -1
+        while True:
+            job, new_version = pull_jobs.wait(job_id, version)
+            if job is None:
+                return
+            if new_version == version and job['status'] in ('queued', 'running'):
+                yield b": keep-alive\n\n"
+                continue
+            version = new_version
+            yield f"data: {json.dumps(job, ensure_ascii=False)}\n\n".encode('utf-8')
+            if job['status'] not in ('queued', 'running'):
+                return
+
+    response = Response(events(), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+def _model_digest(model: str):
+    """Дайджест модели из кэшированного списка моделей Ollama"""
+    body, status_code = _cached_models()
+    if status_code != 200:
+        return None
+    name = normalize_model(model)
+    for item in body.get('models', []):
+        if normalize_model(item.get('name') or item.get('model') or '') == name:
+            return item.get('digest')
+    return None
+
+def _completion_key(endpoint: str, model: str, payload: dict, data: dict):
+    """Ключ кэша ответов или None, если запрос кэшировать нельзя.
+
+    Кэш включается клиентом (cache: true) и применяется только к
+    детерминированным запросам: temperature 0 или фиксированный seed.
+    """
+    if not data.get('cache') or not is_deterministic(payload.get('options')):
+        return None
+    digest = _model_digest(model)
+    if not digest:
+        return None
+    return completion_cache.make_key(endpoint, digest, payload)
+
+# Для каждого вида генерации: поле с входными данными и тексты для ответов и логов
+COMPLETIONS = {
+    "generate": {
+        "field": "prompt",
+        "missing": "Модель или промпт не указаны",
+        "success": "Успешная генерация текста моделью {model}",
+        "error": "Ошибка при генерации"
+    },
+    "chat": {
+        "field": "messages",
+        "missing": "Модель или сообщения не указаны",
+        "success": "Успешный чат с моделью {model}",
+        "error": "Ошибка в чате"
+    }
+}
+
+def prepare_completion(action: str, data):
+    """Проверка запроса генерации; возвращает (model, payload, priority).
+
+    При ошибке в запросе выбрасывает ValueError с текстом для ответа 400.
+    """
+    if not data or not isinstance(data, dict):
+        raise ValueError("Данные не предоставлены")
+
+    spec = COMPLETIONS[action]
+    model = data.get('model')
+    value = data.get(spec["field"])
+    if not model or not value:
+        raise ValueError(spec["missing"])
+    if action == "chat":
+        # Оценка контекста и кэш разбирают сообщения, поэтому их формат проверяется заранее
+        if not isinstance(value, list) or not all(
+            isinstance(message, dict) and isinstance(message.get("content", ""), str) for message in value
+        ):
+            raise ValueError("messages должен быть списком объектов с текстовым content")
+    elif not isinstance(value, str):
+        raise ValueError("prompt должен быть строкой")
+
+    if data.get('options') is not None and not isinstance(data['options'], dict):
+        raise ValueError("options должен быть объектом")
+
+    payload = {"model": model, spec["field"]: value}
+    if data.get('options'):
+        payload["options"] = data['options']
+    # Сохранённые параметры модели (num_ctx, num_thread, keep_alive...) под options клиента
+    model_settings.apply(model, payload, data.get('options'))
+    # Без keep_alive в запросе Ollama вернул бы закреплённой модели срок по умолчанию
+    keep_alive = residency_manager.keep_alive_for(model)
+    if keep_alive is not None:
+        payload["keep_alive"] = keep_alive
+
+    # Интерактивные запросы обслуживаются раньше пакетных (priority: batch)
+    priority = data.get('priority', 'interactive')
+    if priority not in PRIORITIES:
+        raise ValueError(f"Неизвестный приоритет: {priority}")
+    return model, payload, priority
+
+def fit_context(action: str, model: str, payload: dict) -> dict:
+    """Укладывание истории чата в контекстное окно модели (см. ContextBudget)"""
+    if action != "chat":
+        return payload
+    return dict(payload, messages=context_budget.fit(model, payload["messages"], payload.get("options")))
+
+def cached_completion(action: str, model: str, payload: dict, data: dict):
+    """Возвращает (ключ кэша, ответ из кэша); ключ None, если запрос не кэшируется"""
+    cache_key = _completion_key(action, model, payload, data)
+    if not cache_key:
+        return None, None
+    cached = completion_cache.get(cache_key)
+    if cached is not None:
         log_manager.add_log(LogEntry(
-            action="pull_model",
-            details=error_msg,
-            status="error"
+            action=action,
+            details=f"Ответ модели {model} взят из кэша",
+            status="success"
         ))
-        return jsonify({"error": error_msg}), 500
+    return cache_key, cached
 
-@ollama_bp.route('/generate', methods=['POST'])
-def generate():
-    """Генерация текста с помощью модели"""
+def _complete(action: str):
+    """Общий обработчик generate и chat"""
     data = request.json
-    if not data:
-        return jsonify({"error": "Данные не предоставлены"}), 400
+    try:
+        model, payload, priority = prepare_completion(action, data)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    payload = fit_context(action, model, payload)
 
-    model = data.get('model')
-    prompt = data.get('prompt')
+    if data.get('stream'):
+        return _stream_completion(action, f"/api/{action}", payload, model, sse=_wants_sse(data),
+                                  priority=priority)
 
-    if not model or not prompt:
-        return jsonify({"error": "Модель или промпт не указаны"}), 400
+    cache_key, cached = cached_completion(action, model, payload, data)
+    if cached is not None:
+        response = jsonify(cached)
+        response.headers['X-Completion-Cache'] = 'HIT'
+        return response
 
+    spec = COMPLETIONS[action]
     try:
-        response = requests.post(
-            f"{OLLAMA_API_URL}/api/generate",
-            json={
-                "model": model,
-                "prompt": prompt,
-                "stream": False
-            }
-        )
+        with ollama_scheduler.slot(model, priority) as waited:
+            response = ollama_client.post(
+                f"/api/{action}",
+                json=dict(payload, stream=False),
+                model=model
+            )
 
         if response.status_code == 200:
             result = response.json()
+            observe_completion(model, result, wait=waited)
+            if cache_key:
+                completion_cache.put(cache_key, model, result)
             log_manager.add_log(LogEntry(
-                action="generate",
-                details=f"Успешная генерация текста моделью {model}",
+                action=action,
+                details=spec["success"].format(model=model),
                 status="success"
             ))
             return jsonify(result)
         else:
-            error_msg = f"Ошибка при генерации: {response.status_code}"
+            error_msg = f"{spec['error']}: {response.status_code}"
             log_manager.add_log(LogEntry(
-                action="generate",
+                action=action,
                 details=error_msg,
                 status="error"
             ))
             return jsonify({"error": error_msg}), response.status_code
+    except SchedulerRejected as e:
+        return _rejected(action, e)
     except requests.RequestException as e:
-        error_msg = f"Ошибка соединения: {str(e)}"
-        log_manager.add_log(LogEntry(
-            action="generate",
-            details=error_msg,
-            status="error"
-        ))
-        return jsonify({"error": error_msg}), 500
+        return _connection_error(action, e)
+
+@ollama_bp.route('/generate', methods=['POST'])
+def generate():
+    """Генерация текста с помощью модели"""
+    return _complete("generate")
 
 @ollama_bp.route('/chat', methods=['POST'])
 def chat():
     """Чат с моделью"""
+    return _complete("chat")
+
+@ollama_bp.route('/sessions', methods=['POST'])
+def create_session():
+    """Создание чат-сессии: model, необязательные system, options и keep_alive"""
     data = request.json
-    if not data:
-        return jsonify({"error": "Данные не предоставлены"}), 400
+    if not data or not data.get('model'):
+        return jsonify({"error": "Имя модели не указано"}), 400
 
-    model = data.get('model')
-    messages = data.get('messages', [])
+    session = chat_sessions.create(
+        data['model'],
+        system=data.get('system'),
+        options=data.get('options'),
+        keep_alive=data.get('keep_alive')
+    )
+    log_manager.add_log(LogEntry(
+        action="chat_session",
+        details=f"Создана чат-сессия {session['id']} с моделью {session['model']}",
+        status="info"
+    ))
+    return jsonify(session), 201
+
+@ollama_bp.route('/sessions', methods=['GET'])
+def list_sessions():
+    """Список чат-сессий, последние изменённые первыми"""
+    limit = request.args.get('limit', 50, type=int)
+    return jsonify({"sessions": chat_sessions.list(limit)})
+
+@ollama_bp.route('/sessions/<session_id>', methods=['GET'])
+def get_session(session_id):
+    """Чат-сессия вместе с историей сообщений"""
+    session = chat_sessions.get(session_id)
+    if session is None:
+        return jsonify({"error": "Сессия не найдена"}), 404
+    return jsonify(dict(session, messages=chat_sessions.history(session_id)))
 
-    if not model or not messages:
-        return jsonify({"error": "Модель или сообщения не указаны"}), 400
+@ollama_bp.route('/sessions/<session_id>', methods=['DELETE'])
+def delete_session(session_id):
+    """Удаление чат-сессии и её истории"""
+    if not chat_sessions.delete(session_id):
+        return jsonify({"error": "Сессия не найдена"}), 404
+    return jsonify({"message": "Сессия удалена"})
 
+def _session_messages(session: dict, history: list, message: dict) -> list:
+    """Сообщения для Ollama: системный промпт, история сессии и новое сообщение"""
+    messages = [{"role": "system", "content": session['system']}] if session['system'] else []
+    return messages + history + [message]
+
+def _save_turn(session: dict, start: int, message: dict, reply: dict, backend: str):
+    """Запись хода в историю; при параллельном ходе ответ в историю не попадает"""
     try:
-        response = requests.post(
-            f"{OLLAMA_API_URL}/api/chat",
-            json={
-                "model": model,
-                "messages": messages,
-                "stream": False
-            }
-        )
+        chat_sessions.append(session['id'], start, [message, reply], backend)
+        return True
+    except SessionConflict as e:
+        log_manager.add_log(LogEntry(action="chat_session", details=str(e), status="warning"))
+        return False
 
-        if response.status_code == 200:
-            result = response.json()
-            log_manager.add_log(LogEntry(
-                action="chat",
-                details=f"Успешный чат с моделью {model}",
-                status="success"
-            ))
-            return jsonify(result)
-        else:
-            error_msg = f"Ошибка в чате: {response.status_code}"
-            log_manager.add_log(LogEntry(
-                action="chat",
-                details=error_msg,
-                status="error"
-            ))
-            return jsonify({"error": error_msg}), response.status_code
+def prepare_session_turn(session_id: str, data):
+    """Проверка хода чат-сессии; возвращает (session, history, message, model, payload, priority).
+
+    LookupError — сессия не найдена (404), ValueError — ошибка в запросе (400).
+    """
+    if not data or not isinstance(data, dict) or not data.get('message'):
+        raise ValueError("Сообщение не указано")
+
+    session = chat_sessions.get(session_id)
+    if session is None:
+        raise LookupError("Сессия не найдена")
+
+    message = data['message']
+    if isinstance(message, str):
+        message = {"role": "user", "content": message}
+
+    history = chat_sessions.history(session_id)
+    if data.get('options') is not None and not isinstance(data['options'], dict):
+        raise ValueError("options должен быть объектом")
+    model, payload, priority = prepare_completion("chat", dict(
+        data,
+        model=session['model'],
+        messages=_session_messages(session, history, message),
+        options=dict(session['options'] or {}, **(data.get('options') or {}))
+    ))
+    payload = fit_context("chat", model, payload)
+    # keep_alive сессии перекрывает сохранённый в настройках модели; закреплённую модель
+    # он не трогает, иначе короткий срок сессии выгрузил бы её
+    if session['keep_alive'] is not None and residency_manager.keep_alive_for(model) is None:
+        payload["keep_alive"] = session['keep_alive']
+    return session, history, message, model, payload, priority
+
+def session_stream_done(session: dict, history: list, message: dict):
+    """on_done для потокового хода: собирает ответ из фрагментов и дописывает историю"""
+    def on_done(chunks, backend):
+        content = "".join(json.loads(chunk).get('message', {}).get('content', '') for chunk in chunks)
+        _save_turn(session, len(history), message, {"role": "assistant", "content": content}, backend)
+    return on_done
+
+def finish_session_turn(session: dict, history: list, message: dict, result: dict, backend: str):
+    """Запись ответа модели в историю сессии; возвращает (тело ответа, код)"""
+    reply = result.get('message') or {"role": "assistant", "content": ""}
+    if not _save_turn(session, len(history), message, reply, backend):
+        return {"error": "История сессии изменена параллельным запросом", "response": result}, 409
+
+    log_manager.add_log(LogEntry(
+        action="chat",
+        details=COMPLETIONS['chat']['success'].format(model=session['model']),
+        status="success"
+    ))
+    return dict(result, session_id=session['id'], turn=len(history) // 2 + 1), 200
+
+@ollama_bp.route('/sessions/<session_id>/chat', methods=['POST'])
+def session_chat(session_id):
+    """Ход чат-сессии: клиент отправляет только новое сообщение (message).
+
+    История хранится на сервере и дописывается после ответа модели. Запрос
+    направляется на сервер Ollama, ответивший на прошлый ход, а keep_alive
+    сессии держит модель загруженной, поэтому Ollama переиспользует KV-кэш
+    уже вычисленной части диалога и обрабатывает только новое сообщение.
+    Поддерживаются stream, stream_format, options и priority, как в /chat.
+    """
+    data = request.json
+    try:
+        session, history, message, model, payload, priority = prepare_session_turn(session_id, data)
+    except LookupError as e:
+        return jsonify({"error": str(e)}), 404
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    if data.get('stream'):
+        return _stream_completion("chat", "/api/chat", payload, model, sse=_wants_sse(data),
+                                  priority=priority, prefer=session['backend'],
+                                  on_done=session_stream_done(session, history, message))
+
+    try:
+        with ollama_scheduler.slot(model, priority) as waited:
+            response = ollama_client.post(
+                "/api/chat",
+                json=dict(payload, stream=False),
+                model=model,
+                prefer=session['backend']
+            )
+    except SchedulerRejected as e:
+        return _rejected("chat", e)
     except requests.RequestException as e:
-        error_msg = f"Ошибка соединения: {str(e)}"
-        log_manager.add_log(LogEntry(
-            action="chat",
-            details=error_msg,
-            status="error"
-        ))
-        return jsonify({"error": error_msg}), 500
+        return _connection_error("chat", e)
+
+    if response.status_code != 200:
+        error_msg = f"{COMPLETIONS['chat']['error']}: {response.status_code}"
+        log_manager.add_log(LogEntry(action="chat", details=error_msg, status="error"))
+        return jsonify({"error": error_msg}), response.status_code
+
+    result = response.json()
+    observe_completion(model, result, wait=waited)
+    body, status_code = finish_session_turn(session, history, message, result, response.ollama_backend)
+    return jsonify(body), status_code
+
+def _run_batch_item(action: str, data: dict) -> dict:
+    """Выполнение элемента пакета (вызывается потоками batch_jobs)"""
+    model, payload, priority = prepare_completion(action, dict(data, priority=data.get('priority', 'batch')))
+    payload = fit_context(action, model, payload)
+    cache_key, cached = cached_completion(action, model, payload, data)
+    if cached is not None:
+        return cached
+
+    with ollama_scheduler.slot(model, priority) as waited:
+        response = ollama_client.post(f"/api/{action}", json=dict(payload, stream=False), model=model)
+    if response.status_code != 200:
+        raise BatchItemError(f"{COMPLETIONS[action]['error']}: {response.status_code}",
+                             retryable=response.status_code >= 500)
+    result = response.json()
+    observe_completion(model, result, wait=waited)
+    if cache_key:
+        completion_cache.put(cache_key, model, result)
+    return result
+
+batch_jobs.set_handler(_run_batch_item)
+
+def _batch_lines():
+    """Строки пакета: JSON {"items": [...]} или тело JSONL; возвращает (строки, общие поля)"""
+    if request.is_json:
+        data = request.get_json(silent=True)
+        if not isinstance(data, dict) or not isinstance(data.get('items'), list):
+            raise ValueError("Ожидается объект с массивом items или тело JSONL")
+        return data['items'], {key: value for key, value in data.items() if key != 'items'}
+
+    lines = []
+    for number, line in enumerate(request.get_data(as_text=True).splitlines(), 1):
+        if not line.strip():
+            continue
+        try:
+            lines.append(json.loads(line))
+        except ValueError:
+            raise ValueError(f"Строка {number}: некорректный JSON")
+    return lines, request.args.to_dict()
+
+@ollama_bp.route('/batch', methods=['POST'])
+def create_batch():
+    """Пакетная генерация: набор запросов generate/chat выполняется в фоне.
+
+    Тело — JSONL (по запросу в строке) или JSON {"items": [...]}; поля
+    model, options, priority и cache, заданные в параметрах запроса или
+    рядом с items, применяются ко всем строкам. Строка с messages — чат,
+    с prompt — генерация; поле id возвращается вместе с результатом.
+    """
+    try:
+        lines, defaults = _batch_lines()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    if not lines:
+        return jsonify({"error": "Пакет пуст"}), 400
+    if len(lines) > BATCH_MAX_ITEMS:
+        return jsonify({"error": f"В пакете больше {BATCH_MAX_ITEMS} запросов"}), 413
+
+    defaults = {key: defaults[key] for key in ('model', 'options', 'priority', 'cache') if key in defaults}
+    items = []
+    for number, line in enumerate(lines, 1):
+        if not isinstance(line, dict):
+            return jsonify({"error": f"Строка {number}: ожидается объект"}), 400
+        data = dict(defaults, **line)
+        data.pop('stream', None)
+        action = "chat" if 'messages' in data else "generate"
+        try:
+            prepare_completion(action, data)
+        except ValueError as e:
+            return jsonify({"error": f"Строка {number}: {str(e)}"}), 400
+        items.append({"action": action, "request": data})
+
+    return jsonify(batch_jobs.submit(items)), 202
+
+@ollama_bp.route('/batch', methods=['GET'])
+def list_batches():
+    """Список пакетов, новые первыми"""
+    limit = request.args.get('limit', 50, type=int)
+    return jsonify({"jobs": batch_jobs.list(limit)})
+
+@ollama_bp.route('/batch/<job_id>', methods=['GET'])
+def get_batch(job_id):
+    """Состояние пакета: число элементов по статусам и процент выполнения"""
+    job = batch_jobs.get(job_id)
+    if job is None:
+        return jsonify({"error": "Пакет не найден"}), 404
+    return jsonify(job)
+
+@ollama_bp.route('/batch/<job_id>/items', methods=['GET'])
+def get_batch_items(job_id):
+    """Статус, попытки и ошибки отдельных элементов пакета"""
+    if batch_jobs.get(job_id) is None:
+        return jsonify({"error": "Пакет не найден"}), 404
+    return jsonify({"items": batch_jobs.items(
+        job_id,
+        status=request.args.get('status'),
+        offset=request.args.get('offset', 0, type=int),
+        limit=request.args.get('limit', 100, type=int)
+    )})
+
+@ollama_bp.route('/batch/<job_id>/results', methods=['GET'])
+def get_batch_results(job_id):
+    """Результаты пакета в JSONL; с follow=1 — по мере выполнения до конца пакета"""
+    if batch_jobs.get(job_id) is None:
+        return jsonify({"error": "Пакет не найден"}), 404
+    follow = request.args.get('follow') in ('1', 'true')
+    response = Response(batch_jobs.results(job_id, follow=follow), mimetype='application/x-ndjson')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+@ollama_bp.route('/batch/<job_id>', methods=['DELETE'])
+def cancel_batch(job_id):
+    """Отмена выполняющегося пакета или удаление завершённого"""
+    job = batch_jobs.get(job_id)
+    if job is None:
+        return jsonify({"error": "Пакет не найден"}), 404
+    if job['finished'] is None:
+        return jsonify(batch_jobs.cancel(job_id))
+    batch_jobs.delete(job_id)
+    return jsonify({"message": "Пакет удалён"})
+
+@ollama_bp.route('/batch/stats', methods=['GET'])
+def get_batch_stats():
+    return jsonify(batch_jobs.stats())
+
+@ollama_bp.route('/residency', methods=['GET'])
+def get_residency():
+    """Загруженные модели по серверам, закрепления и холодные старты"""
+    return jsonify(residency_manager.stats())
+
+@ollama_bp.route('/residency/pin', methods=['POST'])
+def pin_model():
+    """Закрепление модели в памяти Ollama: model, необязательный keep_alive (по умолчанию -1)"""
+    data = request.json
+    if not data or not data.get('model'):
+        return jsonify({"error": "Имя модели не указано"}), 400
+
+    errors = residency_manager.pin(data['model'], data.get('keep_alive', -1))
+    if errors:
+        return jsonify({"error": "; ".join(errors)}), 502
+    return jsonify({"message": f"Модель {data['model']} закреплена в памяти"})
+
+@ollama_bp.route('/residency/pin/<path:model>', methods=['DELETE'])
+def unpin_model(model):
+    """Снятие закрепления модели"""
+    if not residency_manager.unpin(model):
+        return jsonify({"error": "Модель не закреплена"}), 404
+    return jsonify({"message": f"Закрепление модели {model} снято"})
+
+@ollama_bp.route('/residency/warm', methods=['POST'])
+def warm_model():
+    """Загрузка модели в память заранее: model, необязательный keep_alive"""
+    data = request.json
+    if not data or not data.get('model'):
+        return jsonify({"error": "Имя модели не указано"}), 400
+
+    keep_alive = data.get('keep_alive') or residency_manager.keep_alive_for(data['model'])
+    errors = residency_manager.load(data['model'], keep_alive)
+    if errors:
+        return jsonify({"error": "; ".join(errors)}), 502
+    log_manager.add_log(LogEntry(
+        action="model_residency",
+        details=f"Модель {data['model']} загружена в память",
+        status="success"
+    ))
+    return jsonify({"message": f"Модель {data['model']} загружена в память"})
+
+@ollama_bp.route('/residency/evict', methods=['POST'])
+def evict_model():
+    """Выгрузка модели из памяти Ollama"""
+    data = request.json
+    if not data or not data.get('model'):
+        return jsonify({"error": "Имя модели не указано"}), 400
+
+    errors = residency_manager.evict(data['model'])
+    if errors:
+        return jsonify({"error": "; ".join(errors)}), 502
+    return jsonify({"message": f"Модель {data['model']} выгружена из памяти"})
 
 @ollama_bp.route('/logs', methods=['GET'])
 def get_logs():
-    """Получение логов работы с моделями"""
+    """Получение логов работы с моделями.
+
+    Параметры: limit, action, status, start/end (ISO-время), since (курсор seq),
+    order (desc|asc). Номер последней записи возвращается в заголовке X-Log-Cursor,
+    чтобы клиент мог запрашивать только новые записи через since.
+    """
     limit = request.args.get('limit', 50, type=int)
-    logs = log_manager.get_logs(limit)
-    return jsonify(logs)
\ No newline at end of file
+    since = request.args.get('since', type=int)
+    order = request.args.get('order', 'asc' if since is not None else 'desc')
+    if order not in ('asc', 'desc'):
+        return jsonify({"error": "Параметр order должен быть asc или desc"}), 400
+
+    try:
+        entries = log_manager.query(
+            action=request.args.get('action'),
+            status=request.args.get('status'),
+            since=since,
+            start=request.args.get('start'),
+            end=request.args.get('end'),
+            limit=limit,
+            order=order
+        )
+    except ValueError:
+        return jsonify({"error": "Параметры start/end должны быть в формате ISO 8601"}), 400
+
+    # JSON собирается потоково из компактных записей, без промежуточных словарей
+    response = Response(iter_json(entries), mimetype='application/json')
+    response.headers['X-Log-Cursor'] = str(log_manager.last_seq)
+    return response
+
+@ollama_bp.route('/logs/stats', methods=['GET'])
+def get_log_stats():
+    """Количество записей по action/status в разрезе интервалов (minute|hour|day)"""
+    bucket = request.args.get('bucket', 'minute')
+    if bucket not in LogCounters.BUCKET_FORMATS:
+        return jsonify({"error": f"Неизвестный интервал: {bucket}"}), 400
+    return jsonify(log_manager.stats(
+        bucket=bucket,
+        start=request.args.get('start'),
+        end=request.args.get('end'),
+        action=request.args.get('action')
+    ))
+
+@ollama_bp.route('/logs/writer', methods=['GET'])
+def get_log_writer_stats():
+    """Состояние фоновой записи логов: очередь, записанные и отброшенные записи"""
+    return jsonify(log_manager.writer_stats())
+
+
+@ollama_bp.route('/client/stats', methods=['GET'])
+def get_client_stats():
+    """Использование пула соединений к Ollama"""
+    return jsonify(ollama_client.stats())
+
+@ollama_bp.route('/backends', methods=['GET'])
+def get_backends():
+    """Состояние серверов Ollama: доступность, загруженные модели, незавершённые запросы"""
+    return jsonify(backend_pool.stats())
+
+@ollama_bp.route('/cache/stats', methods=['GET'])
+def get_cache_stats():
+    """Попадания, промахи и объединённые запросы кэша статуса и списка моделей"""
+    return jsonify(ollama_cache.stats())
+
+@ollama_bp.route('/completion-cache/stats', methods=['GET'])
+def get_completion_cache_stats():
+    """Попадания и промахи кэша ответов генерации"""
+    return jsonify(completion_cache.stats())
+
+@ollama_bp.route('/scheduler/stats', methods=['GET'])
+def get_scheduler_stats():
+    """Глубина очередей, время ожидания и отказы планировщика по моделям"""
+    return jsonify(ollama_scheduler.stats())
+
+@ollama_bp.route('/context/stats', methods=['GET'])
+def get_context_stats():
+    """Статистика укладывания истории чатов в контекст модели"""
+    return jsonify(context_budget.stats())
+
+@ollama_bp.route('/metrics', methods=['GET'])
+def get_inference_metrics():
+    """Скользящие гистограммы скорости генерации и задержек по моделям (параметр model — фильтр)"""
+    return jsonify(inference_metrics.stats(request.args.get('model')))
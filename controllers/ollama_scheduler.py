@@ -0,0 +1,244 @@
+import os
+import time
+import heapq
+import asyncio
+import logging
+import itertools
+import threading
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional
+
+from controllers.completion_cache import normalize_model
+
+# Настройка логирования
+logger = logging.getLogger(__name__)
+
+# Классы приоритета: чем меньше число, тем раньше запрос получает слот
+PRIORITIES = {"interactive": 0, "batch": 1}
+
+
+class SchedulerRejected(Exception):
+    """Запрос отклонён планировщиком; retry_after — через сколько секунд повторить"""
+
+    def __init__(self, message: str, retry_after: int, status_code: int = 429):
+        super().__init__(message)
+        self.retry_after = retry_after
+        self.status_code = status_code
+
+
+class _Waiter:
+    """Запрос в очереди; notify() вызывается под блокировкой планировщика при выдаче слота"""
+
+    __slots__ = ("model", "priority", "notify", "granted", "abandoned", "enqueued")
+
+    def __init__(self, model: str, priority: int, notify: Callable[[], None]):
+        self.model = model
+        self.priority = priority
+        self.notify = notify
+        self.granted = False
+        self.abandoned = False
+        self.enqueued = time.monotonic()
+
+
+class _ModelStats:
+    __slots__ = ("in_flight", "queued", "served", "rejected", "timed_out",
+                 "wait_total", "wait_max", "service_avg")
+
+    def __init__(self):
+        self.in_flight = 0
+        self.queued = 0
+        self.served = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        # Скользящее среднее длительности запроса, для расчёта Retry-After
+        self.service_avg = 0.0
+
+
+class OllamaScheduler:
+    """Планировщик запросов к Ollama с очередью на каждую модель.
+
+    Ограничивает число одновременных запросов к каждой модели и к Ollama в
+    целом, чтобы всплеск запросов не заставлял Ollama постоянно выгружать и
+    загружать модели. Свободный слот получает ожидающий запрос с наивысшим
+    приоритетом (interactive раньше batch), при равном приоритете — самый
+    старый. Если очередь модели заполнена, запрос сразу отклоняется с
+    Retry-After. Лимиты умножаются на число доступных серверов Ollama и
+    действуют в пределах одного процесса-воркера.
+    """
+
+    def __init__(self, max_in_flight: Optional[int] = None, model_max_in_flight: Optional[int] = None,
+                 max_queue: Optional[int] = None, queue_timeout: Optional[float] = None):
+        self.max_in_flight = max_in_flight or int(os.environ.get("OLLAMA_MAX_IN_FLIGHT", "4"))
+        self.model_max_in_flight = model_max_in_flight or int(os.environ.get("OLLAMA_MODEL_MAX_IN_FLIGHT", "2"))
+        self.max_queue = max_queue or int(os.environ.get("OLLAMA_MAX_QUEUE", "32"))
+        self.queue_timeout = queue_timeout or float(os.environ.get("OLLAMA_QUEUE_TIMEOUT", "60"))
+
+        # Множитель лимитов: число доступных серверов Ollama
+        self.scale = 1
+
+        self._lock = threading.Lock()
+        self._heap: List[tuple] = []
+        self._counter = itertools.count()
+        self._models: Dict[str, _ModelStats] = {}
+        self.in_flight = 0
+
+    def _model(self, model: str) -> _ModelStats:
+        # 'llama3' и 'llama3:latest' делят одну очередь и один лимит
+        model = normalize_model(model)
+        stats = self._models.get(model)
+        if stats is None:
+            stats = self._models[model] = _ModelStats()
+        return stats
+
+    def _retry_after(self, stats: _ModelStats) -> int:
+        """Оценка времени, через которое в очереди модели освободится место"""
+        per_slot = stats.service_avg or 1.0
+        return max(1, int(per_slot * (stats.queued + 1) / (self.model_max_in_flight * self.scale) + 0.5))
+
+    def set_scale(self, backends: int):
+        """Лимиты растут пропорционально числу доступных серверов Ollama"""
+        with self._lock:
+            self.scale = max(1, backends)
+            self._dispatch()
+
+    def _dispatch(self):
+        """Выдача свободных слотов ожидающим запросам (под self._lock)"""
+        skipped = []
+        max_in_flight = self.max_in_flight * self.scale
+        model_max_in_flight = self.model_max_in_flight * self.scale
+        while self._heap and self.in_flight < max_in_flight:
+            entry = heapq.heappop(self._heap)
+            waiter = entry[2]
+            if waiter.abandoned:
+                continue  # запрос уже ушёл из очереди по таймауту
+            stats = self._model(waiter.model)
+            if stats.in_flight >= model_max_in_flight:
+                skipped.append(entry)
+                continue
+            self._grant(waiter, stats)
+        for entry in skipped:
+            heapq.heappush(self._heap, entry)
+
+    def _grant(self, waiter: _Waiter, stats: _ModelStats):
+        waited = time.monotonic() - waiter.enqueued
+        stats.queued -= 1
+        stats.in_flight += 1
+        stats.wait_total += waited
+        stats.wait_max = max(stats.wait_max, waited)
+        self.in_flight += 1
+        waiter.granted = True
+        waiter.notify()
+
+    def _enqueue(self, model: str, priority: str, notify: Callable[[], None]) -> _Waiter:
+        waiter = _Waiter(model, PRIORITIES.get(priority, PRIORITIES["interactive"]), notify)
+        with self._lock:
+            stats = self._model(model)
+            if stats.queued >= self.max_queue:
+                stats.rejected += 1
+                raise SchedulerRejected(
+                    f"Очередь запросов к модели {model} заполнена",
+                    self._retry_after(stats)
+                )
+            stats.queued += 1
+            heapq.heappush(self._heap, (waiter.priority, next(self._counter), waiter))
+            self._dispatch()
+        return waiter
+
+    def _abandon(self, waiter: _Waiter):
+        """Уход из очереди по таймауту; если слот уже выдан, он остаётся за запросом"""
+        with self._lock:
+            if waiter.granted:
+                return
+            waiter.abandoned = True
+            stats = self._model(waiter.model)
+            stats.queued -= 1
+            stats.timed_out += 1
+            raise SchedulerRejected(
+                f"Превышено время ожидания в очереди модели {waiter.model}",
+                self._retry_after(stats),
+                status_code=503
+            )
+
+    def acquire(self, model: str, priority: str = "interactive") -> float:
+        """Ожидание слота для запроса к модели; возвращает время ожидания в секундах"""
+        event = threading.Event()
+        waiter = self._enqueue(model, priority, event.set)
+        if not event.wait(self.queue_timeout):
+            self._abandon(waiter)
+        return time.monotonic() - waiter.enqueued
+
+    async def acquire_async(self, model: str, priority: str = "interactive") -> float:
+        """То же, что acquire(), но ожидание не занимает поток (для ASGI-режима)"""
+        loop = asyncio.get_running_loop()
+        granted = loop.create_future()
+
+        def notify():
+            loop.call_soon_threadsafe(lambda: granted.done() or granted.set_result(True))
+
+        waiter = self._enqueue(model, priority, notify)
+        try:
+            await asyncio.wait_for(asyncio.shield(granted), self.queue_timeout)
+        except asyncio.TimeoutError:
+            self._abandon(waiter)
+        except asyncio.CancelledError:
+            # Клиент ушёл: освобождаем место в очереди или уже выданный слот
+            try:
+                self._abandon(waiter)
+            except SchedulerRejected:
+                pass
+            else:
+                self.release(model, 0.0)
+            raise
+        return time.monotonic() - waiter.enqueued
+
+    def release(self, model: str, duration: float):
+        """Освобождение слота; duration — длительность запроса в секундах"""
+        with self._lock:
+            stats = self._model(model)
+            stats.in_flight -= 1
+            stats.served += 1
+            stats.service_avg = duration if stats.served == 1 else 0.8 * stats.service_avg + 0.2 * duration
+            self.in_flight -= 1
+            self._dispatch()
+
+    @contextmanager
+    def slot(self, model: str, priority: str = "interactive"):
+        """Выполнение блока кода в слоте модели; as-значение — время ожидания в секундах"""
+        waited = self.acquire(model, priority)
+        started = time.monotonic()
+        try:
+            yield waited
+        finally:
+            self.release(model, time.monotonic() - started)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            models = {}
+            for name, stats in self._models.items():
+                granted = stats.served + stats.in_flight
+                models[name] = {
+                    "in_flight": stats.in_flight,
+                    "queued": stats.queued,
+                    "served": stats.served,
+                    "rejected": stats.rejected,
+                    "timed_out": stats.timed_out,
+                    "wait_avg_ms": round(stats.wait_total / granted * 1000, 1) if granted else 0.0,
+                    "wait_max_ms": round(stats.wait_max * 1000, 1),
+                    "service_avg_ms": round(stats.service_avg * 1000, 1)
+                }
+            return {
+                "max_in_flight": self.max_in_flight,
+                "model_max_in_flight": self.model_max_in_flight,
+                "scale": self.scale,
+                "max_queue": self.max_queue,
+                "queue_timeout": self.queue_timeout,
+                "in_flight": self.in_flight,
+                "queued": sum(stats.queued for stats in self._models.values()),
+                "models": models
+            }
+
+
+# Глобальный экземпляр
+ollama_scheduler = OllamaScheduler()
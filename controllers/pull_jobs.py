@@ -0,0 +1,342 @@
+import json
+import time
+import uuid
+import logging
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional
+
+import requests
+
+from models import log_manager, LogEntry
+from shared_state import shared_state, is_shared_mode
+from controllers.ollama_client import ollama_client
+from controllers.ollama_backends import backend_pool
+from controllers.completion_cache import normalize_model
+
+# Настройка логирования
+logger = logging.getLogger(__name__)
+
+ACTIVE_STATUSES = ("queued", "running")
+
+
+class PullJob:
+    """Фоновая загрузка модели на все серверы Ollama"""
+
+    def __init__(self, model: str):
+        self.id = uuid.uuid4().hex
+        self.model = model
+        self.status = "queued"
+        self.error: Optional[str] = None
+        self.created = time.time()
+        self.started: Optional[float] = None
+        self.finished: Optional[float] = None
+        # Прогресс по каждому серверу: текущий статус Ollama и байты по слоям (digest -> (completed, total))
+        self.backends: Dict[str, Dict] = {}
+        self.cancel_event = threading.Event()
+        self.version = 0
+        # Защищает слои прогресса и список открытых ответов Ollama
+        self.lock = threading.Lock()
+        self.responses: List[requests.Response] = []
+
+    @property
+    def active(self) -> bool:
+        return self.status in ACTIVE_STATUSES
+
+    def progress(self):
+        """Загружено и всего байт по всем серверам и слоям"""
+        with self.lock:
+            layers = [list(backend["layers"].values()) for backend in self.backends.values()]
+        completed = total = 0
+        for backend_layers in layers:
+            for layer_completed, layer_total in backend_layers:
+                completed += layer_completed
+                total += layer_total
+        return completed, total
+
+    def cancel(self):
+        """Отмена: флаг для потоков загрузки и разрыв открытых соединений с Ollama.
+
+        Поток может ждать следующую строку статуса до read_timeout, поэтому
+        одного флага недостаточно. HTTPResponse.shutdown() (urllib3 2.3+)
+        прерывает чтение в другом потоке, а поток загрузки затем закрывает
+        ответ: соединение закрывается и в пул не возвращается. Закрыть ответ
+        отсюда нельзя — close() ждёт, пока завершится идущее чтение.
+        """
+        self.cancel_event.set()
+        with self.lock:
+            responses = list(self.responses)
+        for response in responses:
+            try:
+                response.raw.shutdown()
+            except (ValueError, RuntimeError, OSError):
+                # Соединение уже закрыто или возвращено в пул: читать больше нечего
+                pass
+
+    def to_dict(self) -> Dict:
+        completed, total = self.progress()
+        return {
+            "id": self.id,
+            "model": self.model,
+            "status": self.status,
+            "error": self.error,
+            "completed": completed,
+            "total": total,
+            "percent": round(completed / total * 100, 1) if total else None,
+            "created": self.created,
+            "started": self.started,
+            "finished": self.finished,
+            "backends": {
+                url: {key: value for key, value in backend.items() if key != "layers"}
+                for url, backend in self.backends.items()
+            }
+        }
+
+
+class PullJobManager:
+    """Реестр фоновых загрузок моделей.
+
+    Каждая загрузка выполняется в отдельном потоке: запрос /api/pull к
+    каждому серверу читается потоком, а строки статуса Ollama разбираются
+    в прогресс по слоям. Повторный запрос той же модели, пока загрузка идёт,
+    возвращает существующую задачу. Отмена закрывает соединения с Ollama,
+    что прерывает загрузку. При работе в нескольких воркерах состояние задач
+    (не чаще раза в секунду) и флаг отмены хранятся в общем состоянии.
+    """
+
+    def __init__(self, max_finished: int = 50):
+        self.max_finished = max_finished
+        self._lock = threading.Lock()
+        self._changed = threading.Condition(self._lock)
+        self._jobs: "OrderedDict[str, PullJob]" = OrderedDict()
+        self._published: Dict[str, float] = {}
+        self._on_success: List[Callable[[str], None]] = []
+
+    def on_success(self, callback: Callable[[str], None]):
+        """Подписка на успешную загрузку модели (callback(model))"""
+        self._on_success.append(callback)
+
+    def start(self, model: str):
+        """Запуск загрузки; возвращает (задача, True) или (уже идущая задача, False)"""
+        name = normalize_model(model)
+        with self._lock:
+            for job in self._jobs.values():
+                if job.active and normalize_model(job.model) == name:
+                    return job, False
+            remote = self._remote_active(name)
+            if remote is not None:
+                return remote, False
+
+            job = PullJob(model)
+            self._jobs[job.id] = job
+            self._prune()
+        self._publish(job, force=True)
+        threading.Thread(target=self._run, args=(job,), name=f"pull-{job.id[:8]}", daemon=True).start()
+        return job, True
+
+    def get(self, job_id: str) -> Optional[Dict]:
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is not None:
+                return job.to_dict()
+        if is_shared_mode():
+            return shared_state.get(f"pull_job:{job_id}")
+        return None
+
+    def list(self) -> List[Dict]:
+        with self._lock:
+            jobs = {job.id: job.to_dict() for job in self._jobs.values()}
+        if is_shared_mode():
+            for job_id in shared_state.get("pull_jobs", []):
+                snapshot = shared_state.get(f"pull_job:{job_id}")
+                if snapshot and job_id not in jobs:
+                    jobs[job_id] = snapshot
+        return sorted(jobs.values(), key=lambda job: job["created"], reverse=True)
+
+    def cancel(self, job_id: str) -> Optional[Dict]:
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is not None:
+            job.cancel()
+            return job.to_dict()
+        snapshot = self.get(job_id)
+        if snapshot is not None and snapshot["status"] in ACTIVE_STATUSES:
+            # Задача выполняется в другом воркере: он проверяет флаг раз в секунду
+            shared_state.set(f"pull_cancel:{job_id}", True)
+        return snapshot
+
+    def wait(self, job_id: str, version: int, timeout: float = 15.0):
+        """Ожидание изменения задачи; возвращает (снимок, версия)"""
+        deadline = time.monotonic() + timeout
+        with self._changed:
+            job = self._jobs.get(job_id)
+            if job is not None:
+                while job.version == version and job.active:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._changed.wait(remaining)
+                return job.to_dict(), job.version
+        if not is_shared_mode():
+            return None, version
+        # Задача другого воркера: её снимок обновляется в общем состоянии раз в секунду
+        if version >= 0:
+            time.sleep(1.0)
+        return shared_state.get(f"pull_job:{job_id}"), version + 1
+
+    def _remote_active(self, name: str) -> Optional[PullJob]:
+        """Загрузка этой модели в другом воркере (по опубликованному состоянию)"""
+        if not is_shared_mode():
+            return None
+        job_id = shared_state.get(f"pull_model:{name}")
+        snapshot = shared_state.get(f"pull_job:{job_id}") if job_id else None
+        if not snapshot or snapshot["status"] not in ACTIVE_STATUSES:
+            return None
+        job = PullJob(snapshot["model"])
+        job.id = snapshot["id"]
+        job.status = snapshot["status"]
+        job.created = snapshot["created"]
+        return job
+
+    def _prune(self):
+        finished = [job_id for job_id, job in self._jobs.items() if not job.active]
+        for job_id in finished[:max(0, len(finished) - self.max_finished)]:
+            del self._jobs[job_id]
+
+    def _touch(self, job: PullJob):
+        with self._changed:
+            job.version += 1
+            self._changed.notify_all()
+        self._publish(job)
+
+    def _publish(self, job: PullJob, force: bool = False):
+        """Состояние задачи для других воркеров (не чаще раза в секунду)"""
+        if not is_shared_mode():
+            return
+        now = time.monotonic()
+        if not force and now - self._published.get(job.id, 0) < 1.0:
+            return
+        self._published[job.id] = now
+        try:
+            shared_state.set(f"pull_job:{job.id}", job.to_dict())
+            if force:
+                name = normalize_model(job.model)
+                shared_state.set(f"pull_model:{name}", job.id if job.active else None)
+                recent = [job_id for job_id in shared_state.get("pull_jobs", []) if job_id != job.id]
+                shared_state.set("pull_jobs", ([job.id] + recent)[:self.max_finished])
+        except Exception as e:
+            logger.error(f"Ошибка публикации состояния загрузки {job.model}: {e}")
+
+    def _check_remote_cancel(self, job: PullJob):
+        """Отмена, запрошенная в другом воркере (флаг в общем состоянии)"""
+        if not is_shared_mode() or job.cancel_event.is_set():
+            return
+        try:
+            if shared_state.get(f"pull_cancel:{job.id}"):
+                job.cancel()
+        except Exception as e:
+            logger.error(f"Ошибка проверки отмены загрузки {job.model}: {e}")
+
+    def _run(self, job: PullJob):
+        job.status = "running"
+        job.started = time.time()
+        backends = [backend for backend in backend_pool.backends() if backend.healthy] or backend_pool.backends()
+        for backend in backends:
+            job.backends[backend.url] = {"status": "queued", "error": None, "layers": {}}
+        self._touch(job)
+
+        threads = [threading.Thread(target=self._pull_on, args=(job, backend), daemon=True) for backend in backends]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            # Потоки загрузки могут ждать Ollama до read_timeout; флаг отмены проверяется здесь
+            while thread.is_alive():
+                thread.join(1.0)
+                self._check_remote_cancel(job)
+
+        errors = [f"{url}: {state['error']}" for url, state in job.backends.items() if state["error"]]
+        if job.cancel_event.is_set():
+            job.status = "cancelled"
+            details, status = f"Загрузка модели {job.model} отменена", "warning"
+        elif errors:
+            job.status = "error"
+            job.error = "; ".join(errors)
+            details, status = f"Ошибка при загрузке модели {job.model}: {job.error}", "error"
+        else:
+            job.status = "success"
+            details, status = f"Модель {job.model} успешно загружена", "success"
+
+        if len(errors) < len(backends) and not job.cancel_event.is_set():
+            for callback in self._on_success:
+                try:
+                    callback(job.model)
+                except Exception as e:
+                    logger.error(f"Ошибка обработчика загрузки модели {job.model}: {e}")
+
+        job.finished = time.time()
+        log_manager.add_log(LogEntry(action="pull_model", details=details, status=status))
+        with self._changed:
+            job.version += 1
+            self._changed.notify_all()
+        self._publish(job, force=True)
+
+    def _pull_on(self, job: PullJob, backend):
+        state = job.backends[backend.url]
+        try:
+            response = ollama_client.post(
+                "/api/pull",
+                json={"name": job.model, "stream": True},
+                stream=True,
+                # Между строками статуса при больших слоях могут быть паузы
+                read_timeout=600,
+                backend=backend
+            )
+        except requests.RequestException as e:
+            state["status"], state["error"] = "error", f"Ошибка соединения: {str(e)}"
+            self._touch(job)
+            return
+
+        with job.lock:
+            job.responses.append(response)
+        try:
+            if job.cancel_event.is_set():
+                state["status"] = "cancelled"
+                return
+            if response.status_code != 200:
+                state["status"], state["error"] = "error", f"Код ответа {response.status_code}"
+                return
+            for line in response.iter_lines(chunk_size=None):
+                if job.cancel_event.is_set():
+                    state["status"] = "cancelled"
+                    return
+                if not line:
+                    continue
+                update = json.loads(line)
+                if update.get("error"):
+                    state["status"], state["error"] = "error", update["error"]
+                    return
+                state["status"] = update.get("status", state["status"])
+                if update.get("digest") and update.get("total"):
+                    with job.lock:
+                        state["layers"][update["digest"]] = (update.get("completed", 0), update["total"])
+                self._touch(job)
+            if job.cancel_event.is_set():
+                state["status"] = "cancelled"
+            elif state["status"] != "success":
+                state["status"], state["error"] = "error", "Ollama закрыла поток без статуса success"
+        except (requests.RequestException, ValueError) as e:
+            if job.cancel_event.is_set():
+                # Соединение разорвано отменой
+                state["status"] = "cancelled"
+            else:
+                state["status"], state["error"] = "error", f"Поток прерван: {str(e)}"
+        finally:
+            with job.lock:
+                job.responses.remove(response)
+            # Закрытие соединения прерывает загрузку в Ollama при отмене
+            response.close()
+            self._touch(job)
+
+
+# Глобальный экземпляр
+pull_jobs = PullJobManager()
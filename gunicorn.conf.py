@@ -0,0 +1,16 @@
+import os
+import multiprocessing
+
+# Запуск: gunicorn main:app
+bind = os.environ.get("BIND", "0.0.0.0:5000")
+workers = int(os.environ.get("WEB_CONCURRENCY", multiprocessing.cpu_count() * 2 + 1))
+threads = int(os.environ.get("GUNICORN_THREADS", "4"))
+
+# Несколько воркеров делят URL Ollama, состояние расширений и журнал логов через shared_state
+raw_env = ["SHARED_STATE=1"] if workers > 1 else []
+
+
+def post_worker_init(worker):
+    # Фоновые потоки запускаются в воркере, не дожидаясь первого запроса
+    from app import start_background_workers
+    start_background_workers()
@@ -0,0 +1,841 @@
+import os
+import gzip
+import json
+import time
+import queue
+import logging
+import sqlite3
+import threading
+from datetime import datetime
+from typing import Callable, Iterator, List, Dict, Optional
+
+from shared_state import FileLock
+
+# Настройка логирования
+logger = logging.getLogger(__name__)
+
+
+class LogBackend:
+    """Интерфейс постоянного хранилища логов для LogManager.
+
+    Записи передаются и возвращаются как словари LogEntry.to_dict() и
+    упорядочены по seq. LogManager держит в памяти только недавнее окно,
+    всё остальное запрашивается у хранилища через query().
+    """
+
+    name = "base"
+    # Межпроцессная блокировка; задаётся enable_shared() при работе в нескольких воркерах
+    lock: Optional[FileLock] = None
+
+    def enable_shared(self, lock_path: str):
+        """Режим нескольких процессов: запись под файловой блокировкой, seq выдаётся при записи"""
+        self.lock = FileLock(lock_path)
+
+    def load_recent(self, limit: int) -> List[Dict]:
+        """Последние limit записей в порядке возрастания seq"""
+        if self.lock is None:
+            return self._load_recent(limit)
+        with self.lock:
+            return self._load_recent(limit)
+
+    def _load_recent(self, limit: int) -> List[Dict]:
+        raise NotImplementedError
+
+    def follow(self, since: int) -> List[Dict]:
+        """Записи с seq > since, в том числе записанные другими процессами, по возрастанию seq"""
+        return list(self.query(since=since, newest_first=False))
+
+    def last_seq(self) -> int:
+        """Наибольший сохранённый seq"""
+        raise NotImplementedError
+
+    def append(self, records: List[Dict]) -> bool:
+        """Сохранение пачки записей. Возвращает True, если нужно вызвать maintain()"""
+        raise NotImplementedError
+
+    def append_entries(self, entries: List) -> bool:
+        """Сохранение пачки объектов LogEntry.
+
+        В режиме нескольких процессов запись идёт под файловой блокировкой, а
+        seq назначается здесь же из общего счётчика, хранимого в файле блокировки,
+        поэтому номера уникальны и монотонны для всех воркеров. Время записи
+        сдвигается к моменту назначения seq, чтобы порядок по времени совпадал
+        с порядком по seq и у записей разных воркеров.
+        """
+        if self.lock is None:
+            return self._write_entries(entries)
+        with self.lock:
+            self._prepare_shared_write()
+            stored = self.lock.read_value()
+            last = int(stored) if stored.isdigit() else self.last_seq()
+            now = time.time()
+            for seq, entry in enumerate(entries, start=last + 1):
+                entry.seq = seq
+                entry.ts = max(entry.ts, now)
+            need_maintenance = self._write_entries(entries)
+            self.lock.write_value(str(entries[-1].seq))
+            return need_maintenance
+
+    def _write_entries(self, entries: List) -> bool:
+        """Запись пачки LogEntry; хранилища могут сериализовать их без словарей"""
+        return self.append([entry.to_dict() for entry in entries])
+
+    def _prepare_shared_write(self):
+        """Синхронизация с изменениями других процессов перед записью (под блокировкой)"""
+
+    def needs_maintenance(self) -> bool:
+        return False
+
+    def maintain(self):
+        """Обслуживание хранилища (ротация, очистка), вызывается из потока записи"""
+        if self.lock is None:
+            self._maintain()
+            return
+        with self.lock:
+            self._prepare_shared_write()
+            self._maintain()
+
+    def _maintain(self):
+        pass
+
+    def after_fork(self):
+        """Сброс ресурсов, которые нельзя разделять с родительским процессом"""
+
+    def query(self, action: Optional[str] = None, status: Optional[str] = None,
+              since: Optional[int] = None, start: Optional[str] = None, end: Optional[str] = None,
+              before_seq: Optional[int] = None, limit: Optional[int] = None,
+              newest_first: bool = True) -> Iterator[Dict]:
+        """Выборка записей с фильтрами; before_seq ограничивает выборку записями старше окна в памяти"""
+        raise NotImplementedError
+
+    def stats(self) -> Dict:
+        return {"backend": self.name}
+
+    def close(self):
+        pass
+
+
+def _matches(record: Dict, action: Optional[str], status: Optional[str],
+             start: Optional[str], end: Optional[str]) -> bool:
+    if action is not None and record.get("action") != action:
+        return False
+    if status is not None and record.get("status") != status:
+        return False
+    timestamp = record.get("timestamp") or ""
+    return not ((start and timestamp < start) or (end and timestamp > end))
+
+
+class LogJournal(LogBackend):
+    """Журнал логов только на дозапись в формате JSON Lines.
+
+    Каждая запись - одна строка JSON, поэтому добавление записи стоит O(1)
+    независимо от размера истории. Активный файл журнала ротируется по размеру
+    (max_bytes), числу записей (max_entries) или возрасту (max_age секунд):
+    он сжимается в gzip-сегмент в каталоге архива, а сведения о сегменте
+    (диапазоны seq и времени) заносятся в manifest.json. Старые сегменты
+    читаются с диска только по запросу.
+    """
+
+    name = "jsonl"
+    MANIFEST = "manifest.json"
+
+    def __init__(self, path: str, legacy_path: Optional[str] = None,
+                 max_entries: int = 10000, max_bytes: int = 4 * 1024 * 1024,
+                 max_age: Optional[float] = 24 * 3600, archive_dir: Optional[str] = None,
+                 max_segments: Optional[int] = None):
+        self.path = path
+        self.legacy_path = legacy_path
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.archive_dir = archive_dir or os.path.splitext(path)[0] + "_archive"
+        self.max_segments = max_segments
+        self.segments: List[Dict] = self._load_manifest()
+        self._file = None
+        self._lines = 0
+        self._bytes = 0
+        self._first_record: Optional[Dict] = None
+        self._last_record: Optional[Dict] = None
+        self._opened_at = time.time()
+        # Позиция чтения журнала для follow(): inode файла и смещение
+        self._follow_inode = None
+        self._follow_offset = 0
+
+    @property
+    def last_archived_seq(self) -> int:
+        return self.segments[-1]["last_seq"] if self.segments else 0
+
+    def enable_shared(self, lock_path: Optional[str] = None):
+        super().enable_shared(lock_path or self.path + ".lock")
+
+    def _load_recent(self, limit: int) -> List[Dict]:
+        records = self.load()[-limit:]
+
+        # После ротации активный журнал может быть почти пуст - окно дополняется из последних сегментов
+        missing = limit - len(records)
+        if missing > 0 and self.segments:
+            before_seq = records[0].get("seq") if records else None
+            archived = []
+            for record in self.read_archive(before_seq=before_seq):
+                archived.append(record)
+                if len(archived) >= missing:
+                    break
+            records = archived[::-1] + records
+        return records
+
+    def last_seq(self) -> int:
+        if self._last_record and self._last_record.get("seq"):
+            return self._last_record["seq"]
+        return self.last_archived_seq
+
+    def load(self) -> List[Dict]:
+        """Чтение активного файла журнала с восстановлением после аварийного завершения"""
+        if not os.path.exists(self.path) and self.legacy_path and os.path.exists(self.legacy_path):
+            self._migrate_legacy()
+
+        records, good_offset, corrupted = self._read_records()
+
+        # Обрезаем оборванную последнюю строку, чтобы следующие записи не склеились с ней
+        if os.path.exists(self.path) and os.path.getsize(self.path) > good_offset:
+            logger.warning(f"Журнал {self.path} обрезан до последней целой записи ({good_offset} байт)")
+            with open(self.path, 'r+b') as f:
+                f.truncate(good_offset)
+
+        # Сбой между архивированием и очисткой журнала: записи уже есть в сегменте
+        archived = self.last_archived_seq
+        stale = sum(1 for record in records if (record.get("seq") or 0) and record["seq"] <= archived)
+        if stale:
+            records = [record for record in records if not record.get("seq") or record["seq"] > archived]
+
+        if corrupted or stale:
+            logger.warning(f"Журнал {self.path}: пропущено повреждённых записей {corrupted}, уже архивированных {stale}")
+            self._write_atomic(self.path, records)
+
+        self._lines = len(records)
+        self._bytes = os.path.getsize(self.path) if os.path.exists(self.path) else 0
+        self._first_record = records[0] if records else None
+        self._last_record = records[-1] if records else None
+        self._opened_at = _record_time(self._first_record) or time.time()
+        if os.path.exists(self.path):
+            self._follow_inode = os.stat(self.path).st_ino
+            self._follow_offset = self._bytes
+        return records
+
+    def follow(self, since: int) -> List[Dict]:
+        """Дочитывание новых строк журнала, дописанных любым процессом"""
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return []
+
+        records = []
+        if stat.st_ino != self._follow_inode:
+            # Журнал ротирован: непрочитанный хвост старого файла уже лежит в сегменте
+            self.segments = self._load_manifest()
+            records.extend(self.read_archive(since=since, newest_first=False))
+            self._follow_inode = stat.st_ino
+            self._follow_offset = 0
+
+        if stat.st_size > self._follow_offset:
+            with open(self.path, 'rb') as f:
+                f.seek(self._follow_offset)
+                data = f.read(stat.st_size - self._follow_offset)
+            # Незавершённая последняя строка будет дочитана в следующий раз
+            complete = data.rfind(b'\n') + 1
+            self._follow_offset += complete
+            for line in data[:complete].splitlines():
+                if not line.strip():
+                    continue
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    continue
+
+        return [record for record in records if (record.get("seq") or 0) > since]
+
+    def _read_records(self):
+        """Построчное чтение журнала. Возвращает записи, смещение конца последней целой строки и число битых строк"""
+        records = []
+        offset = 0
+        corrupted = 0
+        try:
+            f = open(self.path, 'rb')
+        except FileNotFoundError:
+            return records, offset, corrupted
+
+        with f:
+            for line in f:
+                # Строка без перевода строки - запись, оборванная при сбое
+                if not line.endswith(b'\n'):
+                    break
+                offset += len(line)
+                if not line.strip():
+                    continue
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    corrupted += 1
+        return records, offset, corrupted
+
+    def _migrate_legacy(self):
+        """Перенос старого logs.json (JSON-массив) в журнал"""
+        try:
+            with open(self.legacy_path, 'r', encoding='utf-8') as f:
+                records = json.load(f)
+        except (OSError, json.JSONDecodeError) as e:
+            logger.error(f"Не удалось прочитать {self.legacy_path} для миграции: {e}")
+            return
+
+        for seq, record in enumerate(records, start=self.last_archived_seq + 1):
+            record.setdefault("seq", seq)
+        self._write_atomic(self.path, records)
+        os.replace(self.legacy_path, self.legacy_path + '.migrated')
+        logger.info(f"Логи перенесены из {self.legacy_path} в {self.path}: {len(records)} записей")
+
+    def _write_atomic(self, path: str, records: List[Dict], compress: bool = False):
+        """Атомарная запись файла записей через временный файл"""
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as raw:
+            f = gzip.GzipFile(fileobj=raw, mode='wb') if compress else raw
+            for record in records:
+                f.write(self._encode(record))
+            if compress:
+                f.close()
+            raw.flush()
+            os.fsync(raw.fileno())
+        os.replace(tmp_path, path)
+
+    @staticmethod
+    def _encode(record: Dict) -> bytes:
+        return (json.dumps(record, ensure_ascii=False) + '\n').encode('utf-8')
+
+    def append(self, records: List[Dict]) -> bool:
+        """Дозапись записей в конец журнала. Возвращает True, если пора ротировать журнал"""
+        return self._append_data(b''.join(self._encode(record) for record in records), records[0], records[-1],
+                                 len(records))
+
+    def _write_entries(self, entries: List) -> bool:
+        data = ''.join(entry.to_json() + '\n' for entry in entries).encode('utf-8')
+        return self._append_data(data, entries[0].to_dict(), entries[-1].to_dict(), len(entries))
+
+    def _prepare_shared_write(self):
+        """Если другой воркер ротировал журнал, открытый дескриптор указывает на удалённый файл"""
+        try:
+            current = os.stat(self.path).st_ino
+        except FileNotFoundError:
+            current = None
+        if self._file is not None and os.fstat(self._file.fileno()).st_ino != current:
+            self.close()
+            self.segments = self._load_manifest()
+            self._lines = 0
+            self._first_record = None
+            self._opened_at = time.time()
+        self._bytes = os.path.getsize(self.path) if current is not None else 0
+
+    def _append_data(self, data: bytes, first: Dict, last: Dict, count: int) -> bool:
+        if self._file is None:
+            self._file = open(self.path, 'ab')
+        self._file.write(data)
+        self._file.flush()
+
+        if self._first_record is None:
+            self._first_record = first
+            self._opened_at = time.time()
+        self._last_record = last
+        self._lines += count
+        self._bytes += len(data)
+        return self.needs_maintenance()
+
+    def _maintain(self):
+        self.rotate()
+
+    def needs_maintenance(self) -> bool:
+        if not self._lines:
+            return False
+        if self._lines >= self.max_entries or self._bytes >= self.max_bytes:
+            return True
+        return self.max_age is not None and time.time() - self._opened_at >= self.max_age
+
+    def rotate(self):
+        """Перенос активного журнала в сжатый сегмент архива"""
+        self.close()
+        records, _, _ = self._read_records()
+        if not records:
+            return
+        if self.lock is not None and not self._rotation_due(records):
+            # Другой воркер уже ротировал журнал
+            self._lines = len(records)
+            self._first_record = records[0]
+            return
+
+        if self.lock is not None:
+            # Манифест мог быть дополнен другими воркерами
+            self.segments = self._load_manifest()
+
+        os.makedirs(self.archive_dir, exist_ok=True)
+        first, last = records[0], records[-1]
+        name = f"segment-{first.get('seq') or 0:012d}-{last.get('seq') or 0:012d}.jsonl.gz"
+        self._write_atomic(os.path.join(self.archive_dir, name), records, compress=True)
+
+        self.segments.append({
+            "file": name,
+            "first_seq": first.get("seq") or 0,
+            "last_seq": last.get("seq") or 0,
+            "start": first.get("timestamp"),
+            "end": last.get("timestamp"),
+            "count": len(records)
+        })
+        if self.max_segments is not None:
+            while len(self.segments) > self.max_segments:
+                expired = self.segments.pop(0)
+                try:
+                    os.remove(os.path.join(self.archive_dir, expired["file"]))
+                except FileNotFoundError:
+                    pass
+        self._write_manifest()
+
+        # Журнал очищается только после того, как сегмент и манифест записаны на диск
+        self._write_atomic(self.path, [])
+        self._lines = 0
+        self._bytes = 0
+        self._first_record = None
+        self._last_record = None
+        self._opened_at = time.time()
+        logger.info(f"Журнал логов ротирован в сегмент {name} ({len(records)} записей)")
+
+    def _rotation_due(self, records: List[Dict]) -> bool:
+        if len(records) >= self.max_entries or os.path.getsize(self.path) >= self.max_bytes:
+            return True
+        started = _record_time(records[0])
+        return self.max_age is not None and started is not None and time.time() - started >= self.max_age
+
+    def _load_manifest(self) -> List[Dict]:
+        try:
+            with open(os.path.join(self.archive_dir, self.MANIFEST), 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return []
+        except (OSError, json.JSONDecodeError) as e:
+            logger.error(f"Не удалось прочитать манифест архива логов: {e}")
+            return []
+
+    def _write_manifest(self):
+        path = os.path.join(self.archive_dir, self.MANIFEST)
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.segments, f, ensure_ascii=False, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+
+    def read_archive(self, before_seq: Optional[int] = None, since: Optional[int] = None,
+                     start: Optional[str] = None, end: Optional[str] = None,
+                     newest_first: bool = True) -> Iterator[Dict]:
+        """Ленивое чтение архивных сегментов; сегменты вне диапазонов seq/времени не открываются"""
+        segments = reversed(self.segments) if newest_first else iter(self.segments)
+        for segment in list(segments):
+            if before_seq is not None and segment["first_seq"] >= before_seq:
+                continue
+            if since is not None and segment["last_seq"] <= since:
+                continue
+            if start and segment.get("end") and segment["end"] < start:
+                continue
+            if end and segment.get("start") and segment["start"] > end:
+                continue
+
+            try:
+                with gzip.open(os.path.join(self.archive_dir, segment["file"]), 'rb') as f:
+                    records = [json.loads(line) for line in f if line.strip()]
+            except (OSError, ValueError) as e:
+                logger.error(f"Не удалось прочитать сегмент логов {segment['file']}: {e}")
+                continue
+
+            if newest_first:
+                records.reverse()
+            for record in records:
+                seq = record.get("seq") or 0
+                if before_seq is not None and seq >= before_seq:
+                    continue
+                if since is not None and seq <= since:
+                    continue
+                yield record
+
+    def query(self, action: Optional[str] = None, status: Optional[str] = None,
+              since: Optional[int] = None, start: Optional[str] = None, end: Optional[str] = None,
+              before_seq: Optional[int] = None, limit: Optional[int] = None,
+              newest_first: bool = True) -> Iterator[Dict]:
+        """Фильтрация архивных сегментов; активный журнал целиком находится в окне памяти"""
+        found = 0
+        for record in self.read_archive(before_seq=before_seq, since=since, start=start,
+                                        end=end, newest_first=newest_first):
+            if not _matches(record, action, status, start, end):
+                continue
+            yield record
+            found += 1
+            if limit and found >= limit:
+                return
+
+    def stats(self) -> Dict:
+        return {
+            "backend": self.name,
+            "active_entries": self._lines,
+            "active_bytes": self._bytes,
+            "segments": len(self.segments),
+            "archived_entries": sum(segment["count"] for segment in self.segments),
+            "last_archived_seq": self.last_archived_seq
+        }
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+def _record_time(record: Optional[Dict]) -> Optional[float]:
+    """Время записи журнала в секундах эпохи"""
+    if not record or not record.get("timestamp"):
+        return None
+    try:
+        return datetime.fromisoformat(record["timestamp"]).timestamp()
+    except ValueError:
+        return None
+
+
+class SQLiteLogBackend(LogBackend):
+    """Хранилище логов в SQLite для историй из миллионов записей.
+
+    База работает в режиме WAL (чтение не блокируется записью), записи
+    вставляются пачками в одной транзакции, а фильтры по action, status,
+    seq и времени выполняются в SQL по индексам.
+    """
+
+    name = "sqlite"
+
+    SCHEMA = (
+        "CREATE TABLE IF NOT EXISTS logs ("
+        " seq INTEGER PRIMARY KEY,"
+        " action TEXT NOT NULL,"
+        " details TEXT NOT NULL,"
+        " status TEXT NOT NULL,"
+        " timestamp TEXT NOT NULL)",
+        "CREATE INDEX IF NOT EXISTS idx_logs_timestamp ON logs (timestamp)",
+        "CREATE INDEX IF NOT EXISTS idx_logs_action ON logs (action, seq)",
+        "CREATE INDEX IF NOT EXISTS idx_logs_status ON logs (status, seq)",
+    )
+
+    def __init__(self, path: str = "logs.db", legacy_path: Optional[str] = None,
+                 max_rows: Optional[int] = None):
+        self.path = path
+        self.legacy_path = legacy_path
+        # Необязательное ограничение размера истории; None - хранить всё
+        self.max_rows = max_rows
+        self._local = threading.local()
+        self._appended = 0
+
+        conn = self._connection()
+        conn.execute("PRAGMA journal_mode=WAL")
+        with conn:
+            for statement in self.SCHEMA:
+                conn.execute(statement)
+
+    def _connection(self) -> sqlite3.Connection:
+        """Отдельное соединение на поток: запись идёт из потока записи, чтение - из обработчиков"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.row_factory = sqlite3.Row
+            self._local.conn = conn
+        return conn
+
+    def enable_shared(self, lock_path: Optional[str] = None):
+        super().enable_shared(lock_path or self.path + ".lock")
+
+    def after_fork(self):
+        self._local = threading.local()
+
+    def _load_recent(self, limit: int) -> List[Dict]:
+        if self.legacy_path and os.path.exists(self.legacy_path) and not self.last_seq():
+            self._migrate_legacy()
+        rows = self._connection().execute(
+            "SELECT seq, action, details, status, timestamp FROM logs ORDER BY seq DESC LIMIT ?",
+            (limit,)
+        ).fetchall()
+        return [dict(row) for row in reversed(rows)]
+
+    def _migrate_legacy(self):
+        """Перенос старого logs.json (JSON-массив) в базу"""
+        try:
+            with open(self.legacy_path, 'r', encoding='utf-8') as f:
+                records = json.load(f)
+        except (OSError, json.JSONDecodeError) as e:
+            logger.error(f"Не удалось прочитать {self.legacy_path} для миграции: {e}")
+            return
+        for seq, record in enumerate(records, start=1):
+            record.setdefault("seq", seq)
+        self.append(records)
+        os.replace(self.legacy_path, self.legacy_path + '.migrated')
+        logger.info(f"Логи перенесены из {self.legacy_path} в {self.path}: {len(records)} записей")
+
+    def last_seq(self) -> int:
+        row = self._connection().execute("SELECT MAX(seq) FROM logs").fetchone()
+        return row[0] or 0
+
+    def append(self, records: List[Dict]) -> bool:
+        return self._insert([(r.get("seq"), r.get("action", ""), r.get("details", ""), r.get("status", "info"),
+                              r.get("timestamp") or "") for r in records])
+
+    def _write_entries(self, entries: List) -> bool:
+        return self._insert([(e.seq, e.action, e.details, e.status, e.timestamp) for e in entries])
+
+    def _insert(self, rows: List[tuple]) -> bool:
+        conn = self._connection()
+        with conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO logs (seq, action, details, status, timestamp) VALUES (?, ?, ?, ?, ?)",
+                rows
+            )
+        self._appended += len(rows)
+        return self.needs_maintenance()
+
+    def needs_maintenance(self) -> bool:
+        return self.max_rows is not None and self._appended >= max(self.max_rows // 10, 1)
+
+    def _maintain(self):
+        """Удаление записей сверх max_rows"""
+        self._appended = 0
+        if self.max_rows is None:
+            return
+        conn = self._connection()
+        with conn:
+            conn.execute("DELETE FROM logs WHERE seq <= (SELECT MAX(seq) FROM logs) - ?", (self.max_rows,))
+
+    def query(self, action: Optional[str] = None, status: Optional[str] = None,
+              since: Optional[int] = None, start: Optional[str] = None, end: Optional[str] = None,
+              before_seq: Optional[int] = None, limit: Optional[int] = None,
+              newest_first: bool = True) -> Iterator[Dict]:
+        conditions = []
+        params: List = []
+        for clause, value in (("action = ?", action), ("status = ?", status), ("seq > ?", since),
+                              ("seq < ?", before_seq), ("timestamp >= ?", start or None),
+                              ("timestamp <= ?", end or None)):
+            if value is not None:
+                conditions.append(clause)
+                params.append(value)
+
+        sql = "SELECT seq, action, details, status, timestamp FROM logs"
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+        sql += " ORDER BY seq DESC" if newest_first else " ORDER BY seq ASC"
+        if limit:
+            sql += " LIMIT ?"
+            params.append(limit)
+
+        for row in self._connection().execute(sql, params):
+            yield dict(row)
+
+    def stats(self) -> Dict:
+        row = self._connection().execute("SELECT COUNT(*), MAX(seq) FROM logs").fetchone()
+        return {
+            "backend": self.name,
+            "path": self.path,
+            "entries": row[0],
+            "last_seq": row[1] or 0,
+            "max_rows": self.max_rows
+        }
+
+    def close(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+
+def create_log_backend(kind: str, log_file: str = "logs.json", **options) -> LogBackend:
+    """Создание хранилища логов по имени: jsonl (по умолчанию) или sqlite"""
+    base = os.path.splitext(log_file)[0]
+    if kind == "sqlite":
+        return SQLiteLogBackend(options.pop("path", None) or base + ".db", legacy_path=log_file, **options)
+    if kind in ("jsonl", "json"):
+        return LogJournal(options.pop("path", None) or base + ".jsonl", legacy_path=log_file, **options)
+    raise ValueError(f"Неизвестное хранилище логов: {kind}")
+
+
+class AsyncLogWriter:
+    """Фоновая запись логов в журнал пачками.
+
+    Обработчики запросов только кладут запись в ограниченную очередь, а
+    отдельный поток сбрасывает её в журнал, когда набирается batch_size
+    записей или проходит flush_interval секунд. При переполнении очереди
+    действует явная политика overflow:
+      - drop_oldest - вытеснить самую старую ожидающую запись;
+      - drop_newest - отбросить новую запись;
+      - block - ждать место не дольше block_timeout, затем отбросить новую.
+    Все отброшенные записи учитываются в счётчике dropped. on_tick
+    вызывается на каждом шаге цикла записи (не реже раза в flush_interval).
+    """
+
+    OVERFLOW_POLICIES = ("drop_oldest", "drop_newest", "block")
+
+    def __init__(self, backend: LogBackend, batch_size: int = 100, flush_interval: float = 0.5, max_queue: int = 10000,
+                 overflow: str = "drop_oldest", block_timeout: float = 0.05,
+                 on_tick: Optional[Callable[[], None]] = None):
+        if overflow not in self.OVERFLOW_POLICIES:
+            raise ValueError(f"Неизвестная политика переполнения: {overflow}")
+
+        self.backend = backend
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.overflow = overflow
+        self.block_timeout = block_timeout
+        self.on_tick = on_tick
+
+        self.io_lock = threading.Lock()
+        # Счётчики меняются из потоков запросов и из потока записи
+        self._stats_lock = threading.Lock()
+        self.submitted = 0
+        self.written = 0
+        self.dropped = 0
+        self.failed = 0
+        self.batches = 0
+        self._reported_dropped = 0
+
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._flush_requested = threading.Event()
+        self._flush_waiters: List[threading.Event] = []
+        self._waiters_lock = threading.Lock()
+        self._stopping = False
+        self._thread = threading.Thread(target=self._run, name="log-writer", daemon=True)
+        self._thread.start()
+
+    def submit(self, entry) -> bool:
+        """Постановка записи в очередь. Возвращает False, если запись отброшена"""
+        with self._stats_lock:
+            self.submitted += 1
+        try:
+            if self.overflow == "block":
+                self._queue.put(entry, timeout=self.block_timeout)
+            else:
+                self._queue.put_nowait(entry)
+            return True
+        except queue.Full:
+            pass
+
+        if self.overflow == "drop_oldest":
+            try:
+                self._queue.get_nowait()
+                with self._stats_lock:
+                    self.dropped += 1
+                self._queue.put_nowait(entry)
+                return True
+            except (queue.Empty, queue.Full):
+                pass
+
+        with self._stats_lock:
+            self.dropped += 1
+        return False
+
+    def _run(self):
+        while True:
+            if self.on_tick is not None:
+                try:
+                    self.on_tick()
+                except Exception as e:
+                    logger.error(f"Ошибка периодической обработки логов: {e}")
+            batch = []
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size and not self._flush_requested.is_set():
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=timeout))
+                except queue.Empty:
+                    break
+
+            flushing = self._flush_requested.is_set()
+            if flushing:
+                self._flush_requested.clear()
+                while True:
+                    try:
+                        batch.append(self._queue.get_nowait())
+                    except queue.Empty:
+                        break
+
+            if batch:
+                self._write(batch)
+            elif self.backend.needs_maintenance():
+                # Например, ротация журнала по возрасту, когда новых записей нет
+                with self.io_lock:
+                    self._maintain()
+            self._report_drops()
+
+            if flushing:
+                with self._waiters_lock:
+                    waiters, self._flush_waiters = self._flush_waiters, []
+                for waiter in waiters:
+                    waiter.set()
+
+            if self._stopping and self._queue.empty():
+                break
+
+    def _write(self, batch):
+        with self.io_lock:
+            try:
+                need_maintenance = self.backend.append_entries(batch)
+                with self._stats_lock:
+                    self.written += len(batch)
+                    self.batches += 1
+            except (OSError, sqlite3.Error) as e:
+                with self._stats_lock:
+                    self.failed += len(batch)
+                logger.error(f"Ошибка записи пачки логов в журнал ({len(batch)} записей): {e}")
+                return
+            if need_maintenance:
+                self._maintain()
+
+    def _maintain(self):
+        try:
+            self.backend.maintain()
+        except (OSError, sqlite3.Error) as e:
+            logger.error(f"Ошибка обслуживания хранилища логов: {e}")
+
+    def _report_drops(self):
+        dropped = self.dropped
+        if dropped > self._reported_dropped:
+            logger.warning(
+                f"Очередь логов переполнена: отброшено {dropped - self._reported_dropped} записей "
+                f"(всего {dropped}, политика {self.overflow})"
+            )
+            self._reported_dropped = dropped
+
+    def flush(self, timeout: Optional[float] = 5.0) -> bool:
+        """Синхронный сброс всех ожидающих записей в журнал"""
+        if not self._thread.is_alive():
+            return self._queue.empty()
+        done = threading.Event()
+        with self._waiters_lock:
+            self._flush_waiters.append(done)
+        self._flush_requested.set()
+        return done.wait(timeout)
+
+    def close(self, timeout: Optional[float] = 5.0):
+        """Сброс очереди и остановка потока записи (хук завершения работы)"""
+        self._stopping = True
+        self.flush(timeout)
+        self._thread.join(timeout)
+        with self.io_lock:
+            self.backend.close()
+
+    def stats(self) -> Dict:
+        with self._stats_lock:
+            return {
+                "queued": self._queue.qsize(),
+                "max_queue": self._queue.maxsize,
+                "overflow_policy": self.overflow,
+                "submitted": self.submitted,
+                "written": self.written,
+                "dropped": self.dropped,
+                "failed": self.failed,
+                "batches": self.batches
+            }
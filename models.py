@@ -1,49 +1,453 @@
-from datetime import datetime
+import os
+import re
+import sys
 import json
-from typing import List, Dict, Optional
+import time
+import atexit
+import bisect
+import threading
+from collections import Counter, OrderedDict
+from datetime import datetime
+from typing import Iterable, Iterator, List, Dict, Optional, Union
+
+from log_storage import LogBackend, AsyncLogWriter, create_log_backend
+from shared_state import is_shared_mode
+
+# Повторы одинаковой ошибки в пределах окна (секунды) сворачиваются в одну запись со счётчиком
+LOG_COLLAPSE_WINDOW = float(os.environ.get("LOG_COLLAPSE_WINDOW", "60"))
+COLLAPSED_STATUSES = ("error", "warning")
+# Адреса объектов в тексте исключений различаются у одинаковых ошибок
+_ADDRESS_RE = re.compile(r"0x[0-9a-fA-F]+")
+
+# Быстрое C-кодирование строки в JSON (с кавычками)
+_encode_json_str = json.encoder.encode_basestring
 
 class LogEntry:
-    def __init__(self, action: str, details: str, status: str = "info", timestamp: str = None):
-        self.action = action
+    """Запись лога в компактном виде.
+
+    __slots__ убирает словарь атрибутов у каждого объекта, action/status
+    интернируются (одна строка на всё множество записей), а время хранится
+    числом секунд эпохи вместо ISO-строки.
+    """
+
+    __slots__ = ("seq", "action", "details", "status", "ts")
+
+    # JSON-представление интернированных значений action/status кэшируется
+    _json_cache: Dict[str, str] = {}
+
+    def __init__(self, action: str, details: str, status: str = "info",
+                 timestamp: Union[str, float, None] = None, seq: Optional[int] = None):
+        self.action = sys.intern(action)
         self.details = details
-        self.status = status
-        self.timestamp = timestamp or datetime.now().isoformat()
+        self.status = sys.intern(status)
+        self.ts = parse_timestamp(timestamp) if timestamp is not None else time.time()
+        # Монотонный порядковый номер, назначается LogManager при добавлении
+        self.seq = seq
+
+    @property
+    def timestamp(self) -> str:
+        return datetime.fromtimestamp(self.ts).isoformat()
 
     def to_dict(self) -> Dict:
         return {
+            "seq": self.seq,
             "action": self.action,
             "details": self.details,
             "status": self.status,
             "timestamp": self.timestamp
         }
 
+    def to_json(self) -> str:
+        """Сериализация в JSON без промежуточного словаря"""
+        cache = self._json_cache
+        action = cache.get(self.action)
+        if action is None:
+            action = cache[self.action] = _encode_json_str(self.action)
+        status = cache.get(self.status)
+        if status is None:
+            status = cache[self.status] = _encode_json_str(self.status)
+        return (
+            f'{{"seq": {"null" if self.seq is None else self.seq}, "action": {action}, '
+            f'"details": {_encode_json_str(self.details)}, "status": {status}, '
+            f'"timestamp": "{self.timestamp}"}}'
+        )
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> "LogEntry":
+        return cls(
+            action=data.get("action", ""),
+            details=data.get("details", ""),
+            status=data.get("status", "info"),
+            timestamp=data.get("timestamp"),
+            seq=data.get("seq")
+        )
+
+def parse_timestamp(value: Union[str, float]) -> float:
+    """ISO-строка (или число) в секунды эпохи; ValueError для некорректного значения"""
+    if isinstance(value, (int, float)):
+        return float(value)
+    return datetime.fromisoformat(value).timestamp()
+
+def iter_json(entries: Iterable[LogEntry]) -> Iterator[str]:
+    """Потоковая сериализация списка записей в JSON-массив"""
+    yield "["
+    first = True
+    for entry in entries:
+        if first:
+            first = False
+            yield entry.to_json()
+        else:
+            yield ", " + entry.to_json()
+    yield "]"
+
+class LogCounters:
+    """Поддерживаемые счётчики логов по action/status с разбивкой по минутам"""
+
+    BUCKET_FORMATS = {
+        "minute": 16,  # YYYY-MM-DDTHH:MM
+        "hour": 13,    # YYYY-MM-DDTHH
+        "day": 10      # YYYY-MM-DD
+    }
+
+    def __init__(self, retention_minutes: int = 1440):
+        self.retention_minutes = retention_minutes
+        self.by_action: Counter = Counter()
+        self.by_status: Counter = Counter()
+        # Ключ интервала - номер минуты от начала эпохи
+        self.buckets: "OrderedDict[int, Counter]" = OrderedDict()
+
+    def add(self, entry: LogEntry):
+        self.by_action[entry.action] += 1
+        self.by_status[entry.status] += 1
+
+        minute = int(entry.ts // 60)
+        bucket = self.buckets.get(minute)
+        if bucket is None:
+            bucket = self.buckets[minute] = Counter()
+            while len(self.buckets) > self.retention_minutes:
+                self.buckets.popitem(last=False)
+        bucket[(entry.action, entry.status)] += 1
+
+    def snapshot(self, bucket: str = "minute", start: Optional[str] = None,
+                 end: Optional[str] = None, action: Optional[str] = None) -> Dict:
+        """Агрегаты по интервалам без повторного просмотра записей"""
+        width = self.BUCKET_FORMATS[bucket]
+        aggregated: "OrderedDict[str, Dict]" = OrderedDict()
+        for minute, counts in self.buckets.items():
+            label = datetime.fromtimestamp(minute * 60).isoformat(timespec="minutes")
+            if (start and label < start[:16]) or (end and label > end[:16]):
+                continue
+            key = label[:width]
+            target = aggregated.setdefault(key, {})
+            for (entry_action, status), count in counts.items():
+                if action and entry_action != action:
+                    continue
+                by_status = target.setdefault(entry_action, {})
+                by_status[status] = by_status.get(status, 0) + count
+
+        return {
+            "bucket": bucket,
+            "totals": {
+                "action": dict(self.by_action),
+                "status": dict(self.by_status)
+            },
+            "buckets": [{"bucket": key, "counts": counts} for key, counts in aggregated.items()]
+        }
+
+
 class LogManager:
-    def __init__(self, log_file: str = "logs.json"):
+    def __init__(self, log_file: str = "logs.json", backend: Optional[LogBackend] = None,
+                 max_entries: int = 10000, async_writes: bool = True,
+                 writer_options: Optional[Dict] = None, shared: Optional[bool] = None):
+        # log_file - старый формат (JSON-массив), переносится в хранилище при первом запуске
         self.log_file = log_file
+        # Хранилище выбирается переменной LOG_BACKEND: jsonl (по умолчанию) или sqlite
+        if backend is None:
+            kind = os.environ.get("LOG_BACKEND", "jsonl")
+            options = {"path": os.environ.get("LOG_DB_PATH")} if kind == "sqlite" else {"max_entries": max_entries}
+            backend = create_log_backend(kind, log_file, **options)
+        self.backend = backend
+        # Несколько воркеров: запись сериализуется файловой блокировкой, seq выдаёт хранилище,
+        # а окно в памяти дочитывает записи всех процессов перед каждым чтением
+        self.shared = is_shared_mode() if shared is None else shared
+        if self.shared:
+            self.backend.enable_shared()
+        # В памяти хранится только недавнее окно из max_entries записей,
+        # более старые записи запрашиваются у хранилища
+        self.max_entries = max_entries
+        self.trim_slack = max(max_entries // 10, 1)
+        # Записи упорядочены по seq; вторичные индексы хранят те же объекты
         self.logs: List[LogEntry] = []
+        self._by_action: Dict[str, List[LogEntry]] = {}
+        self._by_status: Dict[str, List[LogEntry]] = {}
+        self.counters = LogCounters()
+        self._next_seq = 1
+        self._lock = threading.Lock()
+        # (action, status, details) -> [начало окна, число подавленных повторов, последние details]
+        self._repeats: Dict[tuple, list] = {}
         self.load_logs()
 
+        # Запись на диск выполняется фоновым потоком, обработчики запросов не ждут диск
+        self.writer: Optional[AsyncLogWriter] = None
+        self._writer_options = writer_options or {}
+        if async_writes:
+            self.writer = AsyncLogWriter(self.backend, on_tick=self._flush_repeats, **self._writer_options)
+            atexit.register(self.close)
+        # Потоки не переживают fork (например, gunicorn --preload) - поток записи создаётся заново
+        os.register_at_fork(after_in_child=self._after_fork)
+
+    def _after_fork(self):
+        self._lock = threading.Lock()
+        self.backend.after_fork()
+        if self.writer is not None:
+            self.writer = AsyncLogWriter(self.backend, on_tick=self._flush_repeats, **self._writer_options)
+
     def load_logs(self):
-        try:
-            with open(self.log_file, 'r') as f:
-                logs_data = json.load(f)
-                self.logs = [LogEntry(**log) for log in logs_data]
-        except (FileNotFoundError, json.JSONDecodeError):
+        with self._lock:
+            records = self.backend.load_recent(self.max_entries)
             self.logs = []
+            self._by_action = {}
+            self._by_status = {}
+            self.counters = LogCounters()
+            self._next_seq = 1
+            for record in records:
+                self._index(LogEntry.from_dict(record))
+            # Нумерация продолжается после записей, уже ушедших из окна
+            self._next_seq = max(self._next_seq, self.backend.last_seq() + 1)
+
+    def _refresh(self):
+        """Подтягивание в окно памяти записей, сохранённых всеми воркерами (режим shared)"""
+        if not self.shared:
+            return
+        with self._lock:
+            for record in self.backend.follow(self._next_seq - 1):
+                self._index(LogEntry.from_dict(record))
+
+    def _index(self, log_entry: LogEntry):
+        """Добавление записи в основной список, индексы и счётчики"""
+        # Старые записи без номера (перенесённые из logs.json) нумеруются при загрузке
+        if log_entry.seq is None or log_entry.seq < self._next_seq:
+            log_entry.seq = self._next_seq
+        self._next_seq = log_entry.seq + 1
+        # Границы по времени в query() ищутся бинарным поиском: при переводе часов назад
+        # время записи в окне не меньше времени предыдущей
+        if self.logs and log_entry.ts < self.logs[-1].ts:
+            log_entry.ts = self.logs[-1].ts
+
+        self.logs.append(log_entry)
+        self._by_action.setdefault(log_entry.action, []).append(log_entry)
+        self._by_status.setdefault(log_entry.status, []).append(log_entry)
+        self.counters.add(log_entry)
+
+        # Кольцевой буфер: лишние записи вытесняются пачкой, чтобы не сдвигать список на каждой записи
+        if len(self.logs) >= self.max_entries + self.trim_slack:
+            self._trim()
 
     def save_logs(self):
-        with open(self.log_file, 'w') as f:
-            json.dump([log.to_dict() for log in self.logs], f, indent=2)
+        """Сброс ожидающих записей на диск"""
+        self.flush()
+
+    def _trim(self):
+        """Вытеснение из памяти записей старше окна max_entries"""
+        excess = len(self.logs) - self.max_entries
+        if excess <= 0:
+            return
+        del self.logs[:excess]
+        first_seq = self.logs[0].seq
+        for index in (self._by_action, self._by_status):
+            for key in list(index):
+                entries = index[key]
+                del entries[:bisect.bisect_left(entries, first_seq, key=_seq_key)]
+                if not entries:
+                    del index[key]
+
+    def _collapse(self, log_entry: LogEntry) -> List[LogEntry]:
+        """Записи, которые нужно добавить вместо log_entry (вызывается под блокировкой).
+
+        Первая ошибка пишется как есть, повторы той же ошибки в течение
+        LOG_COLLAPSE_WINDOW только считаются. Когда окно истекает, вместо них
+        добавляется одна запись с числом повторов.
+        """
+        now = log_entry.ts
+        pending = self._expired_repeats(now)
+
+        if log_entry.status not in COLLAPSED_STATUSES or LOG_COLLAPSE_WINDOW <= 0:
+            return pending + [log_entry]
+        key = (log_entry.action, log_entry.status, _ADDRESS_RE.sub("0x", log_entry.details))
+        repeat = self._repeats.get(key)
+        if repeat is None:
+            self._repeats[key] = [now, 0, log_entry.details]
+            return pending + [log_entry]
+        repeat[1] += 1
+        repeat[2] = log_entry.details
+        return pending
+
+    def _expired_repeats(self, now: float) -> List[LogEntry]:
+        """Итоговые записи истёкших окон повторов (вызывается под блокировкой)"""
+        pending = []
+        for key, (started, count, details) in list(self._repeats.items()):
+            if now - started >= LOG_COLLAPSE_WINDOW:
+                del self._repeats[key]
+                if count:
+                    pending.append(LogEntry(action=key[0], details=f"{details} (повторилось {count} раз)",
+                                            status=key[1]))
+        return pending
+
+    def _flush_repeats(self):
+        """Запись итогов истёкших окон без ожидания следующей записи (из потока записи)"""
+        if not self._repeats:
+            return
+        with self._lock:
+            for entry in self._expired_repeats(time.time()):
+                self._append(entry)
 
     def add_log(self, log_entry: LogEntry):
-        self.logs.append(log_entry)
-        self.save_logs()
+        with self._lock:
+            # Время назначается под блокировкой: окно упорядочено по seq и по времени одновременно,
+            # иначе записи из параллельных потоков легли бы не по порядку ts и query() терял бы их
+            log_entry.ts = time.time()
+            entries = self._collapse(log_entry)
+            for entry in entries:
+                self._append(entry)
+
+    def _append(self, log_entry: LogEntry):
+        # В режиме shared seq назначается при записи, а в окно запись попадает через _refresh()
+        if not self.shared:
+            self._index(log_entry)
+        if self.writer is not None:
+            self.writer.submit(log_entry)
+        elif self.backend.append_entries([log_entry]):
+            self.backend.maintain()
+
+    def flush(self, timeout: Optional[float] = 5.0) -> bool:
+        """Синхронный сброс ожидающих записей на диск"""
+        if self.writer is None:
+            return True
+        return self.writer.flush(timeout)
+
+    def close(self):
+        """Хук завершения работы: дописывает очередь и закрывает журнал"""
+        with self._lock:
+            # Незакрытые окна повторов записываются сразу
+            for (action, status, _), (_, count, details) in self._repeats.items():
+                if count:
+                    self._append(LogEntry(action=action, details=f"{details} (повторилось {count} раз)",
+                                          status=status))
+            self._repeats = {}
+        if self.writer is not None:
+            self.writer.close()
+        else:
+            self.backend.close()
+
+    def writer_stats(self) -> Dict:
+        stats = {"mode": "sync"} if self.writer is None else dict(self.writer.stats(), mode="async")
+        stats["backend"] = self.backend.stats()
+        with self._lock:
+            stats["memory_entries"] = len(self.logs)
+        return stats
 
     def get_logs(self, limit: Optional[int] = None) -> List[Dict]:
-        logs = sorted(self.logs, key=lambda x: x.timestamp, reverse=True)
-        if limit:
-            logs = logs[:limit]
-        return [log.to_dict() for log in logs]
+        return [log.to_dict() for log in self.recent(limit)]
+
+    def recent(self, limit: Optional[int] = None) -> List[LogEntry]:
+        """Последние записи, новые первыми"""
+        self._refresh()
+        with self._lock:
+            # Список уже упорядочен по seq, сортировка не нужна
+            logs = self.logs[-limit:] if limit else self.logs[:]
+        logs.reverse()
+        return logs
+
+    def query(self, action: Optional[str] = None, status: Optional[str] = None,
+              since: Optional[int] = None, start: Optional[str] = None, end: Optional[str] = None,
+              limit: Optional[int] = None, order: str = "desc") -> List[LogEntry]:
+        """Выборка записей по индексам.
+
+        since - курсор: вернуть только записи с seq > since;
+        start/end - границы по времени (ISO-строки, включительно).
+        """
+        start_ts = parse_timestamp(start) if start else None
+        end_ts = parse_timestamp(end) if end else None
+        self._refresh()
+        with self._lock:
+            candidates = self.logs
+            extra_filter = None
+            if action is not None and status is not None:
+                by_action = self._by_action.get(action, [])
+                by_status = self._by_status.get(status, [])
+                if len(by_action) <= len(by_status):
+                    candidates, extra_filter = by_action, ("status", status)
+                else:
+                    candidates, extra_filter = by_status, ("action", action)
+            elif action is not None:
+                candidates = self._by_action.get(action, [])
+            elif status is not None:
+                candidates = self._by_status.get(status, [])
+
+            # Записи добавляются в порядке времени, поэтому границы ищутся бинарным поиском
+            lo, hi = 0, len(candidates)
+            if since is not None:
+                lo = bisect.bisect_right(candidates, since, key=_seq_key)
+            if start:
+                lo = max(lo, bisect.bisect_left(candidates, start_ts, lo, hi, key=_ts_key))
+            if end:
+                hi = bisect.bisect_right(candidates, end_ts, lo, hi, key=_ts_key)
+
+            result = _select(candidates, lo, hi, extra_filter, limit, order == "desc")
+            window_start = self.logs[0].seq if self.logs else self._next_seq
+
+        # Записи старше окна в памяти запрашиваются у хранилища (для SQLite фильтры выполняются в SQL)
+        if since is not None and since >= window_start - 1:
+            return result
+        if start and self.logs and start_ts >= self.logs[0].ts:
+            return result
+        if order == "desc" and limit and len(result) >= limit:
+            return result
+
+        remaining = limit - len(result) if (limit and order == "desc") else limit
+        archived = [LogEntry.from_dict(record) for record in self.backend.query(
+            action=action, status=status, since=since, start=start, end=end,
+            before_seq=window_start, limit=remaining, newest_first=order == "desc"
+        )]
+
+        if order == "desc":
+            return result + archived
+        result = archived + result
+        return result[:limit] if limit else result
+
+    def stats(self, bucket: str = "minute", start: Optional[str] = None,
+              end: Optional[str] = None, action: Optional[str] = None) -> Dict:
+        """Количество записей по action/status в разрезе интервалов времени"""
+        self._refresh()
+        with self._lock:
+            result = self.counters.snapshot(bucket, start, end, action)
+            result["last_seq"] = self._next_seq - 1
+        return result
+
+    @property
+    def last_seq(self) -> int:
+        self._refresh()
+        return self._next_seq - 1
+
+def _seq_key(entry: LogEntry) -> int:
+    return entry.seq
+
+def _ts_key(entry: LogEntry) -> float:
+    return entry.ts
+
+def _select(entries: List[LogEntry], lo: int, hi: int, extra_filter, limit: Optional[int],
+            newest_first: bool) -> List[LogEntry]:
+    """Проход по срезу [lo, hi) с дополнительным фильтром и ограничением количества"""
+    indexes: Iterable[int] = range(hi - 1, lo - 1, -1) if newest_first else range(lo, hi)
+    result = []
+    for i in indexes:
+        entry = entries[i]
+        if extra_filter and getattr(entry, extra_filter[0]) != extra_filter[1]:
+            continue
+        result.append(entry)
+        if limit and len(result) >= limit:
+            break
+    return result
 
 class Config:
     def __init__(self):
@@ -0,0 +1,176 @@
+import os
+import json
+import time
+import sqlite3
+import logging
+import threading
+from typing import Any, Dict, Optional
+
+try:
+    import fcntl
+except ImportError:  # Windows: межпроцессная блокировка недоступна
+    fcntl = None
+
+# Настройка логирования
+logger = logging.getLogger(__name__)
+
+# Не чаще этого интервала (секунды) воркер проверяет изменения, сделанные другими воркерами
+SHARED_STATE_REFRESH = float(os.environ.get("SHARED_STATE_REFRESH", "1"))
+
+
+def is_shared_mode() -> bool:
+    """Работает ли приложение в нескольких процессах (gunicorn с несколькими воркерами)"""
+    if os.environ.get("SHARED_STATE", "").lower() in ("1", "true", "yes"):
+        return True
+    try:
+        return int(os.environ.get("WEB_CONCURRENCY", "1")) > 1
+    except ValueError:
+        return False
+
+
+class FileLock:
+    """Межпроцессная блокировка на файле (flock) с защитой от гонок потоков внутри процесса.
+
+    Повторный захват тем же потоком допускается, чтобы методы, выполняемые
+    под блокировкой, могли вызывать друг друга.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._thread_lock = threading.RLock()
+        self._depth = 0
+        self._fd: Optional[int] = None
+
+    def acquire(self):
+        self._thread_lock.acquire()
+        self._depth += 1
+        if self._depth > 1:
+            return
+        try:
+            self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+            if fcntl is not None:
+                fcntl.flock(self._fd, fcntl.LOCK_EX)
+        except OSError:
+            self._depth -= 1
+            self._thread_lock.release()
+            raise
+
+    def release(self):
+        self._depth -= 1
+        if self._depth == 0 and self._fd is not None:
+            if fcntl is not None:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+            os.close(self._fd)
+            self._fd = None
+        self._thread_lock.release()
+
+    def read_value(self) -> str:
+        """Чтение небольшого значения, хранимого в самом файле блокировки (только под блокировкой)"""
+        os.lseek(self._fd, 0, os.SEEK_SET)
+        return os.read(self._fd, 64).decode('ascii', 'ignore').strip()
+
+    def write_value(self, value: str):
+        """Запись значения в файл блокировки (только под блокировкой)"""
+        os.lseek(self._fd, 0, os.SEEK_SET)
+        os.ftruncate(self._fd, 0)
+        os.write(self._fd, value.encode('ascii'))
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.release()
+
+
+class SharedState:
+    """Общее для всех воркеров хранилище настроек на SQLite.
+
+    Значения хранятся в JSON. Каждый процесс держит копию в памяти и
+    перечитывает её, только когда PRAGMA data_version показывает, что
+    другой процесс зафиксировал изменения; сама проверка выполняется не
+    чаще раза в SHARED_STATE_REFRESH секунд. В одном процессе изменять
+    копию некому: файл читается один раз и создаётся только при первой
+    записи (например, сохранённых настроек моделей).
+    """
+
+    def __init__(self, path: Optional[str] = None, refresh: float = SHARED_STATE_REFRESH):
+        self.path = path or os.environ.get("SHARED_STATE_PATH", "shared_state.db")
+        self.refresh = refresh
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+        self._pid = None
+        self._cache: Dict[str, Any] = {}
+        self._data_version = None
+        self._checked = 0.0
+        self._checked_pid = None
+
+    def _connection(self) -> sqlite3.Connection:
+        # Соединение не наследуется от родительского процесса после fork
+        if self._conn is None or self._pid != os.getpid():
+            self._conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False, isolation_level=None)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("CREATE TABLE IF NOT EXISTS state (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+            self._pid = os.getpid()
+            self._data_version = None
+        return self._conn
+
+    def _refresh(self):
+        shared = is_shared_mode()
+        now = time.monotonic()
+        if self._checked_pid == os.getpid():
+            # В одном процессе копия в памяти всегда актуальна
+            if not shared or now - self._checked < self.refresh:
+                return
+        self._checked_pid = os.getpid()
+        self._checked = now
+        if not shared and not os.path.exists(self.path):
+            # Ничего не сохранено: файл не нужен до первой записи
+            return
+        conn = self._connection()
+        version = conn.execute("PRAGMA data_version").fetchone()[0]
+        if version != self._data_version:
+            self._cache = {key: json.loads(value) for key, value in conn.execute("SELECT key, value FROM state")}
+            self._data_version = version
+
+    def get(self, key: str, default: Any = None) -> Any:
+        with self._lock:
+            try:
+                self._refresh()
+            except sqlite3.Error as e:
+                logger.error(f"Ошибка чтения общего состояния: {e}")
+            return self._cache.get(key, default)
+
+    def set(self, key: str, value: Any):
+        with self._lock:
+            self._connection().execute(
+                "INSERT INTO state (key, value) VALUES (?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+                (key, json.dumps(value, ensure_ascii=False))
+            )
+            # Собственная запись не меняет data_version этого соединения
+            self._cache[key] = value
+
+    def increment(self, key: str) -> int:
+        """Атомарное увеличение счётчика (например, поколения настроек)"""
+        with self._lock:
+            conn = self._connection()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = conn.execute("SELECT value FROM state WHERE key = ?", (key,)).fetchone()
+                value = (json.loads(row[0]) if row else 0) + 1
+                conn.execute(
+                    "INSERT INTO state (key, value) VALUES (?, ?) "
+                    "ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+                    (key, json.dumps(value))
+                )
+                conn.execute("COMMIT")
+            except sqlite3.Error:
+                conn.execute("ROLLBACK")
+                raise
+            self._cache[key] = value
+            return value
+
+
+# Глобальный экземпляр
+shared_state = SharedState()
@@ -104,9 +104,12 @@ function generateCode() {
                 headers: {
                     'Content-Type': 'application/json'
                 },
+                // Детерминированный запрос: повторная отправка того же кода берётся из кэша
                 body: JSON.stringify({
                     model: currentModel,
-                    prompt: finalPrompt
+                    prompt: finalPrompt,
+                    options: { temperature: 0 },
+                    cache: true
                 })
             })
             .then(response => response.json())
@@ -119,22 +119,35 @@ async function initializeInterface() {
     await loadLogs();
 }
 
-// Загрузка логов
+// Курсор последней полученной записи лога
+let logsCursor = null;
+
+// Загрузка логов (после первой загрузки запрашиваются только новые записи)
 async function loadLogs() {
     try {
-        const response = await fetch('/api/ollama/logs');
+        const url = logsCursor === null
+            ? '/api/ollama/logs'
+            : `/api/ollama/logs?since=${logsCursor}&order=desc`;
+        const response = await fetch(url);
         const logs = await response.json();
 
         const logsContainer = document.querySelector('#logs-container');
         if (!logsContainer) return;
 
-        logsContainer.innerHTML = logs.map(log => `
+        const html = logs.map(log => `
             <div class="log-entry log-${log.status}">
                 <span class="log-timestamp">${new Date(log.timestamp).toLocaleString()}</span>
                 <span class="log-action">${log.action}</span>
                 <span class="log-details">${log.details}</span>
             </div>
         `).join('');
+
+        if (logsCursor === null) {
+            logsContainer.innerHTML = html;
+        } else {
+            logsContainer.insertAdjacentHTML('afterbegin', html);
+        }
+        logsCursor = response.headers.get('X-Log-Cursor') || logsCursor;
     } catch (error) {
         console.error('Ошибка при загрузке логов:', error);
         showNotification('Ошибка', 'Не удалось загрузить логи', 'error');
@@ -214,6 +227,14 @@ function setupEventListeners() {
         saveCurrentFile();
     });
     
+    // Листание большого файла
+    document.querySelector('#btn-file-prev-page').addEventListener('click', function() {
+        openFilePage(-1);
+    });
+    document.querySelector('#btn-file-next-page').addEventListener('click', function() {
+        openFilePage(1);
+    });
+    
     // Кнопка открытия кода программы
     document.querySelector('#btn-view-self-code').addEventListener('click', function() {
         loadSelfCode();
@@ -505,8 +526,6 @@ function selectModel(modelName) {
 
 // Загрузка новой модели
 function pullModel(modelName) {
-    showLoader('#models-container');
-    
     fetch('/api/ollama/pull', {
         method: 'POST',
         headers: {
@@ -518,22 +537,48 @@ function pullModel(modelName) {
     .then(data => {
         if (data.error) {
             showNotification('Ошибка', data.error, 'error');
-        } else {
-            showNotification('Загрузка модели', data.message, 'info');
-            
-            // Через некоторое время обновляем список моделей
-            setTimeout(() => {
-                loadModels();
-            }, 5000);
+            return;
         }
+
+        showNotification('Загрузка модели', data.message, 'info');
+        watchPullJob(data.job_id, modelName);
     })
     .catch(error => {
         console.error('Ошибка при загрузке модели:', error);
         showNotification('Ошибка', `Не удалось загрузить модель: ${error.message}`, 'error');
-        hideLoader('#models-container');
     });
 }
 
+// Отслеживание прогресса фоновой загрузки модели
+function watchPullJob(jobId, modelName) {
+    const events = new EventSource(`/api/ollama/pull/jobs/${jobId}/events`);
+    let lastPercent = null;
+
+    events.onmessage = event => {
+        const job = JSON.parse(event.data);
+
+        if (job.percent !== null && job.percent !== lastPercent) {
+            lastPercent = job.percent;
+            console.log(`Загрузка модели ${modelName}: ${job.percent}%`);
+        }
+
+        if (job.status === 'success') {
+            events.close();
+            showNotification('Загрузка модели', `Модель ${modelName} загружена`, 'success');
+            loadModels();
+        } else if (job.status === 'error') {
+            events.close();
+            showNotification('Ошибка', job.error || `Не удалось загрузить модель ${modelName}`, 'error');
+        } else if (job.status === 'cancelled') {
+            events.close();
+            showNotification('Загрузка модели', `Загрузка модели ${modelName} отменена`, 'warning');
+        }
+    };
+
+    // Поток закрывается сервером после завершения задачи; переподключение не нужно
+    events.onerror = () => events.close();
+}
+
 // Отправка запроса в модель
 function sendPromptToModel() {
     const prompt = document.querySelector('#prompt-input').value.trim();
@@ -553,6 +598,7 @@ function sendPromptToModel() {
     const responseContainer = document.querySelector('#model-response');
     responseContainer.innerHTML = '<div class="text-center py-5"><div class="spinner"></div><p class="mt-3">Генерация ответа...</p></div>';
     
+    // Ответ приходит потоком NDJSON: текст выводится по мере генерации
     fetch('/api/ollama/generate', {
         method: 'POST',
         headers: {
@@ -560,25 +606,58 @@ function sendPromptToModel() {
         },
         body: JSON.stringify({
             model: model,
-            prompt: prompt
+            prompt: prompt,
+            stream: true
         })
     })
-    .then(response => response.json())
-    .then(data => {
-        if (data.error) {
-            responseContainer.innerHTML = `<div class="alert alert-danger">${data.error}</div>`;
-        } else {
-            // Форматирование ответа
-            const response = data.response || '';
-            responseContainer.innerHTML = `<pre class="model-response-text">${escapeHtml(response)}</pre>`;
+    .then(async response => {
+        if (!response.ok) {
+            const data = await response.json();
+            throw new Error(data.error || `Код ответа ${response.status}`);
         }
+
+        let text = '';
+        responseContainer.innerHTML = '<pre class="model-response-text"></pre>';
+        const output = responseContainer.querySelector('pre');
+
+        await readNdjsonStream(response, chunk => {
+            if (chunk.error) {
+                throw new Error(chunk.error);
+            }
+            text += chunk.response || '';
+            output.textContent = text;
+        });
     })
     .catch(error => {
         console.error('Ошибка при отправке запроса:', error);
-        responseContainer.innerHTML = `<div class="alert alert-danger">Ошибка при отправке запроса: ${error.message}</div>`;
+        responseContainer.innerHTML = `<div class="alert alert-danger">Ошибка при отправке запроса: ${escapeHtml(error.message)}</div>`;
     });
 }
 
+// Чтение потока NDJSON: onChunk вызывается для каждого JSON-объекта
+async function readNdjsonStream(response, onChunk) {
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+
+    while (true) {
+        const { value, done } = await reader.read();
+        if (done) break;
+
+        buffer += decoder.decode(value, { stream: true });
+        const lines = buffer.split('\n');
+        buffer = lines.pop();
+        for (const line of lines) {
+            if (line.trim()) {
+                onChunk(JSON.parse(line));
+            }
+        }
+    }
+    if (buffer.trim()) {
+        onChunk(JSON.parse(buffer));
+    }
+}
+
 // Загрузка списка файлов проекта
 function loadSelfCode() {
     // Показываем содержимое проводника (может быть скрыто)
@@ -698,11 +777,19 @@ function loadSelfCode() {
         });
 }
 
-// Открытие файла в редакторе
-function openFile(path) {
+// Открытая страница большого файла (null — файл открыт целиком)
+let currentFilePage = null;
+
+// Открытие файла в редакторе; startLine — первая строка страницы большого файла
+function openFile(path, startLine) {
     showLoader('#editor-container');
     
-    fetch(`/api/file/read?path=${encodeURIComponent(path)}`)
+    let url = `/api/file/read?path=${encodeURIComponent(path)}`;
+    if (startLine && currentFilePage) {
+        url += `&start_line=${startLine}&end_line=${startLine + currentFilePage.pageLines - 1}`;
+    }
+    
+    fetch(url)
         .then(response => response.json())
         .then(data => {
             if (data.error) {
@@ -730,8 +817,35 @@ function openFile(path) {
             document.querySelector('#current-file-name').textContent = path;
             document.querySelector('#current-file-badge').style.display = 'inline-block';
             
+            // Большой файл открыт частично: сохранение перезаписало бы его одной страницей
+            window.editorInstance.setOption('readOnly', Boolean(data.truncated));
+            const pager = document.querySelector('#file-pager');
+            if (data.truncated) {
+                const firstPage = !currentFilePage || currentFilePage.path !== path;
+                currentFilePage = {
+                    path: path,
+                    startLine: data.start_line,
+                    endLine: data.end_line,
+                    totalLines: data.total_lines,
+                    pageLines: data.page_lines
+                };
+                document.querySelector('#file-page-info').textContent =
+                    `Строки ${data.start_line}–${data.end_line} из ${data.total_lines}`;
+                document.querySelector('#btn-file-prev-page').disabled = data.start_line <= 1;
+                document.querySelector('#btn-file-next-page').disabled = data.end_line >= data.total_lines;
+                pager.style.display = 'block';
+                if (firstPage) {
+                    showNotification('Внимание',
+                        `Файл слишком большой: он открыт по ${data.page_lines} строк, редактирование отключено`,
+                        'warning');
+                }
+            } else {
+                currentFilePage = null;
+                pager.style.display = 'none';
+            }
+            
             // Активируем кнопку сохранения
-            document.querySelector('#btn-save-file').disabled = false;
+            document.querySelector('#btn-save-file').disabled = Boolean(data.truncated);
             
             hideLoader('#editor-container');
         })
@@ -742,6 +856,18 @@ function openFile(path) {
         });
 }
 
+// Переход к соседней странице большого файла
+function openFilePage(direction) {
+    if (!currentFilePage) {
+        return;
+    }
+    const startLine = Math.max(1, currentFilePage.startLine + direction * currentFilePage.pageLines);
+    if (startLine > currentFilePage.totalLines) {
+        return;
+    }
+    openFile(currentFilePage.path, startLine);
+}
+
 // Сохранение текущего файла
 function saveCurrentFile() {
     const path = document.querySelector('#current-file-path').value;
@@ -752,6 +878,12 @@ function saveCurrentFile() {
         return;
     }
     
+    // Страница большого файла: запись заменила бы весь файл этой страницей
+    if (currentFilePage) {
+        showNotification('Ошибка', 'Файл открыт частично, сохранение недоступно', 'error');
+        return;
+    }
+    
     // Запрашиваем подтверждение перед сохранением
     Swal.fire({
         title: 'Подтверждение',
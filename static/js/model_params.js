@@ -3,6 +3,7 @@ class ModelParamsManager {
     constructor() {
         this.currentModel = null;
         this.settings = {};
+        this.keepAlive = null;
     }
 
     async loadSettings(modelName) {
@@ -10,7 +11,9 @@ class ModelParamsManager {
             const response = await fetch(`/api/model-params/settings/${modelName}`);
             if (!response.ok) throw new Error('Ошибка при загрузке настроек');
             
-            this.settings = await response.json();
+            const data = await response.json();
+            this.settings = data.options || {};
+            this.keepAlive = data.keep_alive;
             this.currentModel = modelName;
             this.renderSettings();
         } catch (error) {
@@ -24,15 +27,18 @@ class ModelParamsManager {
             const response = await fetch(`/api/model-params/settings/${this.currentModel}`, {
                 method: 'POST',
                 headers: { 'Content-Type': 'application/json' },
-                body: JSON.stringify(this.settings)
+                body: JSON.stringify({ options: this.settings, keep_alive: this.keepAlive })
             });
 
-            if (!response.ok) throw new Error('Ошибка при сохранении настроек');
+            if (!response.ok) {
+                const data = await response.json().catch(() => ({}));
+                throw new Error(data.error || 'Ошибка при сохранении настроек');
+            }
             
             showNotification('Успех', 'Настройки модели сохранены', 'success');
         } catch (error) {
             console.error('Ошибка:', error);
-            showNotification('Ошибка', 'Не удалось сохранить настройки', 'error');
+            showNotification('Ошибка', `Не удалось сохранить настройки: ${error.message}`, 'error');
         }
     }
 
@@ -46,32 +52,60 @@ class ModelParamsManager {
                 <div class="param-group">
                     <label>Temperature:</label>
                     <input type="range" min="0" max="1" step="0.1" 
-                           value="${this.settings.temperature}"
+                           value="${this.settings.temperature ?? 0.8}"
                            onchange="modelParamsManager.updateParam('temperature', this.value)">
-                    <span>${this.settings.temperature}</span>
+                    <span>${this.settings.temperature ?? 'по умолчанию'}</span>
                 </div>
                 <div class="param-group">
                     <label>Top P:</label>
                     <input type="range" min="0" max="1" step="0.1" 
-                           value="${this.settings.top_p}"
+                           value="${this.settings.top_p ?? 0.9}"
                            onchange="modelParamsManager.updateParam('top_p', this.value)">
-                    <span>${this.settings.top_p}</span>
+                    <span>${this.settings.top_p ?? 'по умолчанию'}</span>
                 </div>
                 <div class="param-group">
                     <label>Max Tokens:</label>
                     <input type="number" min="1" max="4096" 
-                           value="${this.settings.max_tokens}"
-                           onchange="modelParamsManager.updateParam('max_tokens', this.value)">
+                           value="${this.settings.num_predict ?? ''}"
+                           onchange="modelParamsManager.updateParam('num_predict', this.value)">
+                </div>
+                ${this.renderNumber('num_ctx', 'Размер контекста (num_ctx)')}
+                ${this.renderNumber('num_thread', 'Потоки CPU (num_thread)')}
+                ${this.renderNumber('num_batch', 'Размер пакета (num_batch)')}
+                ${this.renderNumber('num_gpu', 'Слои на GPU (num_gpu)')}
+                <div class="param-group">
+                    <label>Keep alive:</label>
+                    <input type="text" placeholder="5m, 1h, -1"
+                           value="${this.keepAlive ?? ''}"
+                           onchange="modelParamsManager.setKeepAlive(this.value)">
                 </div>
                 <button onclick="modelParamsManager.saveSettings()">Сохранить настройки</button>
             </div>
         `;
     }
 
+    renderNumber(param, label) {
+        return `
+            <div class="param-group">
+                <label>${label}:</label>
+                <input type="number" min="0" placeholder="по умолчанию"
+                       value="${this.settings[param] ?? ''}"
+                       onchange="modelParamsManager.updateParam('${param}', this.value)">
+            </div>
+        `;
+    }
+
     updateParam(param, value) {
-        this.settings[param] = parseFloat(value);
+        // Пустое поле возвращает значение Ollama по умолчанию
+        this.settings[param] = value === '' ? null : parseFloat(value);
         this.renderSettings();
     }
+
+    setKeepAlive(value) {
+        // Число без единицы (-1, 0, 300) Ollama принимает только как число секунд, "5m" — как строку
+        const trimmed = value.trim();
+        this.keepAlive = trimmed === '' ? null : (/^-?\d+$/.test(trimmed) ? Number(trimmed) : trimmed);
+    }
 }
 
 // Инициализация менеджера параметров
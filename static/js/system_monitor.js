@@ -316,13 +316,92 @@ function initializeSystemMonitor(containerId) {
                 <p class="mt-2">Загрузка информации о системе...</p>
             </div>
         </div>
+        <div id="inference-metrics-container" class="mt-3"></div>
     `;
     
     // Загружаем информацию о системе
     loadSystemInfo();
+    loadInferenceMetrics();
     
     // Настраиваем автообновление каждые 10 секунд
     window.systemMonitorInterval = setInterval(() => {
         loadSystemInfo();
+        loadInferenceMetrics();
     }, 10000);
-}
\ No newline at end of file
+}
+
+// Загрузка метрик производительности моделей
+function loadInferenceMetrics() {
+    fetch('/api/ollama/metrics')
+        .then(response => response.json())
+        .then(data => {
+            if (data.error) {
+                console.error('Ошибка при загрузке метрик моделей:', data.error);
+                return;
+            }
+
+            updateInferenceMetricsUI(data);
+        })
+        .catch(error => {
+            console.error('Ошибка при загрузке метрик моделей:', error);
+        });
+}
+
+// Обновление панели производительности моделей
+function updateInferenceMetricsUI(data) {
+    const metricsContainer = document.getElementById('inference-metrics-container');
+    if (!metricsContainer) return;
+
+    // Медиана и 99-й перцентиль метрики
+    const formatMetric = (metric, unit) => {
+        if (!metric || !metric.count) return '—';
+        return `${metric.p50} / ${metric.p99} ${unit}`;
+    };
+
+    const models = Object.entries(data.models || {});
+    let rows = '';
+    models
+        .sort((a, b) => ((b[1].tokens_per_sec || {}).p50 || 0) - ((a[1].tokens_per_sec || {}).p50 || 0))
+        .forEach(([name, metrics]) => {
+            rows += `
+                <tr>
+                    <td>${name}</td>
+                    <td>${(metrics.total_ms || {}).count || 0}</td>
+                    <td>${formatMetric(metrics.tokens_per_sec, 'ток/с')}</td>
+                    <td>${formatMetric(metrics.ttft_ms, 'мс')}</td>
+                    <td>${formatMetric(metrics.load_ms, 'мс')}</td>
+                    <td>${formatMetric(metrics.queue_wait_ms, 'мс')}</td>
+                </tr>
+            `;
+        });
+
+    metricsContainer.innerHTML = `
+        <div class="mb-4">
+            <h5><i class="fas fa-tachometer-alt me-2"></i>Производительность моделей</h5>
+            <div class="card neo-card mb-3">
+                <div class="card-body">
+                    <p class="text-muted small mb-2">
+                        Медиана / 99-й перцентиль за последние ${Math.round(data.window / 60)} мин
+                    </p>
+                    ${models.length ? `
+                        <div class="table-responsive">
+                            <table class="table table-sm">
+                                <thead>
+                                    <tr>
+                                        <th>Модель</th>
+                                        <th>Запросов</th>
+                                        <th>Скорость</th>
+                                        <th>Первый токен</th>
+                                        <th>Загрузка</th>
+                                        <th>Очередь</th>
+                                    </tr>
+                                </thead>
+                                <tbody>${rows}</tbody>
+                            </table>
+                        </div>
+                    ` : '<p class="mb-0">Запросов к моделям пока не было</p>'}
+                </div>
+            </div>
+        </div>
+    `;
+}
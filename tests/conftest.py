@@ -0,0 +1,13 @@
+import os
+import sys
+import tempfile
+
+# Корень проекта в пути импорта, как при запуске приложения из него
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+
+def pytest_sessionstart(session):
+    # Глобальные экземпляры (журнал логов, общее состояние, кэши) создают файлы в текущем каталоге,
+    # а модули приложения импортируются при сборе тестов, уже после этого хука
+    os.chdir(tempfile.mkdtemp(prefix="tests_"))
@@ -0,0 +1,198 @@
+import pytest
+import requests
+
+from controllers import ollama_backends
+from controllers.ollama_backends import BackendPool
+
+URLS = ["http://a:11434", "http://b:11434"]
+
+
+@pytest.fixture
+def pool(monkeypatch):
+    monkeypatch.setattr(ollama_backends, "BREAKER_THRESHOLD", 2)
+    monkeypatch.setattr(ollama_backends, "BREAKER_COOLDOWN", 5.0)
+    monkeypatch.setattr(ollama_backends, "BREAKER_MAX_COOLDOWN", 30.0)
+    monkeypatch.setattr(BackendPool, "urls", property(lambda self: URLS))
+    pool = BackendPool()
+    # Фоновая проверка обращалась бы к несуществующим серверам и меняла состояние
+    monkeypatch.setattr(pool, "_ensure_prober", lambda: None)
+    pool.notified = []
+    pool.on_change(pool.notified.append)
+    return pool
+
+
+def _backend(pool, url=URLS[0]):
+    return next(backend for backend in pool.backends() if backend.url == url)
+
+
+def _expire_cooldown(backend):
+    backend.opened_at -= backend.cooldown
+    if backend.trial_started is not None:
+        backend.trial_started -= backend.cooldown
+
+
+def test_opens_after_threshold(pool):
+    backend = _backend(pool)
+    pool.mark_failed(backend, OSError("refused"))
+    assert (backend.state, backend.healthy) == ("closed", True)
+
+    pool.mark_failed(backend, OSError("refused"))
+    assert (backend.state, backend.healthy) == ("open", False)
+    assert backend.last_error == "refused"
+    assert 4.5 <= backend.retry_after() <= 5.0
+    assert pool.notified[-1] == 1
+
+
+def test_success_resets_failure_count(pool):
+    backend = _backend(pool)
+    pool.mark_failed(backend, OSError("refused"))
+    pool.record_success(backend)
+    pool.mark_failed(backend, OSError("refused"))
+    assert backend.state == "closed"
+
+
+def test_immediate_failure_opens_at_once(pool):
+    backend = _backend(pool)
+    pool.mark_failed(backend, OSError("probe failed"), immediate=True)
+    assert backend.state == "open"
+
+
+def test_open_admits_one_trial_after_cooldown(pool):
+    backend = _backend(pool)
+    pool.mark_failed(backend, OSError("refused"), immediate=True)
+    assert not pool.admit(backend)
+
+    _expire_cooldown(backend)
+    assert pool.admit(backend)
+    assert backend.state == "half_open"
+    # Пока пробный запрос не завершился, остальные не пропускаются
+    assert not pool.admit(backend)
+
+    # Зависший пробный запрос не блокирует сервер навсегда
+    _expire_cooldown(backend)
+    assert pool.admit(backend)
+
+
+def test_failed_trial_doubles_cooldown_up_to_max(pool):
+    backend = _backend(pool)
+    pool.mark_failed(backend, OSError("refused"), immediate=True)
+    cooldowns = []
+    for _ in range(4):
+        _expire_cooldown(backend)
+        assert pool.admit(backend)
+        pool.mark_failed(backend, OSError("refused"))
+        assert backend.state == "open"
+        cooldowns.append(backend.cooldown)
+    assert cooldowns == [10.0, 20.0, 30.0, 30.0]
+
+
+def test_successful_trial_closes(pool):
+    backend = _backend(pool)
+    pool.mark_failed(backend, OSError("refused"), immediate=True)
+    _expire_cooldown(backend)
+    pool.admit(backend)
+    pool.mark_failed(backend, OSError("refused"))
+    _expire_cooldown(backend)
+    pool.admit(backend)
+
+    pool.record_success(backend)
+    assert (backend.state, backend.healthy, backend.last_error) == ("closed", True, None)
+    assert backend.cooldown == 5.0
+    assert backend.retry_after() is None
+    assert pool.notified[-1] == 2
+
+
+def test_choose_skips_open_backends(pool):
+    pool.mark_failed(_backend(pool, URLS[0]), OSError("refused"), immediate=True)
+    assert {pool.choose().url for _ in range(20)} == {URLS[1]}
+
+
+def test_choose_prefers_requested_backend(pool):
+    assert all(pool.choose(prefer=URLS[1]).url == URLS[1] for _ in range(20))
+    pool.mark_failed(_backend(pool, URLS[1]), OSError("refused"), immediate=True)
+    assert pool.choose(prefer=URLS[1]).url == URLS[0]
+
+
+def test_choose_prefers_loaded_then_installed_model(pool):
+    first, second = _backend(pool, URLS[0]), _backend(pool, URLS[1])
+    first.available = {"llama3:latest"}
+    assert pool.choose("llama3").url == URLS[0]
+    second.loaded = {"llama3:latest"}
+    assert pool.choose("llama3").url == URLS[1]
+
+
+def test_choose_balances_by_outstanding(pool):
+    pool.acquire(_backend(pool, URLS[0]))
+    assert pool.choose().url == URLS[1]
+    pool.release(_backend(pool, URLS[0]))
+    pool.acquire(_backend(pool, URLS[1]))
+    assert pool.choose().url == URLS[0]
+
+
+def test_choose_excludes_tried_backends(pool):
+    assert pool.choose(exclude=[URLS[0]]).url == URLS[1]
+    assert pool.choose(exclude=URLS) is None
+
+
+def test_all_open_fails_fast_until_cooldown(pool):
+    first, second = _backend(pool, URLS[0]), _backend(pool, URLS[1])
+    pool.mark_failed(first, OSError("refused"), immediate=True)
+    pool.mark_failed(second, OSError("refused"), immediate=True)
+    assert pool.choose() is None
+    error = pool.unavailable()
+    assert error.retry_after == 5
+
+    _expire_cooldown(second)
+    trial = pool.choose()
+    assert trial is second
+    assert trial.state == "half_open"
+    assert pool.choose() is None
+
+
+class _Response:
+    def __init__(self, payload, status_code=200):
+        self.payload = payload
+        self.status_code = status_code
+
+    def json(self):
+        return self.payload
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.HTTPError(str(self.status_code))
+
+
+class _Session:
+    def __init__(self, responses):
+        self.responses = responses
+
+    def get(self, url, timeout=None):
+        response = self.responses[url.rsplit("/api/", 1)[1]]
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+
+def test_probe_updates_models_and_closes(pool):
+    backend = _backend(pool)
+    pool.mark_failed(backend, OSError("refused"), immediate=True)
+    pool._session = _Session({
+        "version": _Response({"version": "0.5.0"}),
+        "ps": _Response({"models": [{"name": "llama3", "size": 1, "expires_at": "2100-01-01T00:00:00Z"}]}),
+        "tags": _Response({"models": [{"name": "llama3:latest"}, {"model": "qwen2:7b"}]}),
+    })
+    pool.probe(backend)
+
+    assert backend.state == "closed"
+    assert backend.version == "0.5.0"
+    assert backend.loaded == {"llama3:latest"}
+    assert backend.resident["llama3:latest"]["expires_at"] == "2100-01-01T00:00:00Z"
+    assert backend.available == {"llama3:latest", "qwen2:7b"}
+
+
+def test_failed_probe_opens(pool):
+    backend = _backend(pool)
+    pool._session = _Session({"version": requests.ConnectionError("refused")})
+    pool.probe(backend)
+    assert backend.state == "open"
+    assert backend.last_probe is not None
@@ -0,0 +1,114 @@
+import pytest
+from flask import Flask
+
+from controllers import file_controller
+from controllers.file_controller import file_bp
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    monkeypatch.setattr(file_controller, "BASE_DIR", str(tmp_path))
+    app = Flask(__name__)
+    app.register_blueprint(file_bp)
+    return app.test_client()
+
+
+@pytest.fixture
+def data(tmp_path):
+    content = b"".join(b"line %03d\n" % i for i in range(1, 101))
+    (tmp_path / "file.txt").write_bytes(content)
+    return content
+
+
+def _read(client, headers=None, **params):
+    return client.get("/api/file/read", query_string=dict(params, path="file.txt"), headers=headers or {})
+
+
+def test_raw_whole_file(client, data):
+    response = _read(client, raw=1)
+    assert response.status_code == 200
+    assert response.data == data
+    assert response.headers["Accept-Ranges"] == "bytes"
+    assert response.headers["ETag"]
+
+
+def test_raw_byte_range(client, data):
+    response = _read(client, {"Range": "bytes=9-26"}, raw=1)
+    assert response.status_code == 206
+    assert response.data == data[9:27]
+    assert response.headers["Content-Range"] == f"bytes 9-26/{len(data)}"
+    assert response.headers["Content-Length"] == "18"
+
+
+def test_raw_suffix_and_open_ranges(client, data):
+    response = _read(client, {"Range": "bytes=-9"}, raw=1)
+    assert response.status_code == 206
+    assert response.data == b"line 100\n"
+
+    response = _read(client, {"Range": f"bytes={len(data) - 4}-"}, raw=1)
+    assert response.status_code == 206
+    assert response.data == data[-4:]
+
+
+def test_raw_unsatisfiable_range(client, data):
+    response = _read(client, {"Range": f"bytes={len(data) + 10}-"}, raw=1)
+    assert response.status_code == 416
+    assert response.headers["Content-Range"] == f"bytes */{len(data)}"
+
+
+def test_raw_if_none_match(client, data):
+    etag = _read(client, raw=1).headers["ETag"]
+    assert _read(client, {"If-None-Match": etag}, raw=1).status_code == 304
+
+
+def test_raw_if_range_with_stale_etag_sends_whole_file(client, data):
+    response = _read(client, {"Range": "bytes=0-9", "If-Range": '"stale"'}, raw=1)
+    assert response.status_code == 200
+    assert response.data == data
+
+
+def test_raw_line_range(client, data):
+    response = _read(client, raw=1, start_line=10, end_line=12)
+    assert response.status_code == 200
+    assert response.data == b"line 010\nline 011\nline 012\n"
+    assert response.headers["X-Total-Lines"] == "100"
+    assert (response.headers["X-Start-Line"], response.headers["X-End-Line"]) == ("10", "12")
+
+
+def test_json_line_range_is_truncated(client, data):
+    body = _read(client, start_line=99).get_json()
+    assert body["content"] == "line 099\nline 100\n"
+    assert (body["start_line"], body["end_line"], body["total_lines"]) == (99, 100, 100)
+    assert body["truncated"] is True
+
+    body = _read(client, start_line=1, end_line=500).get_json()
+    assert body["truncated"] is False
+    assert body["end_line"] == 100
+
+
+def test_large_file_returns_first_page(client, data, monkeypatch):
+    monkeypatch.setattr(file_controller, "FILE_READ_JSON_LIMIT", 100)
+    monkeypatch.setattr(file_controller, "FILE_READ_PAGE_LINES", 5)
+    body = _read(client).get_json()
+    assert body["content"] == data[:45].decode()
+    assert body["truncated"] is True
+    assert body["page_lines"] == 5
+
+
+def test_invalid_line_number(client, data):
+    assert _read(client, start_line=0).status_code == 400
+    assert _read(client, start_line="abc").status_code == 400
+
+
+def test_path_outside_base_dir(client, data):
+    response = client.get("/api/file/read", query_string={"path": "../outside.txt", "raw": 1})
+    assert response.status_code == 403
+
+
+def test_unsatisfiable_range_through_app():
+    # Глобальный обработчик ошибок приложения не должен превращать 416 в 500
+    from app import app
+
+    response = app.test_client().get("/api/file/read", query_string={"path": "app.py", "raw": 1},
+                                      headers={"Range": "bytes=100000000-"})
+    assert response.status_code == 416
@@ -0,0 +1,160 @@
+import os
+
+import pytest
+
+from controllers import line_index as line_index_module
+from controllers.line_index import LineIndexCache
+
+
+@pytest.fixture(autouse=True)
+def small_steps(monkeypatch):
+    # Маленькие шаг индекса и блок чтения, чтобы опорные точки и границы блоков попадали внутрь строк
+    monkeypatch.setattr(line_index_module, "LINE_INDEX_STEP", 3)
+    monkeypatch.setattr(line_index_module, "CHUNK_SIZE", 7)
+
+
+def _write(path, data: bytes, mode="wb", mtime_ns=None):
+    with open(path, mode) as f:
+        f.write(data)
+    if mtime_ns is not None:
+        os.utime(path, ns=(mtime_ns, mtime_ns))
+
+
+def _expected(data: bytes, start_line: int, end_line: int) -> bytes:
+    return b"".join(data.splitlines(keepends=True)[start_line - 1:end_line])
+
+
+def _read(cache, path, start_line, end_line):
+    start, end, index = cache.line_range(str(path), start_line, end_line)
+    with open(path, "rb") as f:
+        f.seek(start)
+        return f.read(end - start), index
+
+
+def _lines(count, first=1):
+    return b"".join(f"строка {i} {'x' * (i % 5)}\n".encode() for i in range(first, first + count))
+
+
+def test_line_range_matches_splitlines(tmp_path):
+    path = tmp_path / "file.txt"
+    data = _lines(20)
+    _write(path, data)
+    cache = LineIndexCache()
+
+    for start_line in range(1, 22):
+        for end_line in range(start_line, 22):
+            content, index = _read(cache, path, start_line, end_line)
+            assert content == _expected(data, start_line, end_line)
+    assert index.total_lines == 20
+    assert cache.builds == 1
+
+
+def test_line_range_without_trailing_newline(tmp_path):
+    path = tmp_path / "file.txt"
+    data = b"first\nsecond\nlast"
+    _write(path, data)
+    cache = LineIndexCache()
+
+    content, index = _read(cache, path, 2, None)
+    assert content == b"second\nlast"
+    assert index.total_lines == 3
+
+
+def test_empty_file(tmp_path):
+    path = tmp_path / "empty.txt"
+    _write(path, b"")
+    assert LineIndexCache().line_range(str(path), 1, 10)[:2] == (0, 0)
+
+
+def test_unchanged_file_is_a_hit(tmp_path):
+    path = tmp_path / "file.txt"
+    _write(path, _lines(10))
+    cache = LineIndexCache()
+    first = cache.get(str(path))
+    assert cache.get(str(path)) is first
+    assert (cache.builds, cache.hits) == (1, 1)
+
+
+def test_appended_file_extends_index(tmp_path):
+    path = tmp_path / "log.txt"
+    data = _lines(10)
+    _write(path, data, mtime_ns=1_000_000_000)
+    cache = LineIndexCache()
+    cache.get(str(path))
+
+    appended = _lines(15, first=11)
+    _write(path, appended, mode="ab", mtime_ns=2_000_000_000)
+    data += appended
+
+    content, index = _read(cache, path, 1, None)
+    assert content == data
+    assert index.total_lines == 25
+    assert (cache.builds, cache.extends) == (1, 1)
+    for start_line in range(1, 26):
+        assert _read(cache, path, start_line, start_line + 4)[0] == _expected(data, start_line, start_line + 4)
+
+
+def test_append_continues_unterminated_line(tmp_path):
+    path = tmp_path / "log.txt"
+    _write(path, b"one\ntw", mtime_ns=1_000_000_000)
+    cache = LineIndexCache()
+    assert cache.get(str(path)).total_lines == 2
+
+    _write(path, b"o\nthree\n", mode="ab", mtime_ns=2_000_000_000)
+    content, index = _read(cache, path, 2, 3)
+    assert content == b"two\nthree\n"
+    assert index.total_lines == 3
+    assert cache.extends == 1
+
+
+def test_rewritten_file_is_rebuilt(tmp_path):
+    path = tmp_path / "file.txt"
+    _write(path, _lines(10), mtime_ns=1_000_000_000)
+    cache = LineIndexCache()
+    cache.get(str(path))
+
+    # Файл стал длиннее, но индексированная часть изменилась: дописыванием это не считается
+    data = b"\n".join(b"other %d" % i for i in range(30)) + b"\n"
+    _write(path, data, mtime_ns=2_000_000_000)
+    content, index = _read(cache, path, 5, 9)
+    assert content == _expected(data, 5, 9)
+    assert index.total_lines == 30
+    assert (cache.builds, cache.extends) == (2, 0)
+
+
+def test_truncated_file_is_rebuilt(tmp_path):
+    path = tmp_path / "file.txt"
+    _write(path, _lines(20), mtime_ns=1_000_000_000)
+    cache = LineIndexCache()
+    cache.get(str(path))
+
+    data = _lines(4)
+    _write(path, data, mtime_ns=2_000_000_000)
+    content, index = _read(cache, path, 1, None)
+    assert content == data
+    assert index.total_lines == 4
+    assert cache.builds == 2
+
+
+def test_cache_evicts_least_recently_used(tmp_path):
+    cache = LineIndexCache(max_files=2)
+    paths = [str(tmp_path / f"{name}.txt") for name in "abc"]
+    for path in paths:
+        _write(path, _lines(3))
+    cache.get(paths[0])
+    cache.get(paths[1])
+    cache.get(paths[0])
+    cache.get(paths[2])
+
+    assert cache.stats()["files"] == 2
+    cache.get(paths[1])
+    assert cache.builds == 4
+
+
+def test_iter_bytes_streams_range(tmp_path):
+    path = tmp_path / "file.bin"
+    data = bytes(range(256)) * 10
+    _write(path, data)
+    chunks = list(LineIndexCache.iter_bytes(str(path), 100, 2000, chunk_size=300))
+    assert b"".join(chunks) == data[100:2000]
+    assert max(len(chunk) for chunk in chunks) == 300
@@ -0,0 +1,144 @@
+import gzip
+import json
+import os
+
+from log_storage import LogJournal
+
+
+def _record(seq, action="test", status="info", timestamp="2025-01-01T00:00:00"):
+    return {"seq": seq, "action": action, "details": f"запись {seq}", "status": status, "timestamp": timestamp}
+
+
+def _journal(tmp_path, **kwargs):
+    kwargs.setdefault("max_age", None)
+    return LogJournal(str(tmp_path / "logs.jsonl"), **kwargs)
+
+
+def test_append_reports_rotation_by_entries(tmp_path):
+    journal = _journal(tmp_path, max_entries=3)
+    assert not journal.append([_record(1), _record(2)])
+    assert journal.append([_record(3)])
+
+
+def test_append_reports_rotation_by_size(tmp_path):
+    journal = _journal(tmp_path, max_bytes=200)
+    assert not journal.append([_record(1)])
+    assert journal.append([_record(2), _record(3)])
+
+
+def test_rotate_moves_records_to_segment(tmp_path):
+    journal = _journal(tmp_path, max_entries=3)
+    journal.append([_record(seq) for seq in range(1, 4)])
+    journal.rotate()
+
+    assert os.path.getsize(journal.path) == 0
+    assert journal.last_archived_seq == 3
+    segment = journal.segments[0]
+    assert (segment["first_seq"], segment["last_seq"], segment["count"]) == (1, 3, 3)
+    with gzip.open(os.path.join(journal.archive_dir, segment["file"]), "rb") as f:
+        assert [json.loads(line)["seq"] for line in f] == [1, 2, 3]
+    with open(os.path.join(journal.archive_dir, LogJournal.MANIFEST), encoding="utf-8") as f:
+        assert json.load(f) == journal.segments
+
+
+def test_rotate_drops_expired_segments(tmp_path):
+    journal = _journal(tmp_path, max_entries=2, max_segments=2)
+    for first in (1, 3, 5):
+        journal.append([_record(first), _record(first + 1)])
+        journal.rotate()
+
+    assert [segment["first_seq"] for segment in journal.segments] == [3, 5]
+    assert sorted(os.listdir(journal.archive_dir)) == sorted(
+        [segment["file"] for segment in journal.segments] + [LogJournal.MANIFEST]
+    )
+
+
+def test_load_recent_fills_window_from_segments(tmp_path):
+    journal = _journal(tmp_path, max_entries=3)
+    journal.append([_record(seq) for seq in range(1, 4)])
+    journal.rotate()
+    journal.append([_record(4)])
+    journal.close()
+
+    reopened = _journal(tmp_path, max_entries=3)
+    assert [record["seq"] for record in reopened.load_recent(3)] == [2, 3, 4]
+    assert reopened.last_seq() == 4
+
+
+def test_load_truncates_torn_last_line(tmp_path):
+    journal = _journal(tmp_path)
+    journal.append([_record(1), _record(2)])
+    journal.close()
+    with open(journal.path, "ab") as f:
+        f.write(b'{"seq": 3, "act')
+
+    reopened = _journal(tmp_path)
+    assert [record["seq"] for record in reopened.load()] == [1, 2]
+    reopened.append([_record(3)])
+    reopened.close()
+    assert [record["seq"] for record in _journal(tmp_path).load()] == [1, 2, 3]
+
+
+def test_load_skips_records_already_archived(tmp_path):
+    journal = _journal(tmp_path, max_entries=2)
+    journal.append([_record(1), _record(2)])
+    journal.rotate()
+    # Сбой между записью сегмента и очисткой журнала: записи остались в активном файле
+    with open(journal.path, "wb") as f:
+        f.write(b"".join(LogJournal._encode(_record(seq)) for seq in (1, 2, 3)))
+
+    assert [record["seq"] for record in _journal(tmp_path, max_entries=2).load()] == [3]
+
+
+def test_query_filters_archive(tmp_path):
+    journal = _journal(tmp_path, max_entries=4)
+    journal.append([
+        _record(1, status="error", timestamp="2025-01-01T00:00:01"),
+        _record(2, timestamp="2025-01-01T00:00:02"),
+        _record(3, status="error", timestamp="2025-01-01T00:00:03"),
+        _record(4, timestamp="2025-01-01T00:00:04"),
+    ])
+    journal.rotate()
+
+    assert [record["seq"] for record in journal.query(status="error")] == [3, 1]
+    assert [record["seq"] for record in journal.query(start="2025-01-01T00:00:02", end="2025-01-01T00:00:03",
+                                                      newest_first=False)] == [2, 3]
+    assert [record["seq"] for record in journal.query(before_seq=3, limit=1)] == [2]
+
+
+def test_follow_reads_records_of_other_writers(tmp_path):
+    reader = _journal(tmp_path)
+    reader.load()
+    writer = _journal(tmp_path)
+    writer.append([_record(1), _record(2)])
+
+    assert [record["seq"] for record in reader.follow(0)] == [1, 2]
+    assert reader.follow(2) == []
+    writer.append([_record(3)])
+    assert [record["seq"] for record in reader.follow(2)] == [3]
+
+
+def test_follow_waits_for_complete_line(tmp_path):
+    reader = _journal(tmp_path)
+    reader.load()
+    line = LogJournal._encode(_record(1))
+    with open(reader.path, "ab") as f:
+        f.write(line[:10])
+    assert reader.follow(0) == []
+    with open(reader.path, "ab") as f:
+        f.write(line[10:])
+    assert [record["seq"] for record in reader.follow(0)] == [1]
+
+
+def test_follow_across_rotation(tmp_path):
+    reader = _journal(tmp_path, max_entries=3)
+    reader.load()
+    writer = _journal(tmp_path, max_entries=3)
+    writer.append([_record(1)])
+    assert [record["seq"] for record in reader.follow(0)] == [1]
+
+    # Записи 2 и 3 попали в сегмент до того, как читатель их увидел
+    writer.append([_record(2), _record(3)])
+    writer.rotate()
+    writer.append([_record(4)])
+    assert [record["seq"] for record in reader.follow(1)] == [2, 3, 4]